@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+""" Throughput of independent lookups through the asynchronous interface (asyncstore.py),
+    for several numbers of worker threads, compared to the same lookups done one after the
+    other with a single store. The results of both are checked to be identical, as well as the
+    records given by get, find and map. """
+
+import os
+import time
+import json
+import argparse
+import tempfile
+from cp3_llbb.SAMADhi.SAMADhi import DbStore, Sample, Dataset
+from cp3_llbb.SAMADhi.synthetic import create_synthetic_catalog
+from cp3_llbb.SAMADhi.asyncstore import AsyncDbStore, asyncio, to_record
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Measure the throughput of concurrent lookups with the asynchronous interface.')
+
+    parser.add_argument('-d', '--database', dest='database', help='Database URI. By default, a temporary SQLite database is filled with a synthetic catalog.')
+    parser.add_argument('--samples', type=int, default=5000, dest='nsamples', help='Number of synthetic samples')
+    parser.add_argument('-n', '--lookups', type=int, default=2000, dest='lookups', help='Number of lookups')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4, 8], dest='workers', help='Numbers of worker threads to try')
+    parser.add_argument('-o', '--output', default='async_throughput.json', dest='output', help='Output JSON file')
+
+    return parser.parse_args()
+
+def lookup(store, name):
+    """one lookup: a sample by name and its source dataset"""
+    sample = store.find(Sample, Sample.name == name).one()
+    dataset = sample.source_dataset
+    return to_record(sample), None if dataset is None else to_record(dataset)
+
+def run_sequential(database, names):
+    store = DbStore(uri=database)
+    start = time.time()
+    results = [ lookup(store, name) for name in names ]
+    elapsed = time.time()-start
+    store.close()
+    return elapsed, results
+
+def check_queries(loop, database, names):
+    """get, find and map of the asynchronous interface give the same records as the queries on a store"""
+    store = DbStore(uri=database)
+    samples = [ store.find(Sample, Sample.name == name).one() for name in names ]
+    expected = [ to_record(sample) for sample in samples ]
+    store.close()
+    catalog = AsyncDbStore(max_workers=2, uri=database)
+    try:
+        got = loop.run_until_complete(asyncio.gather(*[ catalog.get(Sample, sample.sample_id) for sample in samples ]))
+        found = loop.run_until_complete(asyncio.gather(*[ catalog.find(Sample, Sample.name == name) for name in names ]))
+        mapped = loop.run_until_complete(catalog.map(lambda store, name: to_record(store.find(Sample, Sample.name == name).one()), names, chunk_size=7))
+        missing = loop.run_until_complete(catalog.get(Sample, -1))
+        empty = loop.run_until_complete(catalog.map(lookup, []))
+    finally:
+        catalog.close()
+    if list(got) != expected or list(found) != [ (record,) for record in expected ] or mapped != expected or missing is not None or empty != []:
+        raise RuntimeError("The records given by get, find or map differ from the ones of the store")
+
+def run_concurrent(loop, database, names, workers):
+    catalog = AsyncDbStore(max_workers=workers, uri=database)
+    # open the stores of all workers first
+    loop.run_until_complete(asyncio.gather(*[ catalog.count(Dataset) for i in range(2*workers) ]))
+    start = time.time()
+    results = loop.run_until_complete(asyncio.gather(*[ catalog.run(lookup, name) for name in names ]))
+    elapsed = time.time()-start
+    start = time.time()
+    mapped = loop.run_until_complete(catalog.map(lookup, names))
+    elapsed_map = time.time()-start
+    catalog.close()
+    return elapsed, list(results), elapsed_map, mapped
+
+def main():
+    options = get_options()
+    database = options.database
+    if database is None:
+        database = "sqlite:%s" % os.path.join(tempfile.mkdtemp(prefix="SAMADhi_bench_"), "catalog.db")
+        print("Generating a synthetic catalog in %s" % database)
+        create_synthetic_catalog(DbStore(uri=database), ndatasets=options.nsamples//10, nsamples=options.nsamples,
+                                 nfiles=options.nsamples, nresults=10)
+    store = DbStore(uri=database)
+    names = [ name for name, in store.execute("SELECT name FROM sample ORDER BY sample_id") ]
+    store.close()
+    names = [ names[(i*7919) % len(names)] for i in range(options.lookups) ]
+
+    # an event loop of our own: asyncio.get_event_loop() does not create one any more outside of a coroutine
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    check_queries(loop, database, names[:100])
+    elapsed, reference = run_sequential(database, names)
+    report = { "database" : database.split("@")[-1], "lookups" : len(names), "sequential_per_s" : len(names)/elapsed, "workers" : {} }
+    print("%-20s %10.0f lookups/s" % ("sequential", len(names)/elapsed))
+    print("%-20s %18s %18s" % ("", "one future each", "map"))
+    for workers in options.workers:
+        elapsed, results, elapsed_map, mapped = run_concurrent(loop, database, names, workers)
+        if results != reference or mapped != reference:
+            raise RuntimeError("The concurrent lookups with %d workers differ from the sequential ones" % workers)
+        report["workers"][workers] = { "gather_per_s" : len(names)/elapsed, "map_per_s" : len(names)/elapsed_map }
+        print("%-20s %10.0f lookups/s %10.0f lookups/s" % ("%d workers" % workers, len(names)/elapsed, len(names)/elapsed_map))
+
+    with open(options.output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print("Report written to %s" % options.output)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+""" Throughput of the chunked data backfill of the migrations (the v10 size and modification time
+    of the files), and check that an interrupted migration resumes where it stopped: the migration
+    is interrupted after some chunks, run again, and the filled values are compared to the files. """
+
+import os
+import json
+import time
+import argparse
+import tempfile
+from storm.locals import Store, create_database
+from cp3_llbb.SAMADhi.synthetic import create_synthetic_catalog
+from cp3_llbb.SAMADhi.migrations import MigrationRunner, MIGRATIONS, Backfill
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Measure the migration backfill throughput on SQLite, and check that it resumes after an interruption.')
+
+    parser.add_argument('--files', type=int, default=100000, dest='nfiles', help='Number of synthetic files')
+    parser.add_argument('--disk-files', type=int, default=200, dest='disk_files', help='Number of files written on disk, shared by the entries')
+    parser.add_argument('--chunk-size', type=int, default=5000, dest='chunk_size', help='Number of rows per chunk')
+    parser.add_argument('--interrupt-after', type=int, default=3, dest='interrupt_after', help='Number of chunks done before the interruption')
+    parser.add_argument('-o', '--output', default='migration_backfill.json', dest='output', help='Output JSON file')
+
+    return parser.parse_args()
+
+class Interrupted(Exception):
+    pass
+
+def backfill_step():
+    return [ step for migration in MIGRATIONS if migration.version == 10 for step in migration.steps if isinstance(step, Backfill) ][0]
+
+def run_upgrade(store, chunk_size, interrupt_after=None):
+    """upgrade to the latest version, interrupted after some chunks if given. Returns (interrupted, lower keys of the chunks, time)"""
+    step = backfill_step()
+    fill = step.statement
+    chunks = []
+    def counting(store, lower, upper):
+        if interrupt_after is not None and len(chunks) == interrupt_after:
+            raise Interrupted()
+        chunks.append(lower)
+        fill(store, lower, upper)
+    step.statement = counting
+    start = time.time()
+    try:
+        MigrationRunner(store, chunk_size=chunk_size).upgrade()
+    except Interrupted:
+        store.rollback()
+        return True, chunks, time.time()-start
+    finally:
+        step.statement = fill
+    return False, chunks, time.time()-start
+
+def main():
+    options = get_options()
+    directory = tempfile.mkdtemp(prefix="SAMADhi_bench_")
+    store = Store(create_database("sqlite:%s" % os.path.join(directory, "catalog.db")))
+    print("Generating a synthetic catalog with %d files in %s" % (options.nfiles, directory))
+    create_synthetic_catalog(store, upgrade=False, ndatasets=100, nsamples=1000, nfiles=options.nfiles, nresults=10, stream=None)
+    MigrationRunner(store).upgrade(target=9)
+    # the entries point to files on disk, except one in ten (remote) and one in ten (missing)
+    for i in range(options.disk_files):
+        with open(os.path.join(directory, "f_%d.root" % i), "w") as outfile:
+            outfile.write("x"*i)
+    store.execute("UPDATE file SET pfn = CASE WHEN id % 10 = 0 THEN 'root://remote//f.root' WHEN id % 10 = 1 THEN ? "
+                  "ELSE ? || '/f_' || (id % ?) || '.root' END", (os.path.join(directory, "missing.root"), directory, options.disk_files), noresult=True)
+    store.commit()
+
+    interrupted, first, first_time = run_upgrade(store, options.chunk_size, options.interrupt_after)
+    if not interrupted:
+        raise RuntimeError("The migration was not interrupted (too few chunks)")
+    saved, = store.execute("SELECT last_key FROM schema_migration_progress WHERE version = 10").get_one()
+    version, = store.execute("SELECT MAX(version) FROM schema_version").get_one()
+    if version != 9 or saved <= 0:
+        raise RuntimeError("Unexpected state after the interruption: version %s, last key %s" % (version, saved))
+    interrupted, second, second_time = run_upgrade(store, options.chunk_size)
+    if second[0] != saved:
+        raise RuntimeError("The migration restarted at key %d instead of %d" % (second[0], saved))
+
+    expected = dict((os.path.join(directory, "f_%d.root" % i), i) for i in range(options.disk_files))
+    wrong = 0
+    for pfn, size, mtime in store.execute("SELECT pfn, size, mtime FROM file"):
+        if (size, mtime is not None) != ((expected[pfn], True) if pfn in expected else (None, False)):
+            wrong += 1
+    leftover, = store.execute("SELECT COUNT(*) FROM schema_migration_progress").get_one()
+    version, = store.execute("SELECT MAX(version) FROM schema_version").get_one()
+    if wrong or leftover or version != MIGRATIONS[-1].version:
+        raise RuntimeError("After the resumed migration: %d wrong entries, %d progress rows left, version %s" % (wrong, leftover, version))
+
+    rows = options.nfiles
+    report = { "files" : rows, "chunk_size" : options.chunk_size, "interrupted_after" : len(first), "resumed_at" : saved,
+               "chunks_after_resume" : len(second), "rows_per_s" : rows/(first_time+second_time) }
+    print("%d chunks before the interruption, resumed at id %d with %d chunks: %.0f rows/s" % (
+          len(first), saved, len(second), report["rows_per_s"]))
+    with open(options.output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print("Report written to %s" % options.output)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+""" Time to read the event weight sum and the number of entries of ROOT files with each backend of
+    rootmeta.py (the python reader, without ROOT, and PyROOT), on a local set of test files.
+    The import of each backend is timed separately, in a new interpreter, and the values read by
+    all the backends are checked to be identical. """
+
+import os
+import sys
+import json
+import time
+import glob
+import random
+import argparse
+import tempfile
+import subprocess
+from cp3_llbb.SAMADhi.rootmeta import file_metadata
+
+IMPORTS = { "python" : "import cp3_llbb.SAMADhi.rootmeta", "pyroot" : "import ROOT; ROOT.TFile" }
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Compare the backends reading the event weight sum and the number of entries of ROOT files.')
+
+    parser.add_argument('files', type=str, nargs='*', help='ROOT files (or directories of ROOT files). By default, test files are written with PyROOT in a temporary directory.')
+    parser.add_argument('-n', '--nfiles', type=int, default=200, dest='nfiles', help='Number of test files')
+    parser.add_argument('--entries', type=int, default=1000, dest='entries', help='Number of entries of the trees of the test files')
+    parser.add_argument('--branches', type=int, default=50, dest='branches', help='Number of branches of the trees of the test files')
+    parser.add_argument('-b', '--backends', type=str, nargs='+', default=['python', 'pyroot'], dest='backends', help='Backends to compare')
+    parser.add_argument('-r', '--repeat', type=int, default=3, dest='repeat', help='Number of passes over the files with each backend')
+    parser.add_argument('-o', '--output', default='root_metadata.json', dest='output', help='Output JSON file')
+
+    return parser.parse_args()
+
+def generate(directory, nfiles, nentries, nbranches):
+    """test files like the ones of a sample: an event_weight_sum TParameter<double> and a tree t"""
+    import ROOT
+    from array import array
+    paths = []
+    for i in range(nfiles):
+        path = os.path.join(directory, "output_%d.root" % i)
+        f = ROOT.TFile.Open(path, "RECREATE")
+        ROOT.TParameter("double")("event_weight_sum", random.gauss(nentries, 10.)).Write()
+        tree = ROOT.TTree("t", "t")
+        values = [ array("d", [ 0. ]) for j in range(nbranches) ]
+        for j, value in enumerate(values):
+            tree.Branch("b%d" % j, value, "b%d/D" % j)
+        for k in range(nentries):
+            for value in values:
+                value[0] = random.random()
+            tree.Fill()
+        tree.Write()
+        f.Close()
+        paths.append(path)
+    return paths
+
+def list_files(arguments):
+    paths = []
+    for argument in arguments:
+        if os.path.isdir(argument):
+            paths += sorted(glob.glob(os.path.join(argument, "*.root")))
+        else:
+            paths.append(argument)
+    return paths
+
+def time_import(backend):
+    """import time of a backend in a new interpreter, None if it cannot be imported"""
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        if subprocess.call([ sys.executable, "-c", IMPORTS[backend] ], stderr=devnull) != 0:
+            return None
+    return time.time()-start
+
+def run(paths, backend, repeat):
+    """(values read, best and all times of the passes over the files). A first pass imports the backend and fills the page cache"""
+    values = [ file_metadata(path, backend) for path in paths ]
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        for path in paths:
+            file_metadata(path, backend)
+        times.append(time.time()-start)
+    return values, min(times), times
+
+def main():
+    options = get_options()
+    if options.files:
+        paths = list_files(options.files)
+        if not paths:
+            print("No ROOT files found")
+            return
+    else:
+        directory = tempfile.mkdtemp(prefix="SAMADhi_bench_")
+        print("Writing %d test files in %s" % (options.nfiles, directory))
+        paths = generate(directory, options.nfiles, options.entries, options.branches)
+
+    report = { "files" : len(paths), "size" : sum(os.path.getsize(path) for path in paths), "backends" : {} }
+    reference = None
+    print("%-10s %12s %14s %12s" % ("backend", "import (s)", "per file (ms)", "files/s"))
+    for backend in options.backends:
+        imported = time_import(backend) if backend in IMPORTS else None
+        if backend in IMPORTS and imported is None:
+            print("%-10s %12s" % (backend, "unavailable"))
+            continue
+        values, best, times = run(paths, backend, options.repeat)
+        if reference is None:
+            reference = (backend, values)
+        else:
+            mismatches = [ (path, value, expected) for path, value, expected in zip(paths, values, reference[1]) if value != expected ]
+            if mismatches:
+                raise RuntimeError("%s and %s differ for %d files, e.g. %s: %s and %s" % ((backend, reference[0], len(mismatches))+mismatches[0]))
+        report["backends"][backend] = { "import_s" : imported, "best_s" : best, "times_s" : times,
+                                         "per_file_ms" : 1000.*best/len(paths), "files_per_s" : len(paths)/best }
+        print("%-10s %12s %14.3f %12.0f" % (backend, "-" if imported is None else "%.3f" % imported, 1000.*best/len(paths), len(paths)/best))
+
+    with open(options.output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print("Report written to %s" % options.output)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
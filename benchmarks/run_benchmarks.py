@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+""" End-to-end benchmarks of the main SAMADhi code paths on a (synthetic) catalog.
+    The wall time, number of SQL statements and peak memory of each case are recorded
+    to JSON, so that two versions can be compared (--compare). """
+
+import os
+import sys
+import imp
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from storm.tracer import install_tracer
+from cp3_llbb.SAMADhi.SAMADhi import DbStore, Sample
+from cp3_llbb.SAMADhi.synthetic import create_synthetic_catalog
+from cp3_llbb.SAMADhi import schema
+from cp3_llbb.SAMADhi.normalization import get_normalizations
+from cp3_llbb.SAMADhi.duplicates import find_duplicates
+from cp3_llbb.SAMADhi.tracing import QueryTracer
+
+TOPDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Time the main SAMADhi code paths and record wall time, query count and peak memory to JSON.')
+
+    parser.add_argument('-d', '--database', dest='database', help='Database URI. By default, a temporary SQLite database is filled with a synthetic catalog.')
+    parser.add_argument('--datasets', type=int, default=1000, dest='ndatasets', help='Number of synthetic datasets')
+    parser.add_argument('--samples', type=int, default=10000, dest='nsamples', help='Number of synthetic samples')
+    parser.add_argument('--files', type=int, default=1000000, dest='nfiles', help='Number of synthetic files')
+    parser.add_argument('--results', type=int, default=2000, dest='nresults', help='Number of synthetic results')
+    parser.add_argument('--write', dest='write', action='store_true', help='Also run the cases that modify the database (always done on a copy for SQLite)')
+    parser.add_argument('-k', '--cases', nargs='+', dest='cases', help='Only run these cases')
+    parser.add_argument('-r', '--repeat', type=int, default=1, dest='repeat', help='Number of runs of each case (the fastest one is kept)')
+    parser.add_argument('-l', '--label', dest='label', help='Label of this run (default: git description of the working copy)')
+    parser.add_argument('-o', '--output', default='benchmarks.json', dest='output', help='Output JSON file')
+    parser.add_argument('--compare', dest='compare', help='JSON output of a previous run to compare with')
+
+    options = parser.parse_args()
+
+    if options.label is None:
+        try:
+            options.label = subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=TOPDIR).strip()
+        except (OSError, subprocess.CalledProcessError):
+            options.label = "unknown"
+
+    return options
+
+def load_module(path):
+    """import a script (or example) by path"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    return imp.load_source("bench_"+name, os.path.join(TOPDIR, path))
+
+def run_main(module, *argv):
+    """call the main() of a script with the given command-line arguments"""
+    old_argv = sys.argv
+    sys.argv = [ module.__file__ ] + list(argv)
+    try:
+        module.main()
+    finally:
+        sys.argv = old_argv
+
+class Context(object):
+    """What the cases need: a scratch directory and the options of the dbAnalysis sections"""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.dryRun = True
+        self.DAScrosscheck = False
+        self.path = workdir
+        self.basedir = workdir
+        self.workers = 8
+
+def search(*argv):
+    return lambda context: run_main(load_module("scripts/search_SAMADhi.py"), *argv)
+
+def add_sample(context, name=u"benchmark_sample", nfiles=2000):
+    """register a sample of nfiles files. The interactive parts (confirmation) and
+       the file inspection (ROOT) are replaced, the database part is the real one."""
+    module = load_module("scripts/add_sample.py")
+    module.confirm = lambda *args, **kwargs: True
+    module.get_file_data_ = lambda path: (1000., 1000)
+    files = ",".join(os.path.join(context.workdir, "output_%d.root" % i) for i in range(nfiles))
+    run_main(module, "NTUPLES", context.workdir, "--name", name, "--source_dataset", "1", "--source_sample", "1", "--files", files)
+
+def db_analysis(section):
+    def run(context):
+        module = load_module("scripts/SAMADhi_dbAnalysis.py")
+        getattr(module, section)(DbStore(), context)
+    return run
+
+def sample_luminosities(context):
+    dbstore = DbStore()
+    for sample in dbstore.find(Sample):
+        sample.getLuminosity()
+
+def normalizations(context):
+    """normalization of 500 samples, as done by a plotting job"""
+    dbstore = DbStore()
+    names = [ name for name, in dbstore.execute("SELECT name FROM sample ORDER BY sample_id LIMIT 500") ]
+    get_normalizations(dbstore, names).scale(1000.)
+
+def pat_luminosities(context):
+    load_module("documentation/SAMADhi_examples.py").getPATlumi(u"%")
+
+# name : (function, modifies the database)
+CASES = [
+    ("search_sample_name", search("sample", "-n", "*_PAT_v1*"), False),
+    ("search_sample_path", search("sample", "-p", "/storage/data/cms/store/user/user01/*"), False),
+    ("search_sample_long", search("sample", "-l", "-n", "*_v1??"), False),
+    ("search_dataset_name", search("dataset", "-n", "/DoubleMuon/*"), False),
+    ("search_result_long", search("result", "-l", "-p", "/home/users/user01/*"), False),
+    ("add_sample_new", add_sample, True),
+    ("add_sample_replace", add_sample, True),
+    ("luminosity_samples", sample_luminosities, False),
+    ("luminosity_pat_dictionary", pat_luminosities, False),
+    ("normalization_500_samples", normalizations, False),
+    ("shared_files", lambda context: find_duplicates(DbStore()), False),
+    ] + [ ("dbAnalysis_"+section, db_analysis(section), False) for section in (
+    "collectGeneralStats", "datasetSection", "sampleSection", "resultSection") ]
+
+def _run_case(function, database, workdir, pipe):
+    """ executed in a child process, so that the memory measurement is not polluted by the other cases """
+    os.environ["SAMADHI_DATABASE"] = database
+    sys.stdout = open(os.devnull, "w")
+    tracer = QueryTracer()
+    install_tracer(tracer)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    try:
+        function(Context(workdir))
+    except BaseException as error:
+        pipe.send({ "error" : "%s: %s" % (error.__class__.__name__, error) })
+        return
+    wall = time.time()-start
+    rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pipe.send({ "wall_s" : wall, "queries" : tracer.count(), "peak_rss_kb" : rss_end, "rss_increase_kb" : rss_end-rss_start,
+                "query_loops" : tracer.summary()["loops"][:5] })
+
+def run_case(function, database, workdir):
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_case, args=(function, database, workdir, child))
+    process.start()
+    result = parent.recv() if parent.poll(None) else { "error" : "no result" }
+    process.join()
+    return result
+
+def main():
+    options = get_options()
+    workdir = tempfile.mkdtemp(prefix="SAMADhi_bench_")
+    os.makedirs(os.path.join(workdir, "data"))
+    try:
+        database = options.database
+        if database is None:
+            database = "sqlite:%s" % os.path.join(workdir, "catalog.db")
+            print("Generating a synthetic catalog in %s" % database)
+            create_synthetic_catalog(DbStore(uri=database), ndatasets=options.ndatasets, nsamples=options.nsamples,
+                                     nfiles=options.nfiles, nresults=options.nresults)
+        store = DbStore(uri=database)
+        report = { "label" : options.label, "database" : database.split("@")[-1], "cases" : {},
+                   "sizes" : dict((table, store.execute("SELECT COUNT(*) FROM %s" % table).get_one()[0]) for table in schema.CATALOG_TABLES) }
+        write_database = database
+        if database.startswith("sqlite:"):
+            # the cases modifying the database run on a copy
+            write_database = "sqlite:%s" % os.path.join(workdir, "catalog_write.db")
+            shutil.copy(database[len("sqlite:"):], write_database[len("sqlite:"):])
+        store.close()
+
+        for name, function, modifies in CASES:
+            if options.cases and name not in options.cases:
+                continue
+            if modifies and not (options.write or write_database != database):
+                continue
+            runs = [ run_case(function, write_database if modifies else database, workdir) for i in range(options.repeat) ]
+            valid = [ run for run in runs if "error" not in run ]
+            report["cases"][name] = min(valid, key=lambda run: run["wall_s"]) if valid else runs[0]
+            result = report["cases"][name]
+            if "error" in result:
+                print("%-40s failed: %s" % (name, result["error"]))
+            else:
+                print("%-40s %10.3f s %8d queries %10d kB" % (name, result["wall_s"], result["queries"], result["peak_rss_kb"]))
+    finally:
+        shutil.rmtree(workdir)
+
+    with open(options.output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print("Report written to %s" % options.output)
+
+    if options.compare:
+        with open(options.compare) as infile:
+            reference = json.load(infile)
+        print("\nComparison with %s (%s):" % (options.compare, reference.get("label")))
+        for name in sorted(report["cases"].keys()):
+            new, old = report["cases"][name], reference["cases"].get(name, {})
+            if "wall_s" not in new or "wall_s" not in old:
+                continue
+            print("%-40s time x%6.2f   queries %8d -> %-8d memory x%5.2f" % (name, new["wall_s"]/max(old["wall_s"], 1e-9),
+                  old["queries"], new["queries"], new["peak_rss_kb"]/float(max(old["peak_rss_kb"], 1))))
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
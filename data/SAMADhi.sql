@@ -5,6 +5,9 @@ DROP TABLE IF EXISTS dataset;
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS file;
 DROP TABLE IF EXISTS analysis;
+DROP TABLE IF EXISTS schema_version;
+DROP TABLE IF EXISTS schema_migration_progress;
+DROP TABLE IF EXISTS changelog;
 
 CREATE TABLE  users
 (
@@ -43,7 +46,9 @@ energy float,
 creation_time datetime,
 user_comment text,
 PRIMARY KEY (dataset_id),
-KEY idx_name (name)
+UNIQUE KEY uq_dataset_name (name),
+KEY idx_dataset_process_energy (process, energy),
+KEY idx_dataset_creation_time (creation_time)
 ) ENGINE = INNODB;
 
 CREATE TABLE sample
@@ -66,7 +71,11 @@ creation_time timestamp,
 source_dataset_id int,
 source_sample_id int,
 PRIMARY KEY (sample_id),
-KEY idx_name (name),
+UNIQUE KEY uq_sample_name (name),
+KEY idx_sample_source_dataset (source_dataset_id, sampletype),
+KEY idx_sample_source_sample (source_sample_id),
+KEY idx_sample_path (path),
+KEY idx_sample_creation_time (creation_time),
 FOREIGN KEY (source_dataset_id) REFERENCES dataset(dataset_id),
 FOREIGN KEY (source_sample_id) REFERENCES sample(sample_id)
 ) ENGINE = INNODB;
@@ -82,6 +91,7 @@ analysis_id int NULL,
 elog varchar(255),
 PRIMARY KEY (result_id),
 KEY idx_path (path),
+KEY idx_result_creation_time (creation_time),
 FOREIGN KEY (analysis_id) REFERENCES analysis(analysis_id)
 ) ENGINE = INNODB;
 
@@ -90,6 +100,7 @@ CREATE TABLE sampleresult
 sample_id int NOT NULL,
 result_id int NOT NULL,
 CONSTRAINT SR_ID PRIMARY KEY (sample_id,result_id),
+KEY idx_sampleresult_result (result_id, sample_id),
 FOREIGN KEY (sample_id) REFERENCES sample(sample_id),
 FOREIGN KEY (result_id) REFERENCES result(result_id)
 ) ENGINE = INNODB;
@@ -103,6 +114,55 @@ CREATE TABLE file
     event_weight_sum double,
     extras_event_weight_sum mediumtext,
     nevents BIGINT,
+    size BIGINT,
+    mtime BIGINT,
+    adler32 CHAR(8),
+    xxhash64 CHAR(16),
+    lfn_hash BIGINT AS (CAST(CONV(LEFT(MD5(lfn), 15), 16, 10) AS SIGNED)) VIRTUAL,
     PRIMARY KEY (id),
+    KEY idx_file_sample (sample_id),
+    KEY idx_file_lfn_hash (lfn_hash, sample_id),
     FOREIGN KEY (sample_id) REFERENCES sample(sample_id) ON DELETE CASCADE
 ) ENGINE = INNODB;
+
+CREATE TABLE schema_version
+(
+version int NOT NULL,
+description text,
+applied_on datetime,
+PRIMARY KEY (version)
+) ENGINE = INNODB;
+
+INSERT INTO schema_version (version, description, applied_on)
+VALUES (11, 'initial schema', NOW());
+
+CREATE TABLE schema_migration_progress
+(
+version int NOT NULL,
+step varchar(255) NOT NULL,
+last_key bigint NOT NULL,
+PRIMARY KEY (version, step)
+) ENGINE = INNODB;
+
+CREATE TABLE changelog
+(
+change_id bigint NOT NULL AUTO_INCREMENT,
+tablename varchar(32) NOT NULL,
+row_id bigint NOT NULL,
+operation char(1) NOT NULL,
+changed_on datetime,
+PRIMARY KEY (change_id)
+) ENGINE = INNODB;
+
+CREATE TRIGGER analysis_update_log AFTER UPDATE ON analysis FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'analysis', NEW.analysis_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER analysis_delete_log AFTER DELETE ON analysis FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'analysis', OLD.analysis_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER dataset_update_log AFTER UPDATE ON dataset FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'dataset', NEW.dataset_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER dataset_delete_log AFTER DELETE ON dataset FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'dataset', OLD.dataset_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sample_update_log AFTER UPDATE ON sample FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sample', NEW.sample_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sample_delete_log AFTER DELETE ON sample FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sample', OLD.sample_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER result_update_log AFTER UPDATE ON result FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'result', NEW.result_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER result_delete_log AFTER DELETE ON result FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'result', OLD.result_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER file_update_log AFTER UPDATE ON file FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'file', NEW.id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER file_delete_log AFTER DELETE ON file FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'file', OLD.id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sampleresult_insert_log AFTER INSERT ON sampleresult FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sampleresult', NEW.sample_id, 'I', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sampleresult_delete_log AFTER DELETE ON sampleresult FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sampleresult', OLD.sample_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
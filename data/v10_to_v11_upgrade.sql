@@ -0,0 +1,12 @@
+-- Upgrade SAMADhi from v10 to v11
+-- Record checksums of the files: adler32, as used to verify the grid transfers (xrdadler32, gfal-sum),
+-- and xxhash64, faster, to detect corrupted or replaced files (see python/checksums.py).
+-- The columns are nullable and added in place, without locking the table for writes;
+-- the existing entries get their values from scripts/checksum_files.py.
+
+-- Alter file table
+ALTER TABLE file ADD COLUMN adler32 CHAR(8), ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE file ADD COLUMN xxhash64 CHAR(16), ALGORITHM=INPLACE, LOCK=NONE;
+
+INSERT INTO schema_version (version, description, applied_on)
+VALUES (11, 'checksums of the files, to detect corrupted or replaced files', NOW());
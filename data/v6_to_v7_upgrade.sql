@@ -0,0 +1,53 @@
+-- Upgrade SAMADhi from v6 to v7
+-- Add indexes for the lookups done by the scripts (source dataset/sample, files of a sample,
+-- sample path, dataset process and energy, creation time ordering, results of a sample)
+-- Make dataset and sample names unique (this was only checked by add_sample.py)
+--
+-- The unique indexes cannot be created if there are duplicated names, check first with
+--   SELECT name, COUNT(*) FROM dataset GROUP BY name HAVING COUNT(*) > 1;
+--   SELECT name, COUNT(*) FROM sample GROUP BY name HAVING COUNT(*) > 1;
+-- All indexes are built in place, without locking the tables for writes.
+-- The schema version is recorded from now on (see python/migrations.py), as by scripts/migrate_SAMADhi.py.
+
+-- Alter dataset table
+ALTER TABLE dataset DROP INDEX idx_name, ADD UNIQUE INDEX uq_dataset_name (name), ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE dataset ADD INDEX idx_dataset_process_energy (process, energy), ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE dataset ADD INDEX idx_dataset_creation_time (creation_time), ALGORITHM=INPLACE, LOCK=NONE;
+
+-- Alter sample table
+ALTER TABLE sample DROP INDEX idx_name, ADD UNIQUE INDEX uq_sample_name (name), ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE sample ADD INDEX idx_sample_source_dataset (source_dataset_id, sampletype), ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE sample ADD INDEX idx_sample_source_sample (source_sample_id), ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE sample ADD INDEX idx_sample_path (path), ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE sample ADD INDEX idx_sample_creation_time (creation_time), ALGORITHM=INPLACE, LOCK=NONE;
+
+-- Alter result table
+ALTER TABLE result ADD INDEX idx_result_creation_time (creation_time), ALGORITHM=INPLACE, LOCK=NONE;
+
+-- Alter sampleresult table
+ALTER TABLE sampleresult ADD INDEX idx_sampleresult_result (result_id, sample_id), ALGORITHM=INPLACE, LOCK=NONE;
+
+-- Alter file table
+ALTER TABLE file ADD INDEX idx_file_sample (sample_id), ALGORITHM=INPLACE, LOCK=NONE;
+
+-- Schema version bookkeeping, as created by scripts/migrate_SAMADhi.py
+CREATE TABLE IF NOT EXISTS schema_version
+(
+version int NOT NULL,
+description text,
+applied_on datetime,
+PRIMARY KEY (version)
+) ENGINE = INNODB;
+
+CREATE TABLE IF NOT EXISTS schema_migration_progress
+(
+version int NOT NULL,
+step varchar(255) NOT NULL,
+last_key bigint NOT NULL,
+PRIMARY KEY (version, step)
+) ENGINE = INNODB;
+
+INSERT IGNORE INTO schema_version (version, description, applied_on)
+VALUES (6, 'baseline', NOW());
+INSERT INTO schema_version (version, description, applied_on)
+VALUES (7, 'indexes of the hot query paths, unique dataset and sample names', NOW());
@@ -0,0 +1,33 @@
+-- Upgrade SAMADhi from v7 to v8
+-- Record the updates and deletions in a change log, filled by triggers,
+-- so that local snapshots (see python/snapshot.py) can be synchronized incrementally.
+-- New rows are found from their id, so insertions are only logged for sampleresult.
+-- Logging can be switched off in a session with SET @samadhi_changelog_off = 1;
+-- Old entries can be removed with
+--   DELETE FROM changelog WHERE changed_on < NOW() - INTERVAL 90 DAY;
+
+CREATE TABLE changelog
+(
+change_id bigint NOT NULL AUTO_INCREMENT,
+tablename varchar(32) NOT NULL,
+row_id bigint NOT NULL,
+operation char(1) NOT NULL,
+changed_on datetime,
+PRIMARY KEY (change_id)
+) ENGINE = INNODB;
+
+CREATE TRIGGER analysis_update_log AFTER UPDATE ON analysis FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'analysis', NEW.analysis_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER analysis_delete_log AFTER DELETE ON analysis FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'analysis', OLD.analysis_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER dataset_update_log AFTER UPDATE ON dataset FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'dataset', NEW.dataset_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER dataset_delete_log AFTER DELETE ON dataset FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'dataset', OLD.dataset_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sample_update_log AFTER UPDATE ON sample FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sample', NEW.sample_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sample_delete_log AFTER DELETE ON sample FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sample', OLD.sample_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER result_update_log AFTER UPDATE ON result FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'result', NEW.result_id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER result_delete_log AFTER DELETE ON result FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'result', OLD.result_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER file_update_log AFTER UPDATE ON file FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'file', NEW.id, 'U', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER file_delete_log AFTER DELETE ON file FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'file', OLD.id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sampleresult_insert_log AFTER INSERT ON sampleresult FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sampleresult', NEW.sample_id, 'I', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+CREATE TRIGGER sampleresult_delete_log AFTER DELETE ON sampleresult FOR EACH ROW INSERT INTO changelog (tablename, row_id, operation, changed_on) SELECT 'sampleresult', OLD.sample_id, 'D', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL;
+
+INSERT INTO schema_version (version, description, applied_on)
+VALUES (8, 'change log of updates and deletions, for snapshot synchronization', NOW());
@@ -0,0 +1,12 @@
+-- Upgrade SAMADhi from v8 to v9
+-- Add a hashed lfn to the file table, to find the files registered in several samples
+-- with an index-only GROUP BY (see python/duplicates.py).
+-- It is a virtual generated column: no backfill is needed, and the server keeps it up to date.
+-- Both the column and the index are added in place, without locking the table for writes.
+
+-- Alter file table
+ALTER TABLE file ADD COLUMN lfn_hash BIGINT AS (CAST(CONV(LEFT(MD5(lfn), 15), 16, 10) AS SIGNED)) VIRTUAL, ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE file ADD INDEX idx_file_lfn_hash (lfn_hash, sample_id), ALGORITHM=INPLACE, LOCK=NONE;
+
+INSERT INTO schema_version (version, description, applied_on)
+VALUES (9, 'hashed lfn, to find the files shared by several samples', NOW());
@@ -0,0 +1,14 @@
+-- Upgrade SAMADhi from v9 to v10
+-- Record the size and modification time of the files, so that add_sample.py --resync
+-- only reads again the files that changed on disk (see python/filescan.py).
+-- The columns are nullable and added in place, without locking the table for writes;
+-- the existing entries get their values at the next resync of their sample.
+-- Applied by hand, this script does not fill the size and modification time of the local files
+-- of the existing entries, which the Backfill step of scripts/migrate_SAMADhi.py does.
+
+-- Alter file table
+ALTER TABLE file ADD COLUMN size BIGINT, ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE file ADD COLUMN mtime BIGINT, ALGORITHM=INPLACE, LOCK=NONE;
+
+INSERT INTO schema_version (version, description, applied_on)
+VALUES (10, 'size and modification time of the files, to rescan only the changed files', NOW());
@@ -13,6 +13,14 @@ def getPATlumi(sampletype=u"mc"): # can be u"mc", u"data", u"%"
     dictionary[name]=lumi
   return dictionary
 
+# Example method to get the normalization of many samples at once (one joined query, cached).
+# The columns are NumPy arrays if NumPy is available.
+def getNormalizations(samples, luminosity): # list of names or ids, or a pattern like u"*_PAT_v1"
+  from cp3_llbb.SAMADhi.normalization import get_normalizations
+  dbstore = SAMADhi.DbStore()
+  normalizations = get_normalizations(dbstore, samples)
+  return dict(zip(normalizations.name, normalizations.scale(luminosity)))
+
 # Example method to access a PAT based on the path and access results and dataset
 def getPAT(path=u"%"):
   dbstore = SAMADhi.DbStore()
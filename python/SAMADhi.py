@@ -5,10 +5,30 @@ except ImportError as error:
 
 #db store connection
 
-def DbStore(credentials='~/.samadhi'):
-    """create a database object and returns the db store from STORM"""
+def DbStore(credentials='~/.samadhi', uri=None, trace=None, snapshot=None):
+    """create a database object and returns the db store from STORM.
+       Instead of the credentials file, the database can be given as a URI
+       (e.g. sqlite:/path/to/catalog.db), or in the SAMADHI_DATABASE environment variable.
+       A local snapshot of the catalog (see snapshot.py) is opened in read-only mode
+       if given as snapshot, or in the SAMADHI_SNAPSHOT environment variable.
+       SQL tracing (see tracing.py) is enabled by trace="stderr" or trace="json:/path/to/file",
+       or by the SAMADHI_TRACE environment variable."""
 
     import json, os, stat
+    from . import tracing
+    if trace is not None:
+        tracing.enable(trace)
+    else:
+        tracing.enable_from_environment()
+    if uri is None and snapshot is None:
+        uri = os.environ.get("SAMADHI_DATABASE")
+        if uri is None:
+            snapshot = os.environ.get("SAMADHI_SNAPSHOT")
+    if uri is not None:
+        return Store(create_database(uri))
+    if snapshot is not None:
+        from .snapshot import open_snapshot
+        return open_snapshot(snapshot)
     credentials = os.path.expanduser(credentials)
     if not os.path.exists(credentials):
         raise IOError('Credentials file %r not found.' % credentials)
@@ -29,6 +49,42 @@ def DbStore(credentials='~/.samadhi'):
         db_connection_string = "mysql://%s:%s@%s/%s" % (login, password, hostname, database)
         return Store(create_database(db_connection_string))
 
+def iter_chunks(store, cls, *conditions, **kwargs):
+    """iterate over the objects of a model class matching the conditions, by increasing primary key,
+       reading chunk_size (default 1000) rows at a time. Each chunk starts after the last key of the
+       previous one (keyset pagination, no OFFSET), and the objects of a chunk are removed from the
+       cache of the store when the next one is read, so that a pass over a whole table runs in constant
+       memory (the objects kept by the caller remain usable, and are reloaded when accessed).
+       With columns (a tuple of columns of the class), tuples of their values are given instead."""
+    from storm.info import get_cls_info
+    info = get_cls_info(cls)
+    if len(info.primary_key) != 1:
+        raise ValueError("%s has a composite primary key" % cls.__name__)
+    key = info.primary_key[0]
+    attribute = [ name for name, column in info.attributes.items() if column is key ][0]
+    chunk_size = kwargs.get("chunk_size", 1000)
+    columns = kwargs.get("columns")
+    if columns is None:
+        selected = cls
+    else:
+        # the key is needed to start the next chunk
+        selected = tuple(columns) + (key,)
+    last = None
+    while True:
+        selection = conditions if last is None else conditions+(key > last,)
+        rows = list(store.find(selected, *selection).order_by(key)[:chunk_size])
+        for row in rows:
+            yield row if columns is None else row[:-1]
+        if len(rows) < chunk_size:
+            break
+        if columns is None:
+            last = getattr(rows[-1], attribute)
+            store.flush()
+            for obj in rows:
+                store.invalidate(obj)
+        else:
+            last = rows[-1][-1]
+
 #definition of the DB interface classes 
 
 class Dataset(Storm):
@@ -163,7 +219,7 @@ class Sample(Storm):
         else:
           # for DATA, it can only be obtained from the parent sample
           if self.source_sample is not None:
-            return self.source_sample.luminosity()
+            return self.source_sample.getLuminosity()
     # in all other cases, it is impossible to compute a number.
     return None
 
@@ -264,6 +320,10 @@ class File(Storm):
     event_weight_sum = Float()
     extras_event_weight_sum = Unicode() #  MEDIUMTEXT in MySQL
     nevents = Int()
+    size = Int()  # in bytes, and modification time (seconds since epoch) when registered
+    mtime = Int()
+    adler32 = Unicode()  # checksums (hexadecimal), see checksums.py
+    xxhash64 = Unicode()
 
     sample = Reference(sample_id, "Sample.sample_id")
 
@@ -0,0 +1,180 @@
+"""asyncio-compatible interface to the database.
+   Storm stores are blocking and not thread-safe, so the queries run on a bounded pool of
+   worker threads, each with its own Store (created on first use with DbStore, and closed
+   by the same thread). The methods return asyncio futures, that can be awaited or combined
+   with gather, and resolve to immutable records (named tuples with the columns of the model
+   class), which are safe to use from the event loop, unlike Storm objects bound to a store.
+
+   Example (Python 3):
+     catalog = AsyncDbStore(max_workers=8)
+     samples = await catalog.find(Sample, Sample.name.like(u"TT%"))
+     dataset, parent = await asyncio.gather(catalog.get(Dataset, 12), catalog.get(Sample, 345))
+   With Python 2, trollius and futures provide asyncio and concurrent.futures."""
+
+import threading
+from collections import namedtuple
+from storm.info import get_cls_info
+from .SAMADhi import DbStore
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError as error:
+        raise ImportError("asyncio is needed for the asynchronous interface (with Python 2, please install trollius): {0}".format(error))
+try:
+    from concurrent.futures import Future
+except ImportError as error:
+    raise ImportError("concurrent.futures is needed for the asynchronous interface (with Python 2, please install futures): {0}".format(error))
+
+_record_types = {}
+_record_types_lock = threading.Lock()
+
+def record_type(cls):
+    """named tuple type with the columns of a model class (e.g. SampleRecord for Sample)"""
+    with _record_types_lock:
+        if cls not in _record_types:
+            info = get_cls_info(cls)
+            names = [ name for name, attribute in sorted(info.attributes.items(), key=lambda item: info.columns.index(item[1])) ]
+            _record_types[cls] = namedtuple(cls.__name__+"Record", names)
+        return _record_types[cls]
+
+def to_record(obj):
+    """immutable copy of the columns of a Storm object"""
+    record = record_type(type(obj))
+    return record(*[ getattr(obj, name) for name in record._fields ])
+
+class _Worker(threading.Thread):
+    """Executes the queued calls with its own store"""
+
+    def __init__(self, calls, options):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.calls = calls
+        self.options = options
+
+    def run(self):
+        store = None
+        while True:
+            call = self.calls.get()
+            if call is None:
+                break
+            future, function, args, commit = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if store is None:
+                    store = DbStore(**self.options)
+                result = function(store, *args)
+                # end the transaction: the next query sees the latest data, and nothing stays locked
+                if commit:
+                    store.commit()
+                else:
+                    store.rollback()
+            except BaseException as error:
+                if store is not None:
+                    store.rollback()
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        if store is not None:
+            store.close()
+
+class AsyncDbStore(object):
+    """Runs the database queries on a pool of threads with one store each.
+       The arguments other than max_workers and loop are passed to DbStore."""
+
+    def __init__(self, max_workers=4, loop=None, **options):
+        self.loop = loop
+        self.calls = queue.Queue()
+        self.workers = [ _Worker(self.calls, options) for i in range(max_workers) ]
+        for worker in self.workers:
+            worker.start()
+
+    def _submit(self, function, args, commit=False):
+        if self.workers is None:
+            raise RuntimeError("The asynchronous store is closed")
+        future = Future()
+        self.calls.put((future, function, args, commit))
+        return asyncio.wrap_future(future, loop=self.loop or asyncio.get_event_loop())
+
+    def run(self, function, *args):
+        """run function(store, *args) in a worker, and commit. The result must not contain Storm objects."""
+        return self._submit(function, args, commit=True)
+
+    def map(self, function, items, chunk_size=50):
+        """function(store, item) for each item, the items being split in chunks shared among the workers.
+           Returns a single future with the list of results, in order: for many small lookups,
+           this saves most of the cost of one future per lookup."""
+        items = list(items)
+        def run_chunk(store, chunk):
+            return [ function(store, item) for item in chunk ]
+        chunks = [ self._submit(run_chunk, (items[i:i+chunk_size],)) for i in range(0, len(items), chunk_size) ]
+        result = asyncio.Future(loop=self.loop or asyncio.get_event_loop())
+        if not chunks:
+            result.set_result([])
+            return result
+        def done(gathered):
+            # the caller may have cancelled the result (e.g. after a timeout)
+            if result.done():
+                if not gathered.cancelled():
+                    gathered.exception() # retrieved, not to be logged
+                return
+            if gathered.cancelled():
+                result.cancel()
+            elif gathered.exception() is not None:
+                result.set_exception(gathered.exception())
+            else:
+                result.set_result([ value for chunk in gathered.result() for value in chunk ])
+        # the loop of gather is the one of the chunks (its loop argument was removed in Python 3.10)
+        gathered = asyncio.gather(*chunks)
+        gathered.add_done_callback(done)
+        def cancel(result):
+            # the chunks not started yet are not run
+            if result.cancelled():
+                gathered.cancel()
+        result.add_done_callback(cancel)
+        return result
+
+    def find(self, cls, *args, **kwargs):
+        """records of the objects matching the conditions (as for Store.find).
+           The order_by and limit keyword arguments restrict the result set."""
+        order_by = kwargs.pop("order_by", None)
+        limit = kwargs.pop("limit", None)
+        def find(store):
+            result = store.find(cls, *args, **kwargs)
+            if order_by is not None:
+                result = result.order_by(order_by)
+            if limit is not None:
+                result = result[:limit]
+            return tuple(to_record(obj) for obj in result)
+        return self._submit(find, ())
+
+    def get(self, cls, key):
+        """record of the object with the given primary key, or None"""
+        def get(store):
+            obj = store.get(cls, key)
+            return None if obj is None else to_record(obj)
+        return self._submit(get, ())
+
+    def count(self, cls, *args, **kwargs):
+        return self._submit(lambda store: store.find(cls, *args, **kwargs).count(), ())
+
+    def execute(self, statement, params=None):
+        """rows (tuples) of a raw SQL statement"""
+        return self._submit(lambda store: tuple(tuple(row) for row in store.execute(statement, params)), ())
+
+    def close(self):
+        """wait for the pending queries, and close the stores"""
+        if self.workers is None:
+            return
+        for worker in self.workers:
+            self.calls.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = None
@@ -0,0 +1,182 @@
+"""Set-based updates of the catalog, for maintenance (e.g. the cross-section of a whole campaign).
+   A selection (wildcards on the names, ids, datatype, energy, author, range of creation dates)
+   and the new values of some columns are compiled into UPDATE ... WHERE <key> IN (...) statements
+   on chunks of keys, instead of loading a Storm object per row and assigning its attributes.
+   Only the rows where one of the values differs are selected, so that the counts (and the
+   change log) contain real changes only. preview gives the number of rows to update and the
+   old and new values of the first ones, without writing anything.
+
+   Example:
+     update = BulkUpdate("dataset", { "xsection" : 831.76 }, names=[u"/TT_*"], energy=13.)
+     print(update.preview(dbstore))
+     update.apply(dbstore)
+     dbstore.commit()"""
+
+import datetime
+from storm.locals import Int, Float, Unicode, DateTime
+from storm.info import get_cls_info
+from .SAMADhi import Dataset, Sample, Result, Analysis, File
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+# table: (model class, column matched by the name wildcards)
+TABLES = {
+    "dataset" : (Dataset, "name"),
+    "sample" : (Sample, "name"),
+    "result" : (Result, "path"),
+    "analysis" : (Analysis, "description"),
+    "file" : (File, "lfn"),
+    }
+
+# the tables with a creation time, and with an author
+DATED = ("dataset", "sample", "result")
+AUTHORED = ("sample", "result")
+
+def parse_date(text):
+    """date (YYYY-MM-DD) or date and time (YYYY-MM-DD HH:MM:SS)"""
+    for pattern in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(text, pattern)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: %s (expected YYYY-MM-DD or YYYY-MM-DD HH:MM:SS)" % text)
+
+_CONVERTERS = ((Int, int), (Float, float), (Unicode, unicode), (DateTime, parse_date))
+
+def parse_value(table, column, text):
+    """value of a column given as text (NULL for no value)"""
+    cls = TABLES[table][0]
+    if text == "NULL":
+        return None
+    for kind, convert in _CONVERTERS:
+        if isinstance(cls.__dict__.get(column), kind):
+            return convert(text.decode("utf-8") if kind is Unicode and isinstance(text, str) else text)
+    raise ValueError("Unknown column %s of %s" % (column, table))
+
+class Preview(object):
+    """Number of rows an update would change, and the changes of the first ones"""
+
+    def __init__(self, table, count, rows):
+        self.table = table
+        self.count = count
+        self.rows = rows # (key, name, { column: (stored value, new value) })
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        lines = [ "%d %s rows to update" % (self.count, self.table) ]
+        for key, name, changes in self.rows:
+            lines.append("  #%s %s" % (key, name))
+            lines += [ "    %s: %s -> %s" % (column, old, new) for column, (old, new) in sorted(changes.items()) ]
+        if self.count > len(self.rows):
+            lines.append("  ... and %d more" % (self.count-len(self.rows)))
+        return "\n".join(lines)
+
+class BulkUpdate(object):
+    """New values of some columns (a dictionary) for the rows of a table matching a selection.
+       names are matched with the * and ? wildcards; datatype and energy are those of the dataset
+       (the source dataset for samples); the creation time is in [since, until[."""
+
+    def __init__(self, table, values, names=(), ids=(), datatype=None, energy=None, author=None, since=None, until=None):
+        if table not in TABLES:
+            raise ValueError("Unknown table %s (possible tables: %s)" % (table, ", ".join(sorted(TABLES))))
+        self.table = table
+        cls, self.name_column = TABLES[table]
+        info = get_cls_info(cls)
+        self.key = info.primary_key[0].name
+        if not values:
+            raise ValueError("No value to set")
+        for column in values:
+            if column not in info.attributes or column == self.key:
+                raise ValueError("Column %s of %s cannot be set" % (column, table))
+        self.values = values
+        if datatype is not None or energy is not None:
+            if table not in ("dataset", "sample"):
+                raise ValueError("No datatype and energy for %s" % table)
+        if author is not None and table not in AUTHORED:
+            raise ValueError("No author for %s" % table)
+        if (since is not None or until is not None) and table not in DATED:
+            raise ValueError("No creation time for %s" % table)
+        self.names = [ unicode(name) for name in names ]
+        self.ids = sorted(set(ids))
+        self.datatype, self.energy, self.author, self.since, self.until = datatype, energy, author, since, until
+
+    def where(self):
+        """(condition, parameters) of the rows to update (except the ids)"""
+        clauses, params = [], []
+        if self.names:
+            clauses.append("(%s)" % " OR ".join("%s LIKE ?" % self.name_column for name in self.names))
+            params += [ name.replace('*', '%').replace('?', '_') for name in self.names ]
+        dataset = []
+        if self.datatype is not None:
+            dataset.append(("datatype = ?", unicode(self.datatype)))
+        if self.energy is not None:
+            dataset.append(("energy = ?", float(self.energy)))
+        if dataset and self.table == "sample":
+            clauses.append("source_dataset_id IN (SELECT dataset_id FROM dataset WHERE %s)" % " AND ".join(clause for clause, value in dataset))
+        else:
+            clauses += [ clause for clause, value in dataset ]
+        params += [ value for clause, value in dataset ]
+        if self.author is not None:
+            clauses.append("author = ?")
+            params.append(unicode(self.author))
+        if self.since is not None:
+            clauses.append("creation_time >= ?")
+            params.append(self.since)
+        if self.until is not None:
+            clauses.append("creation_time < ?")
+            params.append(self.until)
+        # only the rows with a different value
+        changed = []
+        for column, value in sorted(self.values.items()):
+            if value is None:
+                changed.append("%s IS NOT NULL" % column)
+            else:
+                changed.append("(%s IS NULL OR %s <> ?)" % (column, column))
+                params.append(value)
+        clauses.append("(%s)" % " OR ".join(changed))
+        return " AND ".join(clauses), params
+
+    def keys(self, store):
+        """keys of the rows to update, in increasing order"""
+        condition, params = self.where()
+        query = "SELECT %s FROM %s WHERE %s" % (self.key, self.table, condition)
+        if not self.ids:
+            return [ key for key, in store.execute(query + " ORDER BY %s" % self.key, params) ]
+        keys = []
+        for i in range(0, len(self.ids), ID_CHUNK):
+            chunk = self.ids[i:i+ID_CHUNK]
+            keys += [ key for key, in store.execute(query + " AND " + _in(self.key, chunk) + " ORDER BY %s" % self.key, params+chunk) ]
+        return keys
+
+    def preview(self, store, limit=10):
+        """the number of rows to update, and the changes of the first limit ones"""
+        keys = self.keys(store)
+        columns = sorted(self.values)
+        rows = []
+        if limit and keys:
+            first = keys[:min(limit, ID_CHUNK)]
+            for row in store.execute("SELECT %s, %s, %s FROM %s WHERE %s ORDER BY %s" % (self.key, self.name_column, ", ".join(columns),
+                                     self.table, _in(self.key, first), self.key), first):
+                rows.append((row[0], row[1], dict((column, (old, self.values[column])) for column, old in zip(columns, row[2:])
+                                                  if old != self.values[column])))
+        return Preview(self.table, len(keys), rows)
+
+    def apply(self, store, chunk_size=ID_CHUNK):
+        """update the selected rows, chunk_size rows per statement. Returns the number of updated rows.
+           Nothing is committed."""
+        columns = sorted(self.values)
+        assignments = ", ".join("%s = ?" % column for column in columns)
+        values = [ self.values[column] for column in columns ]
+        keys = self.keys(store)
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i+chunk_size]
+            store.execute("UPDATE %s SET %s WHERE %s" % (self.table, assignments, _in(self.key, chunk)), values+chunk, noresult=True)
+        # the Storm objects already loaded do not know about the changes
+        store.invalidate()
+        return len(keys)
@@ -0,0 +1,34 @@
+"""In-process caches of query results, keyed on the catalog version (see schema.catalog_version)"""
+
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """Mapping of limited size, the least recently used entries are dropped first.
+       It can be shared between threads."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """value for key, raises KeyError if it is not cached"""
+        with self.lock:
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
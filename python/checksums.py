@@ -0,0 +1,223 @@
+"""Checksums of the registered files (schema v11): adler32, the checksum used to verify the grid
+   transfers (as given by xrdadler32 or gfal-sum), and xxhash64, much faster to compute, to detect
+   corrupted or replaced files. Both are computed in a single pass over each file, read in large
+   chunks; xxhash64 is only computed if the xxhash module is available.
+   ChecksumBackfill fills the missing checksums of the File entries (or, with verify, compares the
+   recorded ones to the files) with a pool of processes, so that the checksums of several files are
+   computed at the same time, and updates the entries in bulk after each chunk.
+   The checksums are also kept in a local cache, by (path, size, modification time), so that
+   the unchanged files are not read again by the next backfill. A verification does not use the
+   cache, since a file corrupted in place can keep its size and modification time, but refreshes it.
+   A file is not checksummed if its size or modification time differ from the ones recorded at its
+   registration: it changed since, and its entry should first be updated (add_sample.py --resync)."""
+
+import os
+import sys
+import zlib
+import time
+from storm.locals import Store, create_database
+from . import schema
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+CHECKSUM_COLUMNS = ("adler32", "xxhash64")
+
+# bytes read at once
+CHUNK_SIZE = 16*1024*1024
+
+HASHED = "hashed"
+CACHED = "cached"
+MISSING = "missing"
+CHANGED = "changed"
+REMOTE = "remote"
+MISMATCH = "mismatch"
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+def _is_local(path):
+    return "://" not in path
+
+def file_checksums(path, chunk_size=CHUNK_SIZE):
+    """(adler32, xxhash64) of a file, as hexadecimal strings (xxhash64 is None without the xxhash module)"""
+    adler = 1
+    digest = None if xxhash is None else xxhash.xxh64()
+    with open(path, "rb") as infile:
+        while True:
+            data = infile.read(chunk_size)
+            if not data:
+                break
+            adler = zlib.adler32(data, adler)
+            if digest is not None:
+                digest.update(data)
+    return (u"%08x" % (adler & 0xffffffff), None if digest is None else unicode(digest.hexdigest()))
+
+def checksum_file(entry):
+    """checksums of one (id, path, registered (size, mtime), cached (size, mtime, adler32, xxhash64) or None) entry.
+       Returns (id, status, size, mtime, adler32, xxhash64)"""
+    file_id, path, registered, cached = entry
+    if not _is_local(path):
+        return (file_id, REMOTE, None, None, None, None)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (file_id, MISSING, None, None, None, None)
+    size, mtime = stat.st_size, int(stat.st_mtime)
+    if None not in registered and tuple(registered) != (size, mtime):
+        return (file_id, CHANGED, size, mtime, None, None)
+    if cached is not None and tuple(cached[:2]) == (size, mtime) and (cached[3] is not None or xxhash is None):
+        return (file_id, CACHED, size, mtime, cached[2], cached[3])
+    try:
+        adler32, xxhash64 = file_checksums(path)
+    except IOError:
+        return (file_id, MISSING, None, None, None, None)
+    # the file was rewritten while it was read
+    stat = os.stat(path)
+    if (stat.st_size, int(stat.st_mtime)) != (size, mtime):
+        return (file_id, CHANGED, size, mtime, None, None)
+    return (file_id, HASHED, size, mtime, adler32, xxhash64)
+
+CACHE_TABLE = """CREATE TABLE IF NOT EXISTS checksum
+(
+path TEXT PRIMARY KEY,
+size BIGINT,
+mtime BIGINT,
+adler32 CHAR(8),
+xxhash64 CHAR(16)
+)"""
+
+class ChecksumCache(object):
+    """checksums of the files already read, by path, with their size and modification time, in a local SQLite file"""
+
+    def __init__(self, path):
+        self.store = Store(create_database("sqlite:%s" % os.path.expanduser(path)))
+        self.store.execute(CACHE_TABLE, noresult=True)
+        self.store.commit()
+
+    def lookup(self, paths):
+        """{ path: (size, mtime, adler32, xxhash64) } of the given paths found in the cache"""
+        paths = list(paths)
+        found = {}
+        for i in range(0, len(paths), ID_CHUNK):
+            chunk = paths[i:i+ID_CHUNK]
+            for path, size, mtime, adler32, xxhash64 in self.store.execute(
+                    "SELECT path, size, mtime, adler32, xxhash64 FROM checksum WHERE %s" % _in("path", chunk), chunk):
+                found[path] = (size, mtime, adler32, xxhash64)
+        return found
+
+    def update(self, rows):
+        """record (path, size, mtime, adler32, xxhash64) rows"""
+        schema.insert_rows(self.store, "checksum", ("path", "size", "mtime")+CHECKSUM_COLUMNS, rows, replace=True)
+        self.store.commit()
+
+    def close(self):
+        self.store.close()
+
+class ChecksumBackfill(object):
+    """Computes the missing checksums of the File entries (or of the entries of some samples) with a pool of processes.
+       With verify, the recorded checksums are also compared to the files, all of them read. The entries are updated after each chunk,
+       and committed unless commit is False (e.g. when the files are checksummed as part of their registration)."""
+
+    def __init__(self, store, cache=None, sample_ids=None, workers=8, verify=False, chunk_size=1000, commit=True, stream=sys.stderr):
+        self.store = store
+        self.cache = cache
+        self.sample_ids = None if sample_ids is None else sorted(sample_ids)
+        self.workers = workers
+        self.verify = verify
+        self.chunk_size = chunk_size
+        self.commit = commit
+        self.stream = stream
+
+    def _sample_chunks(self):
+        if self.sample_ids is None:
+            return [ None ]
+        return [ self.sample_ids[i:i+ID_CHUNK] for i in range(0, len(self.sample_ids), ID_CHUNK) ]
+
+    def _selection(self, sample_ids):
+        """conditions and parameters selecting the entries to read, of some samples (or all of them)"""
+        conditions, params = [], []
+        if not self.verify:
+            conditions.append("(adler32 IS NULL OR xxhash64 IS NULL)" if xxhash is not None else "adler32 IS NULL")
+        if sample_ids is not None:
+            conditions.append(_in("sample_id", sample_ids))
+            params += sample_ids
+        return conditions, params
+
+    def count(self):
+        """number of entries to read"""
+        total = 0
+        for sample_ids in self._sample_chunks():
+            conditions, params = self._selection(sample_ids)
+            total += self.store.execute("SELECT COUNT(*) FROM file%s" % ("" if not conditions else " WHERE "+" AND ".join(conditions)),
+                                        params).get_one()[0]
+        return total
+
+    def iter_chunks(self):
+        """(id, pfn, size, mtime, adler32, xxhash64) of the entries to read, by chunks of increasing ids"""
+        for sample_ids in self._sample_chunks():
+            conditions, params = self._selection(sample_ids)
+            last_id = 0
+            while True:
+                rows = self.store.execute("SELECT id, pfn, size, mtime, adler32, xxhash64 FROM file WHERE %s ORDER BY id LIMIT %d" % (
+                                          " AND ".join([ "id > ?" ]+conditions), self.chunk_size), [ last_id ]+params).get_all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                yield rows
+
+    def run(self):
+        """read the files and update the entries. Returns a summary: the counts per status, the number of updated
+           entries, the number of bytes read, the time spent and the problems (missing and changed files, mismatches)"""
+        from multiprocessing import Pool
+        summary = { "counts" : {}, "updated" : 0, "bytes" : 0, "elapsed_s" : 0., "problems" : [] }
+        total = self.count()
+        if total == 0:
+            return summary
+        pool = Pool(self.workers)
+        start, last_report, done = time.time(), time.time(), 0
+        try:
+            for rows in self.iter_chunks():
+                entries = dict((row[0], row) for row in rows)
+                # a verification reads all the files: a file corrupted in place keeps its size and modification time
+                cached = {} if self.cache is None or self.verify else self.cache.lookup(row[1] for row in rows)
+                jobs = [ (file_id, pfn, (size, mtime), cached.get(pfn)) for file_id, pfn, size, mtime, adler32, xxhash64 in rows ]
+                updates, hashed = [], []
+                for file_id, status, size, mtime, adler32, xxhash64 in pool.imap_unordered(checksum_file, jobs):
+                    pfn, recorded, computed = entries[file_id][1], tuple(entries[file_id][4:]), (adler32, xxhash64)
+                    if status == HASHED:
+                        hashed.append((pfn, size, mtime)+computed)
+                        summary["bytes"] += size
+                    if status in (HASHED, CACHED):
+                        if any(old is not None and new is not None and old != new for old, new in zip(recorded, computed)):
+                            status = MISMATCH
+                        else:
+                            # the recorded checksums are kept, the missing ones are filled
+                            values = tuple(new if old is None else old for old, new in zip(recorded, computed))
+                            if values != recorded:
+                                updates.append((file_id,)+values)
+                    summary["counts"][status] = summary["counts"].get(status, 0)+1
+                    if status in (MISSING, CHANGED, MISMATCH):
+                        summary["problems"].append({ "id" : file_id, "pfn" : pfn, "status" : status,
+                                                     "recorded" : list(recorded), "computed" : list(computed) })
+                if hashed and self.cache is not None:
+                    self.cache.update(hashed)
+                summary["updated"] += schema.update_rows(self.store, "file", "id", CHECKSUM_COLUMNS, updates)
+                if self.commit:
+                    self.store.commit()
+                done += len(rows)
+                if time.time()-last_report > 10.:
+                    last_report = time.time()
+                    elapsed = time.time()-start
+                    self.stream.write("  %d/%d files (%.0f MB/s, %.0f s left)\n" % (
+                                      done, total, summary["bytes"]/1e6/elapsed, elapsed*max(total-done, 0)/done))
+                    self.stream.flush()
+        finally:
+            pool.terminate()
+        summary["elapsed_s"] = time.time()-start
+        return summary
@@ -0,0 +1,168 @@
+"""Columnar export of the catalog, for analytics without queries to the database server.
+   Each table (dataset, sample, file, result, sampleresult, analysis), and a denormalized view
+   of the samples (with the columns of their dataset and the totals of their files), is written
+   to a compressed Parquet file (or an Arrow IPC file, which can be memory-mapped without copy),
+   chunk by chunk so that the memory does not grow with the size of the tables. A manifest
+   (catalog.json) gives the format, the catalog version and the number of rows of each table.
+   pyarrow is needed (pyarrow 0.16 is the last version for Python 2).
+
+   Example:
+     export_catalog(dbstore, "/data/samadhi-export")
+     tables = load_catalog("/data/samadhi-export")
+     samples = tables["sample_view"].to_pandas()
+     samples.groupby(["energy", "author"]).nevents.sum()"""
+
+import os
+import sys
+import json
+import time
+import datetime
+from storm.locals import Int, Float, Unicode, DateTime
+from storm.expr import LeftJoin
+from .SAMADhi import Analysis, Dataset, Sample, File, Result, iter_chunks
+from .reports import layout
+from . import schema
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError as error:
+    raise ImportError("pyarrow is needed for the columnar export of the catalog: {0}".format(error))
+
+MANIFEST = "catalog.json"
+
+FORMATS = { "parquet" : ".parquet", "arrow" : ".arrow" }
+
+# tables exported from their model class
+CLASSES = [ ("analysis", Analysis), ("dataset", Dataset), ("sample", Sample), ("result", Result), ("file", File) ]
+
+_ARROW_TYPES = ((Int, pyarrow.int64()), (Float, pyarrow.float64()), (Unicode, pyarrow.string()), (DateTime, pyarrow.timestamp("s")))
+
+def arrow_schema(cls):
+    """schema of the table of a model class"""
+    names, columns = layout(cls)
+    fields = []
+    for name in names:
+        kind = [ arrow_type for prop, arrow_type in _ARROW_TYPES if isinstance(cls.__dict__[name], prop) ][0]
+        fields.append(pyarrow.field(name, kind))
+    return pyarrow.schema(fields)
+
+SAMPLERESULT_SCHEMA = pyarrow.schema([ pyarrow.field("sample_id", pyarrow.int64()), pyarrow.field("result_id", pyarrow.int64()) ])
+
+# denormalized samples: the main columns of the sample and its dataset, and the totals of its files
+SAMPLE_VIEW = (Sample.sample_id, Sample.name, Sample.sampletype, Sample.author, Sample.creation_time, Sample.nevents_processed,
+               Sample.nevents, Sample.normalization, Sample.event_weight_sum, Sample.luminosity, Sample.code_version,
+               Sample.source_dataset_id, Sample.source_sample_id, Dataset.name, Dataset.process, Dataset.xsection,
+               Dataset.datatype, Dataset.energy, Dataset.cmssw_release, Dataset.globaltag)
+
+SAMPLE_VIEW_FILES = """SELECT sample_id, COUNT(*), SUM(nevents), SUM(event_weight_sum), SUM(size) FROM file
+WHERE sample_id BETWEEN ? AND ? GROUP BY sample_id"""
+
+SAMPLE_VIEW_SCHEMA = pyarrow.schema([ pyarrow.field(name, kind) for name, kind in (
+    ("sample_id", pyarrow.int64()), ("name", pyarrow.string()), ("sampletype", pyarrow.string()), ("author", pyarrow.string()),
+    ("creation_time", pyarrow.timestamp("s")), ("nevents_processed", pyarrow.int64()), ("nevents", pyarrow.int64()),
+    ("normalization", pyarrow.float64()), ("event_weight_sum", pyarrow.float64()), ("luminosity", pyarrow.float64()),
+    ("code_version", pyarrow.string()), ("source_dataset_id", pyarrow.int64()), ("source_sample_id", pyarrow.int64()),
+    ("dataset_name", pyarrow.string()), ("process", pyarrow.string()), ("xsection", pyarrow.float64()),
+    ("datatype", pyarrow.string()), ("energy", pyarrow.float64()), ("cmssw_release", pyarrow.string()), ("globaltag", pyarrow.string()),
+    ("nfiles", pyarrow.int64()), ("files_nevents", pyarrow.int64()), ("files_event_weight_sum", pyarrow.float64()), ("files_size", pyarrow.int64())) ])
+
+def _sample_view_chunks(store, chunk_size):
+    joined = store.using(Sample, LeftJoin(Dataset, Dataset.dataset_id == Sample.source_dataset_id))
+    last = 0
+    while True:
+        rows = list(joined.find(SAMPLE_VIEW, Sample.sample_id > last).order_by(Sample.sample_id)[:chunk_size])
+        if not rows:
+            break
+        # SUM gives a decimal on MySQL
+        files = dict((row[0], (row[1], None if row[2] is None else int(row[2]), None if row[3] is None else float(row[3]),
+                               None if row[4] is None else int(row[4])))
+                     for row in store.execute(SAMPLE_VIEW_FILES, (rows[0][0], rows[-1][0])))
+        yield [ tuple(row)+files.get(row[0], (0, None, None, None)) for row in rows ]
+        if len(rows) < chunk_size:
+            break
+        last = rows[-1][0]
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _table_chunks(store, name, chunk_size):
+    """(schema, iterator over lists of rows) of an exported table"""
+    if name == "sample_view":
+        return SAMPLE_VIEW_SCHEMA, _sample_view_chunks(store, chunk_size)
+    if name == "sampleresult":
+        return SAMPLERESULT_SCHEMA, _chunks(store.execute("SELECT sample_id, result_id FROM sampleresult ORDER BY result_id, sample_id"), chunk_size)
+    cls = dict(CLASSES)[name]
+    return arrow_schema(cls), _chunks(iter_chunks(store, cls, columns=layout(cls)[1], chunk_size=chunk_size), chunk_size)
+
+TABLES = [ name for name, cls in CLASSES ] + [ "sampleresult", "sample_view" ]
+
+def _batch(arrow_schema, rows):
+    columns = zip(*rows)
+    return pyarrow.RecordBatch.from_arrays([ pyarrow.array(list(values), type=field.type) for field, values in zip(arrow_schema, columns) ],
+                                           [ field.name for field in arrow_schema ])
+
+def export_table(store, name, path, fmt="parquet", compression="snappy", chunk_size=50000):
+    """write a table (or the sample view) to a file, chunk_size rows at a time. Returns the number of rows"""
+    arrow_schema, chunks = _table_chunks(store, name, chunk_size)
+    temporary = path+".tmp"
+    count = 0
+    if fmt == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(temporary, arrow_schema, compression=compression)
+    else:
+        writer = pyarrow.RecordBatchFileWriter(temporary, arrow_schema)
+    try:
+        for rows in chunks:
+            batch = _batch(arrow_schema, rows)
+            if fmt == "parquet":
+                writer.write_table(pyarrow.Table.from_batches([ batch ]))
+            else:
+                writer.write_batch(batch)
+            count += len(rows)
+    except:
+        writer.close()
+        os.remove(temporary)
+        raise
+    writer.close()
+    os.rename(temporary, path)
+    return count
+
+def export_catalog(store, directory, tables=TABLES, fmt="parquet", compression="snappy", chunk_size=50000, stream=sys.stderr):
+    """write the tables to a directory, with the manifest"""
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format %s (possible formats: %s)" % (fmt, ", ".join(sorted(FORMATS))))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    manifest = { "format" : fmt, "version" : schema.catalog_version(store), "exported_on" : str(datetime.datetime.now()), "tables" : {} }
+    for name in tables:
+        start = time.time()
+        filename = name+FORMATS[fmt]
+        count = export_table(store, name, os.path.join(directory, filename), fmt, compression, chunk_size)
+        manifest["tables"][name] = { "file" : filename, "rows" : count }
+        stream.write("%s: %d rows in %.1f s\n" % (name, count, time.time()-start))
+    with open(os.path.join(directory, MANIFEST), "w") as output:
+        json.dump(manifest, output, indent=1, sort_keys=True)
+    return manifest
+
+def load_catalog(directory, tables=None):
+    """dictionary of pyarrow Tables, read from the memory-mapped files of an export (all of them, or the given tables)"""
+    with open(os.path.join(directory, MANIFEST)) as infile:
+        manifest = json.load(infile)
+    loaded = {}
+    for name, entry in manifest["tables"].items():
+        if tables is not None and name not in tables:
+            continue
+        path = os.path.join(directory, entry["file"])
+        if manifest["format"] == "parquet":
+            loaded[name] = pyarrow.parquet.read_table(path, memory_map=True)
+        else:
+            loaded[name] = pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+    return loaded
@@ -0,0 +1,77 @@
+"""Files registered in several samples, and samples whose file sets overlap.
+   Everything is computed by the server, from the index on the hashed lfn (schema v9):
+   a GROUP BY on (lfn_hash, sample_id) finds the lfns present in more than one sample, and only
+   those files are joined to count the shared files of each pair of samples (hash collisions are
+   excluded by comparing the lfns). Comparing these counts to the number of distinct files of
+   each sample tells which samples are identical, or subsets of others."""
+
+import time
+from . import schema
+
+RELATIONS = ("identical", "subset", "superset", "overlap")
+
+def _shared_pairs(store, key):
+    """(sample a, sample b, shared distinct files, shared events of a, example lfn), with a < b.
+       The join gives one row per pair of entries, so the files registered more than once in a
+       sample are first reduced to one row per (a, b, lfn), and counted once."""
+    return store.execute("""SELECT sample_a, sample_b, COUNT(*), SUM(nevents), MIN(lfn) FROM
+ (SELECT a.sample_id AS sample_a, b.sample_id AS sample_b, a.lfn AS lfn, MIN(a.nevents) AS nevents
+  FROM (SELECT %(key)s FROM file GROUP BY %(key)s HAVING COUNT(DISTINCT sample_id) > 1) AS shared
+  JOIN file AS a ON a.%(key)s = shared.%(key)s
+  JOIN file AS b ON b.%(key)s = shared.%(key)s AND b.sample_id > a.sample_id AND b.lfn = a.lfn
+  GROUP BY a.sample_id, b.sample_id, a.lfn) AS pairs
+ GROUP BY sample_a, sample_b""" % { "key" : key }).get_all()
+
+def _file_counts(store, sample_ids):
+    counts = {}
+    sample_ids = sorted(sample_ids)
+    for i in range(0, len(sample_ids), 500):
+        chunk = sample_ids[i:i+500]
+        counts.update(store.execute("SELECT sample_id, COUNT(*) FROM file WHERE sample_id IN (%s) GROUP BY sample_id" %
+                                    ", ".join("?" for s in chunk), chunk))
+    return counts
+
+def _names(store, sample_ids):
+    names = {}
+    sample_ids = sorted(sample_ids)
+    for i in range(0, len(sample_ids), 500):
+        chunk = sample_ids[i:i+500]
+        names.update(store.execute("SELECT sample_id, name FROM sample WHERE sample_id IN (%s)" % ", ".join("?" for s in chunk), chunk))
+    return names
+
+def find_duplicates(store):
+    """files shared between samples, and files registered twice in the same sample.
+       Returns a dictionary with
+         shared: one entry per pair of samples with common files, with their relation
+                 (identical, subset: the first one is contained in the second, superset, or overlap)
+         within_sample: samples with the same file registered more than once"""
+    start = time.time()
+    key = schema.LFN_KEY[schema.get_dialect(store)]
+    pairs = _shared_pairs(store, key)
+    # files registered more than once in a sample: (sample, number of such files, number of rows)
+    within = store.execute("""SELECT sample_id, COUNT(*), SUM(n) FROM
+ (SELECT sample_id, COUNT(*) AS n FROM file GROUP BY %(key)s, sample_id HAVING COUNT(*) > 1) AS duplicated
+ GROUP BY sample_id""" % { "key" : key }).get_all()
+    # SUM gives a decimal on MySQL
+    within = [ (sample_id, nfiles, int(rows)) for sample_id, nfiles, rows in within ]
+    extra = dict((sample_id, rows-nfiles) for sample_id, nfiles, rows in within)
+    involved = set(row[0] for row in pairs) | set(row[1] for row in pairs)
+    counts = dict((sample_id, n-extra.get(sample_id, 0)) for sample_id, n in _file_counts(store, involved).items())
+    names = _names(store, involved | set(extra))
+    shared = []
+    for a, b, nshared, nevents, example in pairs:
+        if nshared == counts[a] and nshared == counts[b]:
+            relation = "identical"
+        elif nshared == counts[a]:
+            relation = "subset"
+        elif nshared == counts[b]:
+            relation = "superset"
+        else:
+            relation = "overlap"
+        shared.append({ "samples" : [ a, b ], "names" : [ names.get(a), names.get(b) ], "files" : [ counts[a], counts[b] ],
+                        "shared_files" : nshared, "shared_events" : None if nevents is None else int(nevents), "relation" : relation, "example" : example })
+    shared.sort(key=lambda entry: -entry["shared_files"])
+    return { "shared" : shared,
+             "within_sample" : [ { "sample_id" : sample_id, "name" : names.get(sample_id), "duplicated_files" : nfiles, "extra_entries" : rows-nfiles }
+                                 for sample_id, nfiles, rows in within ],
+             "elapsed_s" : time.time()-start }
@@ -0,0 +1,156 @@
+"""Listing of the files of a sample on disk, and comparison with its File entries.
+   The directories are crawled level by level, all the directories of a level in parallel
+   (os.scandir gives the type of the entries without a stat call, which matters on network
+   file systems), so that nested layouts like the 0000/, 0001/ subdirectories of CRAB outputs
+   are found. The size and modification time of each file are recorded in the File entries
+   (schema v10), and a later scan of the same sample only needs to read the new files and
+   those whose size or modification time changed."""
+
+import os
+import sys
+import errno
+import fnmatch
+from functools import partial
+from . import schema
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+def _scan_directory(pattern, path):
+    """files matching the pattern, as (path, size, mtime), and subdirectories of a directory"""
+    files, directories = [], []
+    try:
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    directories.append(entry.path)
+                elif entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, int(stat.st_mtime)))
+        else:
+            for name in os.listdir(path):
+                full = os.path.join(path, name)
+                if os.path.isdir(full):
+                    directories.append(full)
+                elif fnmatch.fnmatch(name, pattern):
+                    stat = os.stat(full)
+                    files.append((full, stat.st_size, int(stat.st_mtime)))
+    except OSError as error:
+        # removed while crawling
+        if error.errno != errno.ENOENT:
+            raise
+    return files, directories
+
+def stat_file(path):
+    """(path, size, mtime) of a file"""
+    stat = os.stat(path)
+    return (path, stat.st_size, int(stat.st_mtime))
+
+def list_file(path):
+    """(path, size, mtime) of a given file, with None for the size and modification time
+       of the files that cannot be stat'ed here: remote (e.g. root://) or not visible yet"""
+    if "://" in path:
+        return (path, None, None)
+    try:
+        return stat_file(path)
+    except OSError:
+        return (path, None, None)
+
+def scan_files(path, pattern="*.root", recursive=True, workers=8):
+    """files matching the pattern in a directory and, if recursive, its subdirectories.
+       Returns a list of (path, size, mtime), sorted by path"""
+    return scan_many([ path ], pattern, recursive, workers)[0]
+
+def scan_many(paths, pattern="*.root", recursive=True, workers=8):
+    """scan_files for several directories (e.g. the samples of a production), sharing one pool:
+       the directories of a level of all of them are listed in parallel. Returns a list of files per path"""
+    from multiprocessing.pool import ThreadPool
+    files = [ [] for path in paths ]
+    level = []
+    for i, path in enumerate(paths):
+        if os.path.isdir(path):
+            level.append((i, path))
+        else:
+            files[i].append(stat_file(path))
+    pool = ThreadPool(workers)
+    try:
+        while level:
+            subdirectories = []
+            for i, (found, directories) in zip([ i for i, path in level ], pool.imap(partial(_scan_directory, pattern), [ path for i, path in level ])):
+                files[i] += found
+                subdirectories += [ (i, directory) for directory in directories ]
+            level = sorted(subdirectories) if recursive else []
+    finally:
+        pool.terminate()
+    return [ sorted(found) for found in files ]
+
+class FileChanges(object):
+    """Differences between the files on disk and the File entries of a sample"""
+
+    def __init__(self):
+        self.new = []       # (path, size, mtime)
+        self.changed = []   # (id, path, size, mtime)
+        self.vanished = []  # (id, path)
+        self.unknown = []   # (id, size, mtime) of entries registered without size and modification time
+        self.unchanged = 0
+
+    def __len__(self):
+        return len(self.new)+len(self.changed)+len(self.vanished)+len(self.unknown)
+
+    def __str__(self):
+        return "%d new, %d changed, %d vanished and %d unchanged files" % (len(self.new), len(self.changed), len(self.vanished), self.unchanged+len(self.unknown))
+
+def diff_files(store, sample_id, files):
+    """compare the (path, size, mtime) of the files on disk to the File entries of a sample, by pfn.
+       The entries without size and modification time (registered before v10), and the files whose
+       size and modification time are unknown (None, e.g. remote files), are assumed unchanged."""
+    changes = FileChanges()
+    registered = dict((pfn, (file_id, size, mtime)) for file_id, pfn, size, mtime in
+                      store.execute("SELECT id, pfn, size, mtime FROM file WHERE sample_id = ?", (sample_id,)))
+    for path, size, mtime in files:
+        if path not in registered:
+            changes.new.append((path, size, mtime))
+            continue
+        file_id, registered_size, registered_mtime = registered.pop(path)
+        if size is None or mtime is None:
+            changes.unchanged += 1
+        elif registered_size is None or registered_mtime is None:
+            changes.unknown.append((file_id, size, mtime))
+        elif registered_size != size or registered_mtime != mtime:
+            changes.changed.append((file_id, path, size, mtime))
+        else:
+            changes.unchanged += 1
+    changes.vanished = sorted((file_id, pfn) for pfn, (file_id, size, mtime) in registered.items())
+    return changes
+
+def apply_changes(store, sample_id, changes, read_file, stream=sys.stderr):
+    """insert the new files, remove the vanished ones, and read again the changed ones.
+       read_file(path) gives the (event weight sum, number of entries) of a file."""
+    def read_new():
+        for path, size, mtime in changes.new:
+            weight_sum, entries = read_file(path)
+            yield (sample_id, path, path, weight_sum, entries, size, mtime)
+    schema.insert_rows(store, "file", ("sample_id", "lfn", "pfn", "event_weight_sum", "nevents", "size", "mtime"), read_new())
+    def read_changed():
+        for file_id, path, size, mtime in changes.changed:
+            weight_sum, entries = read_file(path)
+            # the checksums of the previous content are dropped (see checksums.py)
+            yield (file_id, weight_sum, entries, size, mtime, None, None)
+    schema.update_rows(store, "file", "id", ("event_weight_sum", "nevents", "size", "mtime", "adler32", "xxhash64"), read_changed())
+    schema.update_rows(store, "file", "id", ("size", "mtime"), changes.unknown)
+    ids = [ file_id for file_id, pfn in changes.vanished ]
+    for i in range(0, len(ids), ID_CHUNK):
+        chunk = ids[i:i+ID_CHUNK]
+        store.execute("DELETE FROM file WHERE %s" % _in("id", chunk), chunk, noresult=True)
+    store.flush()
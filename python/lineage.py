@@ -0,0 +1,177 @@
+"""Lineage of the catalog entries: the samples derived (recursively) from datasets or samples,
+   the results using them, and, upstream, the source samples and datasets of samples or results.
+   The graph is obtained in one query with a recursive common table expression (SQLite >= 3.8.3,
+   MySQL >= 8.0). Other servers get the same graph with one query per level of derivation
+   (instead of one query per node, as when following the references of the model objects).
+
+   Example, everything affected by a bad dataset:
+     graph = descendants(dbstore, datasets=[12])
+     print(sorted(graph.results.values()))"""
+
+import weakref
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+# maximal number of parameters of a statement (the default limit of SQLite)
+MAX_PARAMETERS = 999
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+def _chunks(values, size=ID_CHUNK):
+    values = sorted(values)
+    for i in range(0, len(values), size):
+        yield values[i:i+size]
+
+class Lineage(object):
+    """Graph of datasets, samples and results.
+       The nodes are (type, id) pairs, with type dataset, sample or result, and their names
+       (the path for results) are in the datasets, samples and results dictionaries.
+       The edges go from a parent to its child: dataset to sample, source sample to sample, sample to result."""
+
+    def __init__(self):
+        self.datasets = {}
+        self.samples = {}
+        self.results = {}
+        self.edges = set()
+
+    def _add(self, rows):
+        """add the (type, id, name, source dataset or sample of a result, source sample) rows of a query"""
+        links = []
+        for kind, key, name, first, second in rows:
+            if kind == "sample":
+                self.samples[key] = name
+                links += [ (("dataset", first), ("sample", key)), (("sample", second), ("sample", key)) ]
+            elif kind == "result":
+                self.results[key] = name
+                links.append((("sample", first), ("result", key)))
+            else:
+                self.datasets[key] = name
+        # only the edges between nodes of the graph
+        self.edges.update(link for link in links if link[0][1] is not None and link[0] in self and link[1] in self)
+
+    def __contains__(self, node):
+        kind, key = node
+        return key in getattr(self, kind+"s")
+
+    def __len__(self):
+        return len(self.datasets)+len(self.samples)+len(self.results)
+
+    def update(self, other):
+        self.datasets.update(other.datasets)
+        self.samples.update(other.samples)
+        self.results.update(other.results)
+        self.edges.update(other.edges)
+
+    def children(self, node):
+        return sorted(child for parent, child in self.edges if parent == node)
+
+    def parents(self, node):
+        return sorted(parent for parent, child in self.edges if child == node)
+
+    def to_dict(self):
+        """compact form, for JSON"""
+        return { "datasets" : sorted(self.datasets.items()), "samples" : sorted(self.samples.items()),
+                 "results" : sorted(self.results.items()),
+                 "edges" : [ [ parent[0], parent[1], child[0], child[1] ] for parent, child in sorted(self.edges) ] }
+
+_cte_support = weakref.WeakKeyDictionary()
+
+def supports_recursive_queries(store):
+    """whether the server evaluates WITH RECURSIVE (the answer is cached for each store)"""
+    if store not in _cte_support:
+        try:
+            store.execute("WITH RECURSIVE n(i) AS (SELECT 1 UNION SELECT i+1 FROM n WHERE i < 2) SELECT COUNT(*) FROM n").get_one()
+            _cte_support[store] = True
+        except Exception:
+            _cte_support[store] = False
+    return _cte_support[store]
+
+# nodes of a graph given by the ids of its samples (in the tree relation), the datasets of
+# these samples, and the results of the samples (all of them, or only some).
+_NODES = """SELECT 'sample', s.sample_id, s.name, s.source_dataset_id, s.source_sample_id FROM sample s JOIN tree ON s.sample_id = tree.sample_id
+UNION ALL SELECT 'dataset', d.dataset_id, d.name, NULL, NULL FROM dataset d
+ WHERE d.dataset_id IN (SELECT s.source_dataset_id FROM sample s JOIN tree ON s.sample_id = tree.sample_id)
+UNION ALL SELECT 'result', r.result_id, r.path, sr.sample_id, NULL FROM sampleresult sr JOIN tree ON sr.sample_id = tree.sample_id
+ JOIN result r ON r.result_id = sr.result_id%s"""
+
+def _seeds(datasets, samples, results):
+    """query of the samples of the datasets and results, and the given samples"""
+    queries, params = [], []
+    for column, table, ids in (("source_dataset_id", "sample", datasets), ("sample_id", "sample", samples), ("result_id", "sampleresult", results)):
+        if ids:
+            queries.append("SELECT sample_id FROM %s WHERE %s" % (table, _in(column, ids)))
+            params += list(ids)
+    return " UNION ".join(queries), params
+
+def _graph(store, datasets, samples, results, downstream):
+    datasets, samples, results = sorted(set(datasets)), sorted(set(samples)), sorted(set(results))
+    graph = Lineage()
+    if not (datasets or samples or results):
+        return graph
+    # the ids of the results are bound twice upstream: in the seeds, and in the selection of the results
+    nparameters = len(datasets)+len(samples)+len(results)*(1 if downstream else 2)
+    if nparameters <= MAX_PARAMETERS and supports_recursive_queries(store):
+        seeds, params = _seeds(datasets, samples, results)
+        if downstream:
+            step = "SELECT s.sample_id FROM sample s JOIN tree ON s.source_sample_id = tree.sample_id"
+            selection = ""
+        else:
+            step = "SELECT s.source_sample_id FROM sample s JOIN tree ON s.sample_id = tree.sample_id WHERE s.source_sample_id IS NOT NULL"
+            selection = " WHERE " + _in("sr.result_id", results) if results else " WHERE 1 = 0"
+            params += results
+        graph._add(store.execute(("WITH RECURSIVE tree(sample_id) AS (%s UNION %s)\n" % (seeds, step)) + _NODES % selection, params))
+    else:
+        graph._add(_nodes_by_level(store, datasets, samples, results, downstream))
+    # the datasets asked for, even without samples
+    missing = [ d for d in datasets if d not in graph.datasets ]
+    for chunk in _chunks(missing):
+        graph.datasets.update(store.execute("SELECT dataset_id, name FROM dataset WHERE %s" % _in("dataset_id", chunk), chunk))
+    return graph
+
+def _nodes_by_level(store, datasets, samples, results, downstream):
+    """the rows of _NODES, with one query per level of derivation"""
+    tree = set(samples)
+    for column, table, ids in (("source_dataset_id", "sample", datasets), ("result_id", "sampleresult", results)):
+        for chunk in _chunks(ids):
+            tree.update(row[0] for row in store.execute("SELECT sample_id FROM %s WHERE %s" % (table, _in(column, chunk)), chunk))
+    level = set(tree)
+    while level:
+        found = set()
+        for chunk in _chunks(level):
+            if downstream:
+                found.update(row[0] for row in store.execute("SELECT sample_id FROM sample WHERE %s" % _in("source_sample_id", chunk), chunk))
+            else:
+                found.update(row[0] for row in store.execute("SELECT source_sample_id FROM sample WHERE %s AND source_sample_id IS NOT NULL" %
+                                                             _in("sample_id", chunk), chunk))
+        level = found-tree
+        tree |= level
+    rows, source_datasets = [], set()
+    wanted = set(results)
+    for chunk in _chunks(tree):
+        for row in store.execute("SELECT 'sample', sample_id, name, source_dataset_id, source_sample_id FROM sample WHERE %s" % _in("sample_id", chunk), chunk):
+            rows.append(row)
+            if row[3] is not None:
+                source_datasets.add(row[3])
+        if downstream or wanted:
+            # upstream, only the results asked for (filtered here, to bind no more than a chunk of ids)
+            rows += [ row for row in store.execute("SELECT 'result', r.result_id, r.path, sr.sample_id, NULL FROM sampleresult sr "
+                                                   "JOIN result r ON r.result_id = sr.result_id WHERE %s" % _in("sr.sample_id", chunk), chunk)
+                      if downstream or row[1] in wanted ]
+    for chunk in _chunks(source_datasets):
+        rows += store.execute("SELECT 'dataset', dataset_id, name, NULL, NULL FROM dataset WHERE %s" % _in("dataset_id", chunk), chunk).get_all()
+    return rows
+
+def descendants(store, datasets=(), samples=()):
+    """the samples derived, directly or not, from the datasets and samples (included), and the results using them"""
+    return _graph(store, datasets, samples, (), downstream=True)
+
+def ancestors(store, samples=(), results=()):
+    """the samples (included) and results, their source samples recursively, and the datasets they come from"""
+    return _graph(store, (), samples, results, downstream=False)
+
+def provenance(store, sample):
+    """the full lineage of a sample: where it comes from, and everything derived from it"""
+    graph = ancestors(store, samples=[sample])
+    graph.update(descendants(store, samples=[sample]))
+    return graph
@@ -0,0 +1,102 @@
+"""Luminosity sections processed by more than one data sample of a result.
+   Samples attached to the same result (e.g. a re-reco and a prompt reconstruction of a run
+   range) must not cover the same lumi sections, or their luminosity is counted twice.
+   The processed_lumi masks of the samples (CMS JSON format, {"run": [[first, last], ...]})
+   are turned into (run, first, last) intervals, and the overlaps are found for each result with
+   a sweep line over the intervals sorted by (run, first section), keeping the active intervals
+   in a heap by last section: the cost is O(n log n) plus the number of overlaps, instead of
+   comparing every range of every pair of samples. The luminosity of an overlap is estimated from
+   the luminosity per lumi section of the samples, since the catalog has no per-section values."""
+
+import json
+import time
+import heapq
+from collections import defaultdict
+
+def parse_mask(text):
+    """sorted (run, first, last) intervals of a lumi mask"""
+    if not text:
+        return []
+    intervals = []
+    for run, ranges in json.loads(text).items():
+        intervals += [ (int(run), int(first), int(last)) for first, last in ranges ]
+    return sorted(intervals)
+
+def count_sections(intervals):
+    return sum(last-first+1 for run, first, last in intervals)
+
+def merge(intervals):
+    """union of (run, first, last) intervals, as sorted disjoint intervals"""
+    merged = []
+    for run, first, last in sorted(intervals):
+        if merged and merged[-1][0] == run and first <= merged[-1][2]+1:
+            merged[-1][2] = max(merged[-1][2], last)
+        else:
+            merged.append([ run, first, last ])
+    return [ tuple(interval) for interval in merged ]
+
+def find_overlaps(masks):
+    """overlaps between the masks of different samples, given as { sample_id: intervals }.
+       Returns { (sample a, sample b): merged (run, first, last) overlaps }, with a < b"""
+    events = sorted((run, first, last, sample_id) for sample_id, intervals in masks.items() for run, first, last in intervals)
+    overlaps = defaultdict(list)
+    active, current_run = [], None
+    for run, first, last, sample_id in events:
+        if run != current_run:
+            active, current_run = [], run
+        # the intervals ending before this one starts are done
+        while active and active[0][0] < first:
+            heapq.heappop(active)
+        for other_last, other_sample in active:
+            if other_sample != sample_id:
+                pair = (min(sample_id, other_sample), max(sample_id, other_sample))
+                overlaps[pair].append((run, first, min(last, other_last)))
+        heapq.heappush(active, (last, sample_id))
+    return dict((pair, merge(intervals)) for pair, intervals in overlaps.items())
+
+def result_overlaps(store, result_ids=None):
+    """lumi sections shared by samples of the same result, for the given results or all of them.
+       The samples with a processed_lumi mask are the data samples. Returns a dictionary with
+         overlaps: one entry per result and pair of samples, with the overlapping ranges, their
+                   number of lumi sections and an estimate of the luminosity counted twice
+         elapsed_s: the time spent"""
+    start = time.time()
+    query = """SELECT sr.result_id, s.sample_id, s.name, s.luminosity FROM sampleresult sr
+ JOIN sample s ON s.sample_id = sr.sample_id WHERE s.processed_lumi IS NOT NULL"""
+    params = []
+    if result_ids is not None:
+        result_ids = sorted(set(result_ids))
+        if not result_ids:
+            return { "overlaps" : [], "elapsed_s" : time.time()-start }
+        query += " AND sr.result_id IN (%s)" % ", ".join("?" for r in result_ids)
+        params = result_ids
+    samples = defaultdict(list)
+    names, luminosities = {}, {}
+    for result_id, sample_id, name, luminosity in store.execute(query, params):
+        samples[result_id].append(sample_id)
+        names[sample_id], luminosities[sample_id] = name, luminosity
+    # each mask is read and parsed once, even if the sample is used by several results
+    candidates = sorted(set(sample_id for sample_ids in samples.values() if len(sample_ids) > 1 for sample_id in sample_ids))
+    masks = {}
+    for i in range(0, len(candidates), 500):
+        chunk = candidates[i:i+500]
+        for sample_id, text in store.execute("SELECT sample_id, processed_lumi FROM sample WHERE sample_id IN (%s)" %
+                                             ", ".join("?" for s in chunk), chunk):
+            masks[sample_id] = parse_mask(text)
+    # luminosity per lumi section of each sample
+    density = {}
+    for sample_id in candidates:
+        sections = count_sections(masks[sample_id])
+        if luminosities[sample_id] is not None and sections:
+            density[sample_id] = luminosities[sample_id]/sections
+    overlaps = []
+    for result_id, sample_ids in sorted(samples.items()):
+        if len(sample_ids) < 2:
+            continue
+        for (a, b), ranges in sorted(find_overlaps(dict((sample_id, masks[sample_id]) for sample_id in sample_ids)).items()):
+            sections = count_sections(ranges)
+            estimates = [ density[s]*sections for s in (a, b) if s in density ]
+            overlaps.append({ "result_id" : result_id, "samples" : [ a, b ], "names" : [ names[a], names[b] ],
+                              "ranges" : [ list(interval) for interval in ranges ], "lumisections" : sections,
+                              "luminosity" : sum(estimates)/len(estimates) if estimates else None })
+    return { "overlaps" : overlaps, "elapsed_s" : time.time()-start }
@@ -0,0 +1,294 @@
+"""Schema migrations of the SAMADhi database.
+   The version of the schema is recorded in the schema_version table, and
+   pending migrations are applied in order. Schema changes are done online on MySQL
+   (in place, without locking the tables), and data backfills run in bounded chunks
+   of primary keys, committed one by one, so that an interrupted migration resumes
+   where it stopped."""
+
+import os
+import sys
+import time
+from datetime import datetime
+from . import schema
+
+# last version upgraded by hand with the data/vN_to_vN+1_upgrade.sql files
+BASELINE_VERSION = 6
+
+VERSION_TABLE = {
+"mysql" : """CREATE TABLE IF NOT EXISTS schema_version
+(
+version int NOT NULL,
+description text,
+applied_on datetime,
+PRIMARY KEY (version)
+) ENGINE = INNODB""",
+"sqlite" : """CREATE TABLE IF NOT EXISTS schema_version
+(
+version INTEGER PRIMARY KEY,
+description TEXT,
+applied_on DATETIME
+)""" }
+
+PROGRESS_TABLE = {
+"mysql" : """CREATE TABLE IF NOT EXISTS schema_migration_progress
+(
+version int NOT NULL,
+step varchar(255) NOT NULL,
+last_key bigint NOT NULL,
+PRIMARY KEY (version, step)
+) ENGINE = INNODB""",
+"sqlite" : """CREATE TABLE IF NOT EXISTS schema_migration_progress
+(
+version INTEGER NOT NULL,
+step VARCHAR(255) NOT NULL,
+last_key BIGINT NOT NULL,
+PRIMARY KEY (version, step)
+)""" }
+
+def get_columns(store, table):
+    """names of the columns of a table"""
+    if schema.get_dialect(store) == "mysql":
+        return set(row[0] for row in store.execute("SHOW COLUMNS FROM %s" % table))
+    return set(row[1] for row in store.execute("PRAGMA table_info(%s)" % table))
+
+def has_table(store, table):
+    if schema.get_dialect(store) == "mysql":
+        return store.execute("SHOW TABLES LIKE ?", (unicode(table),)).get_one() is not None
+    return store.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (unicode(table),)).get_one() is not None
+
+class Progress(object):
+    """Reports the progress and throughput of a long step on stderr (nothing is written if the stream is None)"""
+
+    def __init__(self, label, total, stream=sys.stderr, interval=5.):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.stream = stream
+        self.interval = interval
+        self.start = self.last = time.time()
+
+    def update(self, count, force=False):
+        self.done += count
+        now = time.time()
+        if self.stream is not None and (force or now-self.last > self.interval):
+            self.last = now
+            rate = self.done/max(now-self.start, 1e-6)
+            eta = (self.total-self.done)/rate if rate > 0 and self.total else 0.
+            self.stream.write("  %s: %d/%d rows (%.0f rows/s, %.0f s left)\n" % (self.label, self.done, self.total, rate, max(eta, 0.)))
+            self.stream.flush()
+
+    def finish(self):
+        self.update(0, force=True)
+
+class Step(object):
+    """One step of a migration. Steps must be idempotent: they can be run again after an interruption."""
+    name = "step"
+
+    def run(self, store, migration, runner):
+        raise NotImplementedError
+
+class Call(Step):
+    """Step implemented by a function taking the store"""
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def run(self, store, migration, runner):
+        self.function(store)
+        store.commit()
+
+class AddColumn(Step):
+    """Add a nullable column to a table. On MySQL the table is altered in place,
+       without blocking reads and writes. The column should be filled by a Backfill step."""
+
+    def __init__(self, table, column, definition):
+        self.name = "add %s.%s" % (table, column)
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def run(self, store, migration, runner):
+        if self.column in get_columns(store, self.table):
+            return
+        if schema.get_dialect(store) == "mysql":
+            store.execute("ALTER TABLE %s ADD COLUMN %s %s, ALGORITHM=INPLACE, LOCK=NONE" % (self.table, self.column, self.definition), noresult=True)
+        else:
+            store.execute("ALTER TABLE %s ADD COLUMN %s %s" % (self.table, self.column, self.definition), noresult=True)
+        store.commit()
+
+class AddIndexes(Call):
+    """Create indexes (see schema.Index), unless they exist"""
+
+    def __init__(self, name, indexes):
+        Call.__init__(self, name, lambda store: schema.create_indexes(store, indexes))
+
+class Backfill(Step):
+    """Fill rows in chunks of primary keys. The statement must restrict the rows with
+       %(lower)s < key <= %(upper)s, or be a function fill(store, lower, upper) for values computed in Python.
+       Each chunk is committed together with the last processed key."""
+
+    def __init__(self, name, table, key, statement, chunk_size=None):
+        self.name = name
+        self.table = table
+        self.key = key
+        self.statement = statement
+        self.chunk_size = chunk_size
+
+    def run(self, store, migration, runner):
+        chunk_size = self.chunk_size or runner.chunk_size
+        last_key = runner.get_progress(store, migration, self)
+        max_key, = store.execute("SELECT MAX(%s) FROM %s" % (self.key, self.table)).get_one()
+        if max_key is None or last_key >= max_key:
+            return
+        total, = store.execute("SELECT COUNT(*) FROM %s WHERE %s > ?" % (self.table, self.key), (last_key,)).get_one()
+        progress = Progress("%s (v%d)" % (self.name, migration.version), total, stream=runner.stream)
+        if schema.get_dialect(store) == "mysql":
+            # backfilled rows are not recorded in the change log: snapshots are rebuilt after a migration
+            store.execute("SET @samadhi_changelog_off = 1", noresult=True)
+        while last_key < max_key:
+            # next chunk boundary from the key index, so that holes in the keys do not produce empty chunks
+            upper, count = store.execute("SELECT MAX(%s), COUNT(*) FROM (SELECT %s FROM %s WHERE %s > ? ORDER BY %s LIMIT %d) AS chunk" %
+                                         (self.key, self.key, self.table, self.key, self.key, chunk_size), (last_key,)).get_one()
+            if upper is None:
+                break
+            if callable(self.statement):
+                self.statement(store, last_key, upper)
+            else:
+                store.execute(self.statement % { "lower" : "?", "upper" : "?" }, (last_key, upper), noresult=True)
+            runner.set_progress(store, migration, self, upper)
+            store.commit()
+            progress.update(count)
+            last_key = upper
+            if runner.pause:
+                time.sleep(runner.pause)
+        if schema.get_dialect(store) == "mysql":
+            store.execute("SET @samadhi_changelog_off = NULL", noresult=True)
+        progress.finish()
+
+class Migration(object):
+    """Upgrade from version-1 to version"""
+
+    def __init__(self, version, description, steps):
+        self.version = version
+        self.description = description
+        self.steps = steps
+
+    def __str__(self):
+        return "v%d: %s" % (self.version, self.description)
+
+def fill_file_stats(store, lower, upper):
+    """size and modification time of the local files lower < id <= upper registered without them.
+       This is what add_sample.py --resync records for such entries (see filescan.diff_files)."""
+    rows = []
+    for file_id, pfn in store.execute("SELECT id, pfn FROM file WHERE id > ? AND id <= ? AND size IS NULL", (lower, upper)):
+        if "://" in pfn:
+            continue
+        try:
+            stat = os.stat(pfn)
+        except OSError:
+            continue
+        rows.append((file_id, stat.st_size, int(stat.st_mtime)))
+    schema.update_rows(store, "file", "id", ("size", "mtime"), rows)
+
+MIGRATIONS = [
+    Migration(7, "indexes of the hot query paths, unique dataset and sample names", [
+        Call("unique names and hot path indexes", schema.upgrade_indexes),
+        ]),
+    Migration(8, "change log of updates and deletions, for snapshot synchronization", [
+        Call("changelog table and triggers", schema.create_changelog),
+        ]),
+    Migration(9, "hashed lfn, to find the files shared by several samples", [
+        Call("file.lfn_hash and its index", schema.create_lfn_hash),
+        ]),
+    Migration(10, "size and modification time of the files, to rescan only the changed files", [
+        AddColumn("file", "size", "BIGINT"),
+        AddColumn("file", "mtime", "BIGINT"),
+        Backfill("file size and modification time", "file", "id", fill_file_stats),
+        ]),
+    Migration(11, "checksums of the files, to detect corrupted or replaced files", [
+        AddColumn("file", "adler32", "CHAR(8)"),
+        AddColumn("file", "xxhash64", "CHAR(16)"),
+        ]),
+    ]
+
+class MigrationRunner(object):
+    """Applies the pending migrations to a database, reporting on the stream (if not None)"""
+
+    def __init__(self, store, migrations=MIGRATIONS, chunk_size=10000, pause=0., stream=sys.stderr):
+        self.store = store
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.stream = stream
+
+    def log(self, message):
+        if self.stream is not None:
+            self.stream.write(message+"\n")
+
+    def bootstrap(self):
+        """create the bookkeeping tables, and record the version of an unversioned database"""
+        dialect = schema.get_dialect(self.store)
+        versioned = has_table(self.store, "schema_version")
+        self.store.execute(VERSION_TABLE[dialect], noresult=True)
+        self.store.execute(PROGRESS_TABLE[dialect], noresult=True)
+        if not versioned:
+            # databases upgraded by hand: v7 if the hot path indexes are there, v8 with the change log, v9 with the lfn hash,
+            # v10 with the file size and modification time, v11 with the file checksums
+            version = BASELINE_VERSION
+            if all(index.get_name(dialect) in schema.get_indexes(self.store, index.table) for index in schema.HOT_PATH_INDEXES):
+                version = 7
+                if has_table(self.store, "changelog"):
+                    version = 8
+                    if schema.LFN_INDEXES[dialect].get_name(dialect) in schema.get_indexes(self.store, "file"):
+                        version = 9
+                        if "mtime" in get_columns(self.store, "file"):
+                            version = 10
+                            if "adler32" in get_columns(self.store, "file"):
+                                version = 11
+            self.record(version, u"baseline")
+        self.store.commit()
+
+    def record(self, version, description):
+        self.store.execute("INSERT INTO schema_version (version, description, applied_on) VALUES (?, ?, ?)",
+                           (version, description, datetime.now().replace(microsecond=0)), noresult=True)
+
+    def current_version(self):
+        if not has_table(self.store, "schema_version"):
+            return None
+        return self.store.execute("SELECT MAX(version) FROM schema_version").get_one()[0]
+
+    def pending(self, target=None):
+        """migrations to apply to reach the target version (latest by default)"""
+        current = self.current_version()
+        if current is None:
+            current = BASELINE_VERSION
+        return [ m for m in self.migrations if m.version > current and (target is None or m.version <= target) ]
+
+    def get_progress(self, store, migration, step):
+        row = store.execute("SELECT last_key FROM schema_migration_progress WHERE version = ? AND step = ?",
+                            (migration.version, unicode(step.name))).get_one()
+        return row[0] if row is not None else 0
+
+    def set_progress(self, store, migration, step, last_key):
+        if store.execute("UPDATE schema_migration_progress SET last_key = ? WHERE version = ? AND step = ?",
+                         (last_key, migration.version, unicode(step.name))).rowcount == 0:
+            store.execute("INSERT INTO schema_migration_progress (version, step, last_key) VALUES (?, ?, ?)",
+                          (migration.version, unicode(step.name), last_key), noresult=True)
+
+    def upgrade(self, target=None):
+        """apply the pending migrations in order. Returns the list of applied migrations."""
+        self.bootstrap()
+        applied = []
+        for migration in self.pending(target):
+            self.log("Applying %s" % migration)
+            start = time.time()
+            for step in migration.steps:
+                self.log("  %s" % step.name)
+                step.run(self.store, migration, self)
+            self.store.execute("DELETE FROM schema_migration_progress WHERE version = ?", (migration.version,), noresult=True)
+            self.record(migration.version, unicode(migration.description))
+            self.store.commit()
+            self.log("  done in %.1f s" % (time.time()-start))
+            applied.append(migration)
+        return applied
@@ -0,0 +1,90 @@
+"""Approximate search of datasets and samples by name, for the interactive prompts.
+   The names are split in tokens (on /, _, -, . and spaces) and indexed by their character
+   trigrams. A query is only compared to the names sharing trigrams with it, and scored by the
+   fraction of its trigrams found in the name, with a bonus for the query words found as such:
+   e.g. "ttbar madgraph 13" finds /TTbar_13TeV-madgraph/... without scanning all the names.
+   The index of a table is built once per store (i.e. per session), from the ids and names only.
+
+   Example:
+     index = name_index(dbstore, Dataset)
+     for dataset_id, name in index.search("doublemuon 2016")[:10]:
+       print(dataset_id, name)"""
+
+import re
+import weakref
+from collections import defaultdict
+from storm.info import get_cls_info
+
+# minimal fraction of the trigrams of the query found in a name
+MIN_COVERAGE = 0.5
+
+_SEPARATORS = re.compile(r"[^0-9a-z]+")
+
+def tokens(text):
+    """lowercase alphanumeric words of a name or query"""
+    return [ token for token in _SEPARATORS.split(text.lower()) if token ]
+
+def trigrams(token):
+    """trigrams of a word, padded so that its beginning and end count more"""
+    padded = "  %s " % token
+    return set(padded[i:i+3] for i in range(len(padded)-2))
+
+class NameIndex(object):
+    """Trigram index of (id, name) pairs"""
+
+    def __init__(self, rows=()):
+        self.names = {}
+        self.postings = defaultdict(set) # trigram: ids of the names containing it
+        self.sizes = {}                  # id: number of trigrams of the name
+        for key, name in rows:
+            self.add(key, name)
+
+    def add(self, key, name):
+        self.names[key] = name
+        grams = set()
+        for token in tokens(name):
+            grams |= trigrams(token)
+        for gram in grams:
+            self.postings[gram].add(key)
+        self.sizes[key] = len(grams)
+
+    def __contains__(self, key):
+        return key in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query):
+        """(id, name) of the names matching the query, best first"""
+        words = tokens(query)
+        wanted = set()
+        for word in words:
+            wanted |= trigrams(word)
+        if not wanted:
+            return []
+        shared = defaultdict(int)
+        for gram in wanted:
+            for key in self.postings.get(gram, ()):
+                shared[key] += 1
+        scored = []
+        for key, count in shared.items():
+            coverage = float(count)/len(wanted)
+            if coverage < MIN_COVERAGE:
+                continue
+            name = self.names[key].lower()
+            found = sum(1 for word in words if word in name)
+            # ties are broken by the similarity of the whole name (shorter names first)
+            similarity = float(count)/(len(wanted)+self.sizes[key]-count)
+            scored.append((-(coverage+float(found)/len(words)), -similarity, key))
+        scored.sort()
+        return [ (key, self.names[key]) for coverage, similarity, key in scored ]
+
+_indexes = weakref.WeakKeyDictionary()
+
+def name_index(store, cls):
+    """index of the names of a model class (Dataset or Sample), built on first use for each store"""
+    indexes = _indexes.setdefault(store, {})
+    if cls not in indexes:
+        key = get_cls_info(cls).primary_key[0]
+        indexes[cls] = NameIndex(store.find((key, cls.name)))
+    return indexes[cls]
@@ -0,0 +1,148 @@
+"""Normalization of many samples at once, for analysis and plotting jobs.
+   The sample and dataset columns needed to normalize a list of samples are read in a single
+   joined query (plus one query per level of parent samples, for the data samples that get their
+   luminosity from a parent), and returned as columns: NumPy arrays if NumPy is available, lists otherwise.
+   Results are cached, keyed on the catalog version (see schema.catalog_version), so repeated calls
+   in the same job only cost the version check.
+
+   Example:
+     norm = get_normalizations(dbstore, [u"TT_TuneCUETP8M1_PAT", u"DY_PAT"])
+     scales = norm.scale(35900.)    # xsection*normalization/event_weight_sum*luminosity for MC, 1 for data"""
+
+from collections import OrderedDict
+from . import schema
+from .cache import LRUCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS = ("sample_id", "name", "datatype", "xsection", "nevents_processed", "event_weight_sum", "normalization", "luminosity")
+
+_QUERY = """SELECT sample.sample_id, sample.name, sample.nevents_processed, sample.event_weight_sum, sample.normalization,
+ sample.luminosity, sample.source_sample_id, dataset.datatype, dataset.xsection
+ FROM sample LEFT JOIN dataset ON dataset.dataset_id = sample.source_dataset_id WHERE %s"""
+
+# maximal number of names or ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+def _fetch(store, column, values):
+    rows = []
+    values = list(values)
+    for i in range(0, len(values), ID_CHUNK):
+        chunk = values[i:i+ID_CHUNK]
+        rows += store.execute(_QUERY % _in(column, chunk), chunk).get_all()
+    return rows
+
+def _luminosity(sample_id, rows):
+    """effective luminosity, as Sample.getLuminosity, from the rows by sample id"""
+    seen = set()
+    while sample_id is not None and sample_id in rows and sample_id not in seen:
+        seen.add(sample_id)
+        s_id, name, nevents_processed, weight_sum, normalization, luminosity, source_sample_id, datatype, xsection = rows[sample_id]
+        if luminosity is not None:
+            return luminosity
+        if datatype is None:
+            return None
+        if datatype == "mc":
+            if nevents_processed is not None and xsection is not None:
+                return nevents_processed/xsection
+            return None
+        sample_id = source_sample_id
+    return None
+
+class Normalizations(object):
+    """Normalization columns of a list of samples, in the requested order.
+       Each column (see COLUMNS) is an attribute; missing values are NaN in the NumPy arrays,
+       None in the lists."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        for name, values in columns.items():
+            setattr(self, name, values)
+        self._position = dict((name, i) for i, name in enumerate(columns["name"]))
+
+    def __len__(self):
+        return len(self.columns["name"])
+
+    def index(self, name):
+        return self._position[name]
+
+    def weight(self):
+        """xsection*normalization/event_weight_sum: the event weight for 1/pb of MC, 1 for data"""
+        if numpy is not None:
+            is_data = numpy.array([ t != "mc" for t in self.datatype ])
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                weights = self.xsection*self.normalization/self.event_weight_sum
+            return numpy.where(is_data, 1., numpy.where(self.event_weight_sum == 0., numpy.nan, weights))
+        return [ 1. if t != "mc" else (x*n/w if None not in (x, n, w) and w else None)
+                 for t, x, n, w in zip(self.datatype, self.xsection, self.normalization, self.event_weight_sum) ]
+
+    def scale(self, luminosity):
+        """event weight to normalize each sample to the given luminosity (1 for data)"""
+        weights = self.weight()
+        if numpy is not None:
+            return numpy.where(numpy.array([ t != "mc" for t in self.datatype ]), 1., weights*luminosity)
+        return [ w if t != "mc" or w is None else w*luminosity for t, w in zip(self.datatype, weights) ]
+
+    def to_dict(self):
+        """name : dictionary of the columns of each sample"""
+        return dict((name, dict((column, self.columns[column][i]) for column in COLUMNS))
+                    for name, i in self._position.items())
+
+_cache = LRUCache(32)
+
+def clear_cache():
+    _cache.clear()
+
+def _load(store, samples):
+    if isinstance(samples, basestring):
+        rows = store.execute((_QUERY % "sample.name LIKE ?") + " ORDER BY sample.sample_id",
+                             (unicode(samples.replace('*', '%').replace('?', '_')),)).get_all()
+        order = [ row[0] for row in rows ]
+    else:
+        samples = list(samples)
+        names = [ unicode(s) for s in samples if isinstance(s, basestring) ]
+        ids = [ s for s in samples if not isinstance(s, basestring) ]
+        rows = (_fetch(store, "sample.name", set(names)) if names else []) + (_fetch(store, "sample.sample_id", set(ids)) if ids else [])
+        by_key = dict((row[1], row[0]) for row in rows)
+        by_key.update((row[0], row[0]) for row in rows)
+        missing = [ s for s in samples if (unicode(s) if isinstance(s, basestring) else s) not in by_key ]
+        if missing:
+            raise KeyError("Unknown samples: %s" % ", ".join(str(s) for s in missing))
+        order = [ by_key[unicode(s) if isinstance(s, basestring) else s] for s in samples ]
+    rows = dict((row[0], row) for row in rows)
+    # data samples without luminosity take it from their parents: fetch them level by level
+    pending = set(row[6] for row in rows.values() if row[5] is None and row[7] is not None and row[7] != "mc" and row[6] is not None)
+    while pending - set(rows):
+        parents = _fetch(store, "sample.sample_id", pending - set(rows))
+        rows.update((row[0], row) for row in parents)
+        pending = set(row[6] for row in parents if row[5] is None and row[7] is not None and row[7] != "mc" and row[6] is not None)
+    columns = OrderedDict((name, []) for name in COLUMNS)
+    for sample_id in order:
+        s_id, name, nevents_processed, weight_sum, normalization, luminosity, source_sample_id, datatype, xsection = rows[sample_id]
+        for column, value in zip(COLUMNS, (s_id, name, datatype, xsection, nevents_processed, weight_sum, normalization,
+                                           _luminosity(sample_id, rows))):
+            columns[column].append(value)
+    if numpy is not None:
+        for column in ("xsection", "nevents_processed", "event_weight_sum", "normalization", "luminosity"):
+            columns[column] = numpy.array([ numpy.nan if v is None else v for v in columns[column] ], dtype=float)
+        columns["sample_id"] = numpy.array(columns["sample_id"], dtype=int)
+    return Normalizations(columns)
+
+def get_normalizations(store, samples, cache=True):
+    """normalization columns of the samples given by a list of names and/or ids, or by a name pattern (with * and ?)"""
+    if not cache:
+        return _load(store, samples)
+    key = (store.get_database(), schema.catalog_version(store),
+           samples if isinstance(samples, basestring) else tuple(samples))
+    try:
+        return _cache.get(key)
+    except KeyError:
+        result = _load(store, samples)
+        _cache.put(key, result)
+        return result
@@ -0,0 +1,281 @@
+"""Non-interactive registration of many catalog entries at once, from a manifest.
+   A manifest is a JSON (or YAML, if PyYAML is installed) file with a list of entries, and
+   optionally defaults applied to all of them:
+     { "defaults" : { "analysis" : 12, "author" : "jdoe" },
+       "results" : [ { "path" : "/home/users/jdoe/plots_v3", "description" : "...",
+                       "samples" : [ "DoubleMuon_NTUPLES_v12", 345 ] }, ... ] }
+   or, for samples (with the fields of SAMPLE_FIELDS, the parent being an existing sample or
+   a previous entry of the manifest):
+     { "defaults" : { "code_version" : "v5.0.1" },
+       "samples" : [ { "type" : "PAT", "path" : "/storage/.../DoubleMuon_Run2016B", "dataset" : "/DoubleMuon/Run2016B-.../MINIAOD" },
+                     { "type" : "NTUPLES", "path" : "/storage/.../DoubleMuon_Run2016B_ntuples", "parent" : "DoubleMuon_Run2016B" } ] }
+   All the entries are checked before anything is written: the datasets and samples referenced
+   by name or id are resolved with one IN query per chunk of references, and the rows are then
+   inserted with multi-row statements (see schema.insert_rows), in one transaction."""
+
+import os
+import sys
+import json
+from pwd import getpwuid
+from datetime import datetime
+from . import schema, filescan
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+class ManifestError(Exception):
+    """Invalid manifest: the message lists all the problems found"""
+
+    def __init__(self, problems):
+        Exception.__init__(self, "\n".join(problems))
+        self.problems = problems
+
+def load_manifest(path, kind):
+    """entries of a manifest (kind is results or samples), with the defaults applied"""
+    with open(path) as infile:
+        if path.endswith(".yaml") or path.endswith(".yml"):
+            try:
+                import yaml
+            except ImportError as error:
+                raise ImportError("PyYAML is needed for YAML manifests: {0}".format(error))
+            content = yaml.safe_load(infile)
+        else:
+            content = json.load(infile)
+    if isinstance(content, list):
+        content = { kind : content }
+    if not isinstance(content, dict) or not isinstance(content.get(kind), list):
+        raise ManifestError([ "%s: expected a list of %s, or a dictionary with a %s list" % (path, kind, kind) ])
+    defaults = content.get("defaults", {})
+    entries = []
+    for entry in content[kind]:
+        merged = dict(defaults)
+        merged.update(entry)
+        entries.append(merged)
+    return entries
+
+def _text(value):
+    if value is None or isinstance(value, unicode):
+        return value
+    return str(value).decode("utf-8")
+
+def _time(value, path):
+    """creation time given in a manifest: YYYY-MM-DD HH:MM:SS, "path" for the time of the path, or now"""
+    if value is None:
+        return datetime.now()
+    if value == "path":
+        return datetime.fromtimestamp(os.path.getctime(path))
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+def _reference(reference):
+    """a reference to an entry: its id (an integer), or its name"""
+    return reference if isinstance(reference, (int, long)) else _text(reference)
+
+def _resolve(store, table, key, references, columns=()):
+    """{ reference: (id,)+columns } for references given by id or by name"""
+    ids = sorted(set(reference for reference in references if isinstance(reference, (int, long))))
+    names = sorted(set(_reference(reference) for reference in references if not isinstance(reference, (int, long))))
+    found = {}
+    for column, values in ((key, ids), ("name", names)):
+        for i in range(0, len(values), ID_CHUNK):
+            chunk = values[i:i+ID_CHUNK]
+            for row in store.execute("SELECT %s FROM %s WHERE %s" % (", ".join((key, "name")+tuple(columns)), table, _in(column, chunk)), chunk):
+                found[row[0] if column == key else row[1]] = (row[0],)+tuple(row[2:])
+    return found
+
+def resolve_samples(store, references):
+    """{ reference: sample id } for sample references given by id (integers) or by name"""
+    return dict((reference, row[0]) for reference, row in _resolve(store, "sample", "sample_id", references).items())
+
+def _existing(store, table, column, values):
+    values = sorted(set(values))
+    existing = set()
+    for i in range(0, len(values), ID_CHUNK):
+        chunk = values[i:i+ID_CHUNK]
+        existing.update(value for value, in store.execute("SELECT %s FROM %s WHERE %s" % (column, table, _in(column, chunk)), chunk))
+    return existing
+
+def _next_ids(store, table, key, count):
+    """keys for new rows. If another client inserts rows at the same time, the insertion fails
+       on a duplicate key and nothing is written."""
+    last = store.execute("SELECT MAX(%s) FROM %s" % (key, table)).get_one()[0]
+    first = (last or 0)+1
+    return range(first, first+count)
+
+class Registration(object):
+    """Summary of a registration: the new ids, and the number of rows of each table"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.entries = [] # (id, path or name, number of linked samples or files)
+        self.rows = {}
+
+    def __str__(self):
+        lines = [ "%d %s registered:" % (len(self.entries), self.kind) ]
+        lines += [ "  #%d %s (%d %s)" % (key, name, count, "samples" if self.kind == "results" else "files") for key, name, count in self.entries ]
+        lines.append("rows inserted: %s" % ", ".join("%d in %s" % (count, table) for table, count in sorted(self.rows.items())))
+        return "\n".join(lines)
+
+def prepare_results(store, entries):
+    """result rows and their samples from manifest entries. Raises a ManifestError listing all the problems"""
+    problems = []
+    samples = resolve_samples(store, [ reference for entry in entries for reference in entry.get("samples", []) ])
+    analyses = _existing(store, "analysis", "analysis_id", [ entry["analysis"] for entry in entries if entry.get("analysis") is not None ])
+    results = []
+    for i, entry in enumerate(entries):
+        where = "result %d (%s)" % (i+1, entry.get("path"))
+        unknown = set(entry) - set(("path", "description", "elog", "analysis", "author", "time", "samples"))
+        if unknown:
+            problems.append("%s: unknown fields %s" % (where, ", ".join(sorted(unknown))))
+        if not entry.get("path"):
+            problems.append("%s: no path" % where)
+            continue
+        path = os.path.abspath(os.path.expandvars(os.path.expanduser(entry["path"])))
+        if not os.path.exists(path):
+            problems.append("%s: %s is not an existing file or directory" % (where, path))
+            continue
+        missing = [ reference for reference in entry.get("samples", []) if _reference(reference) not in samples ]
+        if missing:
+            problems.append("%s: unknown samples %s" % (where, ", ".join(str(reference) for reference in missing)))
+        if entry.get("analysis") is not None and entry["analysis"] not in analyses:
+            problems.append("%s: unknown analysis %s" % (where, entry["analysis"]))
+        try:
+            creation_time = _time(entry.get("time"), path)
+        except ValueError as error:
+            problems.append("%s: %s" % (where, error))
+            continue
+        author = entry.get("author") or getpwuid(os.stat(path).st_uid).pw_name
+        sample_ids = sorted(set(samples[_reference(reference)] for reference in entry.get("samples", []) if _reference(reference) in samples))
+        results.append(((_text(path), _text(entry.get("description")), _text(author), creation_time, entry.get("analysis"), _text(entry.get("elog"))), sample_ids))
+    if problems:
+        raise ManifestError(problems)
+    return results
+
+def register_results(store, entries):
+    """insert the results of manifest entries, and their links to the samples (nothing is committed)"""
+    results = prepare_results(store, entries)
+    summary = Registration("results")
+    ids = _next_ids(store, "result", "result_id", len(results))
+    summary.rows["result"] = schema.insert_rows(store, "result", ("result_id", "path", "description", "author", "creation_time", "analysis_id", "elog"),
+                                                ((result_id,)+row for result_id, (row, sample_ids) in zip(ids, results)))
+    summary.rows["sampleresult"] = schema.insert_rows(store, "sampleresult", ("sample_id", "result_id"),
+                                                      ((sample_id, result_id) for result_id, (row, sample_ids) in zip(ids, results) for sample_id in sample_ids))
+    summary.entries = [ (result_id, row[0], len(sample_ids)) for result_id, (row, sample_ids) in zip(ids, results) ]
+    return summary
+
+# columns of the samples inserted from a manifest, and the fields giving them
+SAMPLE_COLUMNS = ("sample_id", "name", "path", "sampletype", "nevents_processed", "nevents", "normalization", "event_weight_sum",
+                  "luminosity", "code_version", "user_comment", "author", "creation_time", "source_dataset_id", "source_sample_id")
+
+SAMPLE_FIELDS = ("type", "path", "name", "dataset", "parent", "processed", "nevents", "normalization", "weight_sum", "luminosity",
+                 "code_version", "comment", "author", "time", "files")
+
+FILE_COLUMNS = ("sample_id", "lfn", "pfn", "event_weight_sum", "nevents", "size", "mtime")
+
+def prepare_samples(store, entries):
+    """sample rows (dictionaries of SAMPLE_COLUMNS, and the list of files if given) from manifest entries,
+       with new keys. The parent sample can be one of the previous entries (by name).
+       Raises a ManifestError listing all the problems"""
+    problems = []
+    datasets = _resolve(store, "dataset", "dataset_id", [ entry["dataset"] for entry in entries if entry.get("dataset") is not None ], ("nevents",))
+    parents = _resolve(store, "sample", "sample_id", [ entry["parent"] for entry in entries if entry.get("parent") is not None ], ("nevents_processed",))
+    names = []
+    for entry in entries:
+        path = os.path.abspath(os.path.expandvars(os.path.expanduser(entry.get("path") or "")))
+        names.append(_text(entry.get("name") or os.path.basename(path.rstrip("/"))))
+    existing = _existing(store, "sample", "name", names)
+    ids = _next_ids(store, "sample", "sample_id", len(entries))
+    samples, registered = [], {}
+    for i, entry in enumerate(entries):
+        name = names[i]
+        where = "sample %d (%s)" % (i+1, name)
+        unknown = set(entry) - set(SAMPLE_FIELDS)
+        if unknown:
+            problems.append("%s: unknown fields %s" % (where, ", ".join(sorted(unknown))))
+        if not entry.get("type") or not entry.get("path"):
+            problems.append("%s: type and path are mandatory" % where)
+            continue
+        path = os.path.abspath(os.path.expandvars(os.path.expanduser(entry["path"])))
+        if not os.path.exists(path):
+            problems.append("%s: %s is not an existing directory" % (where, path))
+            continue
+        if name in existing or name in registered:
+            problems.append("%s: a sample with this name exists (add_sample.py updates it)" % where)
+        given = entry.get("files")
+        if given is not None:
+            if not isinstance(given, list):
+                problems.append("%s: files must be a list of paths" % where)
+                continue
+            # the remote files (e.g. root://) cannot be checked here
+            missing = [ f for f in given if "://" not in f and not os.path.isfile(f) ]
+            if missing:
+                problems.append("%s: %d of the given files do not exist, e.g. %s" % (where, len(missing), missing[0]))
+        row = dict((column, None) for column in SAMPLE_COLUMNS)
+        row.update(sample_id=ids[i], name=name, path=_text(path), sampletype=_text(entry["type"]), nevents=entry.get("nevents"),
+                   normalization=entry.get("normalization", 1.0), event_weight_sum=entry.get("weight_sum", 1.0),
+                   luminosity=entry.get("luminosity"), code_version=_text(entry.get("code_version", "")),
+                   user_comment=_text(entry.get("comment", "")), author=_text(entry.get("author") or getpwuid(os.stat(path).st_uid).pw_name))
+        try:
+            row["creation_time"] = _time(entry.get("time"), path)
+        except ValueError as error:
+            problems.append("%s: %s" % (where, error))
+        dataset = parent = None
+        if entry.get("dataset") is not None:
+            dataset = datasets.get(_reference(entry["dataset"]))
+            if dataset is None:
+                problems.append("%s: unknown dataset %s" % (where, entry["dataset"]))
+            else:
+                row["source_dataset_id"] = dataset[0]
+        if entry.get("parent") is not None:
+            parent = registered.get(_reference(entry["parent"])) or parents.get(_reference(entry["parent"]))
+            if parent is None:
+                problems.append("%s: unknown parent sample %s" % (where, entry["parent"]))
+            else:
+                row["source_sample_id"] = parent[0]
+        # the number of processed events is taken from the source sample, or from the source dataset
+        processed = entry.get("processed")
+        if processed is None and parent is not None:
+            processed = parent[1]
+        if processed is None and dataset is not None:
+            processed = dataset[1]
+        row["nevents_processed"] = processed
+        registered[name] = (row["sample_id"], processed)
+        samples.append((row, given))
+    if problems:
+        raise ManifestError(problems)
+    return samples
+
+def register_samples(store, entries, read_file, workers=8, commit_each=False, stream=sys.stdout):
+    """insert the samples of manifest entries, and their files. The files of all the samples are listed,
+       and read with read_file(path), giving (event weight sum, number of entries), by the same pool of
+       workers processes. Each sample is committed when its files are read, or, by default, nothing is committed."""
+    from multiprocessing import Pool
+    from .SAMADhi import Sample
+    samples = prepare_samples(store, entries)
+    listed = filescan.scan_many([ row["path"] for row, files in samples if files is None ], workers=workers)
+    listed.reverse()
+    files = [ listed.pop() if given is None else [ filescan.list_file(_text(path)) for path in given ] for row, given in samples ]
+    summary = Registration("samples")
+    summary.rows = { "sample" : 0, "file" : 0 }
+    pool = Pool(workers)
+    try:
+        contents = pool.imap(read_file, [ path for found in files for path, size, mtime in found ], chunksize=4)
+        for (row, given), found in zip(samples, files):
+            rows = [ (row["sample_id"], path, path)+next(contents)+(size, mtime) for path, size, mtime in found ]
+            summary.rows["sample"] += schema.insert_rows(store, "sample", SAMPLE_COLUMNS, [ tuple(row[column] for column in SAMPLE_COLUMNS) ])
+            summary.rows["file"] += schema.insert_rows(store, "file", FILE_COLUMNS, rows)
+            # the luminosity is computed as by add_sample.py, if not given
+            if row["luminosity"] is None:
+                sample = store.get(Sample, row["sample_id"])
+                sample.luminosity = sample.getLuminosity()
+            summary.entries.append((row["sample_id"], row["name"], len(rows)))
+            stream.write("%s: %d files\n" % (row["name"], len(rows)))
+            if commit_each:
+                store.commit()
+    finally:
+        pool.terminate()
+    return summary
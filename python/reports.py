@@ -0,0 +1,85 @@
+"""Serialization of the catalog entries for the JSON reports (see SAMADhi_dbAnalysis.py).
+   The rows are read as tuples of the needed columns, in chunks of primary keys, instead of
+   as Storm objects, and turned into dictionaries with the layout of the class (attribute names
+   and columns, computed once per class). The reports are written member by member, and the
+   lists given as iterators item by item, so that their size is not bounded by the memory."""
+
+import gzip
+import json
+import datetime
+from storm.info import get_cls_info
+from .SAMADhi import iter_chunks
+
+_layouts = {}
+
+def layout(cls):
+    """(attribute names, columns) of a model class, in the order of the table"""
+    if cls not in _layouts:
+        info = get_cls_info(cls)
+        attributes = sorted(info.attributes.items(), key=lambda item: info.columns.index(item[1]))
+        _layouts[cls] = (tuple(name for name, column in attributes), tuple(column for name, column in attributes))
+    return _layouts[cls]
+
+def encode_storm_object(obj):
+    """json default hook for Storm objects (a dictionary of their columns) and dates"""
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return str(obj)
+    if not hasattr(obj, "__storm_table__"):
+        raise TypeError(repr(obj) + " is not JSON serializable")
+    names, columns = layout(type(obj))
+    return dict((name, getattr(obj, name)) for name in names)
+
+def iter_records(store, cls, *conditions, **kwargs):
+    """dictionaries of the columns of the matching rows, by increasing primary key.
+       The columns keyword argument restricts them to some attributes (the key is always included);
+       the rows are read in chunks of chunk_size keys (see SAMADhi.iter_chunks)."""
+    names, columns = layout(cls)
+    key = get_cls_info(cls).primary_key[0]
+    if kwargs.get("columns") is not None:
+        names = tuple(name for name in names if name in kwargs["columns"] or getattr(cls, name) is key)
+        columns = tuple(getattr(cls, name) for name in names)
+    for row in iter_chunks(store, cls, *conditions, columns=columns, chunk_size=kwargs.get("chunk_size", 10000)):
+        yield dict(zip(names, row))
+
+class ReportWriter(object):
+    """Writes a JSON object, one member at a time, optionally gzip-compressed (the .gz suffix is
+       then added to the path). Iterators (e.g. generators) are written as lists, item by item.
+       Without a path, nothing is written (dry runs)."""
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        if path is None:
+            self.output = None
+        elif compress:
+            self.path = path+".gz"
+            self.output = gzip.open(self.path, "wb")
+        else:
+            self.output = open(path, "w")
+        self.members = 0
+        self._write("{")
+
+    def _write(self, text):
+        if self.output is not None:
+            self.output.write(text)
+
+    def write(self, name, value):
+        self._write("%s\n%s: " % ("," if self.members else "", json.dumps(name)))
+        self.members += 1
+        if hasattr(value, "next") or hasattr(value, "__next__"):
+            self._write("[")
+            for i, item in enumerate(value):
+                self._write("%s%s" % (", " if i else "", json.dumps(item, default=encode_storm_object)))
+            self._write("]")
+        elif self.output is not None:
+            json.dump(value, self.output, default=encode_storm_object)
+
+    def close(self):
+        self._write("\n}\n")
+        if self.output is not None:
+            self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
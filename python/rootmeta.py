@@ -0,0 +1,291 @@
+"""Metadata of the ROOT files of a sample, as stored in the file table: the sum of the event weights
+   (the event_weight_sum TParameter<double>) and the number of entries of the tree t.
+   Two backends read them:
+     python: a minimal reader of the ROOT file format, without ROOT. Only the file header, the keys of
+             the top directory and the records of the two objects are read; of the tree record, only the
+             beginning is decompressed and decoded, up to fEntries (the branches are skipped).
+             Local files only. Objects compressed with zlib are always readable; with LZMA, LZ4 or ZSTD,
+             the lzma (backports.lzma with Python 2), lz4 or zstandard module is needed.
+     pyroot: TFile.Open with PyROOT, also for remote files (root://, ...).
+   The default (auto) is the python reader, with PyROOT as a fallback for the files it cannot read.
+   Other backends are added with register_backend(name, read), read(path) giving the same tuple.
+
+   Example:
+     weight_sum, entries = file_metadata("/storage/data/output_1.root")"""
+
+import zlib
+import struct
+from collections import namedtuple, OrderedDict
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+WEIGHT_SUM = "event_weight_sum"
+TREE = "t"
+
+class RootFormatError(Exception):
+    """the file cannot be read without ROOT (not a ROOT file, truncated, unsupported object or compression)"""
+    pass
+
+Key = namedtuple("Key", ["classname", "name", "cycle", "seek", "nbytes", "keylen", "objlen"])
+
+_BYTE_COUNT = 0x40000000
+_IS_REFERENCED = 1<<4
+
+def _string(data, position):
+    """TString at a position: (text, position after it)"""
+    length, = struct.unpack_from(">B", data, position)
+    position += 1
+    if length == 255:
+        length, = struct.unpack_from(">i", data, position)
+        position += 4
+    return data[position:position+length].decode("latin-1"), position+length
+
+def _key(data, position):
+    """TKey header at a position: (Key, position after it)"""
+    nbytes, version, objlen, datime, keylen, cycle = struct.unpack_from(">ihiIhh", data, position)
+    position += 18
+    # 64 bits offsets in the keys of large files
+    if version > 1000:
+        seek, parent = struct.unpack_from(">qq", data, position)
+        position += 16
+    else:
+        seek, parent = struct.unpack_from(">ii", data, position)
+        position += 8
+    classname, position = _string(data, position)
+    name, position = _string(data, position)
+    title, position = _string(data, position)
+    return Key(classname, name, cycle, seek, nbytes, keylen, objlen), position
+
+def _version(data, position):
+    """byte count and version of a streamed object: (version, start of its members, end of the object or None)"""
+    count, = struct.unpack_from(">I", data, position)
+    if count & _BYTE_COUNT:
+        version, = struct.unpack_from(">h", data, position+4)
+        return version, position+6, position+4+(count & ~_BYTE_COUNT)
+    version, = struct.unpack_from(">h", data, position)
+    return version, position+2, None
+
+def _skip_tobject(data, position):
+    version, = struct.unpack_from(">h", data, position)
+    position += 2
+    if version & 0x4000:
+        position += 4
+    unique_id, bits = struct.unpack_from(">II", data, position)
+    position += 8
+    if bits & _IS_REFERENCED:
+        position += 2
+    return position
+
+def _decompress(path, algorithm, block, size, limit):
+    """one compressed block of a record (limit: number of bytes needed, None for all)"""
+    if algorithm == b"ZL":
+        if limit is None:
+            return zlib.decompress(block)
+        return zlib.decompressobj().decompress(block, limit)
+    if algorithm == b"XZ" and lzma is not None:
+        return lzma.decompress(block)
+    if algorithm == b"L4" and lz4 is not None:
+        # the block starts with a checksum
+        return lz4.block.decompress(block[8:], uncompressed_size=size)
+    if algorithm == b"ZS" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(block, max_output_size=size)
+    raise RootFormatError("%s: compression %r is not supported" % (path, algorithm))
+
+class RootFile(object):
+    """keys of the top directory of a local ROOT file, and their objects, read with plain file reads"""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, "rb")
+        try:
+            self.keys = self._read_keys()
+        except:
+            self.handle.close()
+            raise
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, position, size):
+        if position < 0:
+            raise RootFormatError("%s is corrupted" % self.path)
+        self.handle.seek(position)
+        data = self.handle.read(size)
+        if len(data) < size:
+            raise RootFormatError("%s is truncated" % self.path)
+        return data
+
+    def _read_keys(self):
+        """the keys of the top directory, with the highest cycle of each name"""
+        header = self._read(0, 64)
+        magic, version, begin = struct.unpack_from(">4sii", header)
+        if magic != b"root":
+            raise RootFormatError("%s is not a ROOT file" % self.path)
+        # fEND, fSeekFree, fNbytesFree, nfree, fNbytesName
+        if version < 1000000:
+            nbytes_name, = struct.unpack_from(">i", header, 28)
+        else:
+            nbytes_name, = struct.unpack_from(">i", header, 36)
+        # the top directory record follows the key and name of the file
+        directory = self._read(begin+nbytes_name, 42)
+        version, = struct.unpack_from(">h", directory)
+        nbytes_keys, = struct.unpack_from(">i", directory, 10)
+        # fSeekDir, fSeekParent and fSeekKeys are 64 bits in large files
+        if version > 1000:
+            seek_keys, = struct.unpack_from(">q", directory, 34)
+        else:
+            seek_keys, = struct.unpack_from(">i", directory, 26)
+        data = self._read(seek_keys, nbytes_keys)
+        key, position = _key(data, 0)
+        count, = struct.unpack_from(">i", data, key.keylen)
+        position = key.keylen+4
+        keys = {}
+        for i in range(count):
+            key, position = _key(data, position)
+            if key.name not in keys or key.cycle > keys[key.name].cycle:
+                keys[key.name] = key
+        return keys
+
+    def data(self, key, size=None):
+        """the (uncompressed) record of a key: its first size bytes at least, or all of it"""
+        start, length = key.seek+key.keylen, key.nbytes-key.keylen
+        if key.objlen == length:
+            return self._read(start, length if size is None else min(size, length))
+        blocks, read, position = [], 0, 0
+        record = self._read(start, length)
+        while position < length and (size is None or read < size):
+            algorithm = record[position:position+2]
+            c0, c1, c2, u0, u1, u2 = struct.unpack_from(">6B", record, position+3)
+            compressed, uncompressed = c0|c1<<8|c2<<16, u0|u1<<8|u2<<16
+            block = _decompress(self.path, algorithm, record[position+9:position+9+compressed], uncompressed,
+                                None if size is None else size-read)
+            blocks.append(block)
+            read += len(block)
+            position += 9+compressed
+        return b"".join(blocks)
+
+    def parameter(self, name):
+        """value of a TParameter<double>, None if there is no such key"""
+        key = self.keys.get(name)
+        if key is None:
+            return None
+        if key.classname != "TParameter<double>":
+            raise RootFormatError("%s in %s is a %s" % (name, self.path, key.classname))
+        data = self.data(key)
+        version, position, end = _version(data, 0)
+        position = _skip_tobject(data, position)
+        parameter_name, position = _string(data, position)
+        value, = struct.unpack_from(">d", data, position)
+        return value
+
+    def entries(self, name, prefix=4096):
+        """fEntries of a TTree, None if there is no such key. Only the first bytes of the record are read
+           (all of it, if the title of the tree does not fit in prefix)."""
+        key = self.keys.get(name)
+        if key is None:
+            return None
+        if key.classname != "TTree":
+            raise RootFormatError("%s in %s is a %s" % (name, self.path, key.classname))
+        data = self.data(key, prefix)
+        try:
+            return self._tree_entries(data)
+        except struct.error:
+            return self._tree_entries(self.data(key))
+
+    def _tree_entries(self, data):
+        version, position, end = _version(data, 0)
+        if version < 16:
+            raise RootFormatError("TTree version %d in %s is not supported" % (version, self.path))
+        # TNamed, TAttLine, TAttFill and TAttMarker, skipped with their byte counts
+        for base in range(4):
+            base_version, start, position = _version(data, position)
+            if position is None:
+                raise RootFormatError("TTree in %s has no byte counts" % self.path)
+        entries, = struct.unpack_from(">q", data, position)
+        return entries
+
+def read_python(path):
+    """(event weight sum, number of entries) read without ROOT. (None, None) if the file cannot be opened"""
+    if "://" in path and not path.startswith("file://"):
+        raise RootFormatError("%s is not a local file" % path)
+    try:
+        rootfile = RootFile(path[7:] if path.startswith("file://") else path)
+    except (IOError, OSError):
+        return (None, None)
+    except struct.error as error:
+        raise RootFormatError("%s: %s" % (path, error))
+    with rootfile:
+        try:
+            return (rootfile.parameter(WEIGHT_SUM), rootfile.entries(TREE))
+        except (struct.error, zlib.error) as error:
+            raise RootFormatError("%s: %s" % (path, error))
+
+def read_pyroot(path):
+    """(event weight sum, number of entries) read with PyROOT. (None, None) if the file cannot be opened"""
+    import ROOT
+
+    f = ROOT.TFile.Open(path)
+    if not f:
+        return (None, None)
+
+    weight_sum = f.Get(WEIGHT_SUM)
+    if weight_sum:
+        weight_sum = weight_sum.GetVal()
+    else:
+        weight_sum = None
+
+    entries = None
+    tree = f.Get(TREE)
+    if tree:
+        entries = tree.GetEntriesFast()
+
+    f.Close()
+    return (weight_sum, entries)
+
+def _pyroot_available():
+    try:
+        import ROOT
+    except ImportError:
+        return False
+    return True
+
+def read_auto(path):
+    """the python reader, or PyROOT for the files it cannot read"""
+    try:
+        return read_python(path)
+    except RootFormatError as error:
+        if not _pyroot_available():
+            raise RootFormatError("%s (and PyROOT is not available)" % error)
+        return read_pyroot(path)
+
+BACKENDS = OrderedDict([ ("auto", read_auto), ("python", read_python), ("pyroot", read_pyroot) ])
+
+def register_backend(name, read):
+    """add a backend: read(path) gives the (event weight sum, number of entries) of a file"""
+    BACKENDS[name] = read
+
+def file_metadata(path, backend="auto"):
+    """(event weight sum, number of entries of the tree t) of a file, None for the missing objects"""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend %s (possible backends: %s)" % (backend, ", ".join(BACKENDS)))
+    return BACKENDS[backend](path)
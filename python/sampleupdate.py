@@ -0,0 +1,89 @@
+"""Update of an existing sample from a new version of it, touching only what changed.
+   Sample.replaceBy copies every column, and replacing the files means deleting all the File
+   rows of the sample and inserting them again. Here the stored sample and its files are compared
+   to the new ones (the files by lfn), and only the changed columns, and the added, removed or
+   modified files, are written, with chunked multi-row statements.
+
+   Example:
+     changes = diff_sample(dbstore, existing, sample, files)
+     print(changes)
+     apply_sample_changes(dbstore, existing, changes)"""
+
+from . import schema
+
+# columns of the sample copied by Sample.replaceBy
+SAMPLE_COLUMNS = ("name", "path", "sampletype", "nevents_processed", "nevents", "normalization", "event_weight_sum",
+                  "extras_event_weight_sum", "luminosity", "code_version", "user_comment", "source_dataset_id",
+                  "source_sample_id", "author", "creation_time")
+
+# columns of a file compared, besides its lfn
+FILE_COLUMNS = ("pfn", "event_weight_sum", "extras_event_weight_sum", "nevents", "size", "mtime")
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+class SampleChanges(object):
+    """Differences between a stored sample and a new version of it"""
+
+    def __init__(self):
+        self.columns = {}   # name: (stored value, new value)
+        self.new_files = [] # tuples of the lfn and FILE_COLUMNS
+        self.removed = []   # (id, lfn)
+        self.modified = []  # (id, { column: new value })
+
+    def __len__(self):
+        return len(self.columns)+len(self.new_files)+len(self.removed)+len(self.modified)
+
+    def __str__(self):
+        lines = [ "  %s: %s -> %s" % (name, old, new) for name, (old, new) in sorted(self.columns.items()) ]
+        lines.append("  files: %d added, %d removed, %d modified" % (len(self.new_files), len(self.removed), len(self.modified)))
+        return "\n".join(lines)
+
+def diff_sample(store, existing, sample, files=None):
+    """changes from the stored sample existing to the new sample and its files (File objects, not in the store).
+       If files is None, the files of the stored sample are kept."""
+    changes = SampleChanges()
+    for name in SAMPLE_COLUMNS:
+        old, new = getattr(existing, name), getattr(sample, name)
+        if old != new:
+            changes.columns[name] = (old, new)
+    if files is None:
+        return changes
+    new_files = dict((f.lfn, tuple(getattr(f, column) for column in FILE_COLUMNS)) for f in files)
+    for row in store.execute("SELECT id, lfn, %s FROM file WHERE sample_id = ?" % ", ".join(FILE_COLUMNS), (existing.sample_id,)):
+        file_id, lfn, stored = row[0], row[1], row[2:]
+        if lfn not in new_files:
+            changes.removed.append((file_id, lfn))
+            continue
+        values = new_files.pop(lfn)
+        # an unknown size or modification time (e.g. of a remote file) does not replace the stored one
+        modified = dict((column, new) for column, old, new in zip(FILE_COLUMNS, stored, values)
+                        if old != new and not (new is None and column in ("size", "mtime")))
+        if modified:
+            changes.modified.append((file_id, modified))
+    changes.new_files = sorted((lfn,)+values for lfn, values in new_files.items())
+    return changes
+
+def apply_sample_changes(store, existing, changes):
+    """write the changes to the stored sample and its files"""
+    for name, (old, new) in changes.columns.items():
+        setattr(existing, name, new)
+    store.flush()
+    ids = sorted(file_id for file_id, lfn in changes.removed)
+    for i in range(0, len(ids), ID_CHUNK):
+        chunk = ids[i:i+ID_CHUNK]
+        store.execute("DELETE FROM file WHERE %s" % _in("id", chunk), chunk, noresult=True)
+    # one multi-row UPDATE per chunk of the files with the same modified columns
+    modified_rows = {}
+    for file_id, modified in changes.modified:
+        # the checksums of a file that changed on disk are dropped (see checksums.py)
+        if "size" in modified or "mtime" in modified:
+            modified = dict(modified, adler32=None, xxhash64=None)
+        columns = tuple(sorted(modified))
+        modified_rows.setdefault(columns, []).append((file_id,)+tuple(modified[column] for column in columns))
+    for columns, rows in sorted(modified_rows.items()):
+        schema.update_rows(store, "file", "id", columns, rows)
+    schema.insert_rows(store, "file", ("sample_id", "lfn")+FILE_COLUMNS, ((existing.sample_id,)+row for row in changes.new_files))
@@ -0,0 +1,365 @@
+"""Helpers to manipulate the database layout: SQLite version of the
+   catalog tables, indexes of the hot query paths and bulk inserts and updates.
+   The MySQL layout is the one of data/SAMADhi.sql"""
+
+#SQLite version of the v6 tables (see data/SAMADhi.sql for the MySQL ones)
+
+SQLITE_TABLES = [
+"""CREATE TABLE analysis
+(
+analysis_id INTEGER PRIMARY KEY AUTOINCREMENT,
+description TEXT,
+cadiline TEXT,
+contact TEXT
+)""",
+"""CREATE TABLE dataset
+(
+dataset_id INTEGER PRIMARY KEY AUTOINCREMENT,
+name VARCHAR(255) NOT NULL,
+datatype VARCHAR(255) NOT NULL,
+process VARCHAR(255),
+nevents INTEGER,
+dsize BIGINT,
+xsection FLOAT,
+cmssw_release VARCHAR(255),
+globaltag VARCHAR(255),
+energy FLOAT,
+creation_time DATETIME,
+user_comment TEXT
+)""",
+"""CREATE TABLE sample
+(
+sample_id INTEGER PRIMARY KEY AUTOINCREMENT,
+name VARCHAR(255) NOT NULL,
+path VARCHAR(255) NOT NULL,
+sampletype VARCHAR(255) NOT NULL,
+nevents_processed INTEGER,
+nevents INTEGER,
+normalization FLOAT NOT NULL DEFAULT 1.0,
+event_weight_sum DOUBLE NOT NULL DEFAULT 1.0,
+extras_event_weight_sum TEXT,
+processed_lumi TEXT,
+luminosity FLOAT,
+code_version VARCHAR(255),
+user_comment TEXT,
+author TEXT,
+creation_time TIMESTAMP,
+source_dataset_id INTEGER REFERENCES dataset(dataset_id),
+source_sample_id INTEGER REFERENCES sample(sample_id)
+)""",
+"""CREATE TABLE result
+(
+result_id INTEGER PRIMARY KEY AUTOINCREMENT,
+path VARCHAR(255) NOT NULL,
+description TEXT,
+author TEXT,
+creation_time TIMESTAMP,
+analysis_id INTEGER NULL REFERENCES analysis(analysis_id),
+elog VARCHAR(255)
+)""",
+"""CREATE TABLE sampleresult
+(
+sample_id INTEGER NOT NULL REFERENCES sample(sample_id),
+result_id INTEGER NOT NULL REFERENCES result(result_id),
+PRIMARY KEY (sample_id, result_id)
+)""",
+"""CREATE TABLE file
+(
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+sample_id INTEGER NOT NULL REFERENCES sample(sample_id) ON DELETE CASCADE,
+lfn VARCHAR(500) NOT NULL,
+pfn VARCHAR(500) NOT NULL,
+event_weight_sum DOUBLE,
+extras_event_weight_sum TEXT,
+nevents BIGINT
+)""",
+]
+
+CATALOG_TABLES = [ "analysis", "dataset", "sample", "result", "sampleresult", "file" ]
+
+def get_dialect(store):
+    """returns the name of the backend behind a store: mysql or sqlite"""
+    return store.get_database().__class__.__name__.lower()
+
+class Index(object):
+    """One index on a table.
+       In SQLite index names are global to the database, so the v6 indexes,
+       which share the same name in several MySQL tables, carry a separate sqlite_name."""
+
+    def __init__(self, table, name, columns, unique=False, sqlite_name=None):
+        self.table = table
+        self.name = name
+        self.columns = tuple(columns)
+        self.unique = unique
+        self.sqlite_name = sqlite_name if sqlite_name is not None else name
+
+    def get_name(self, dialect):
+        return self.sqlite_name if dialect == "sqlite" else self.name
+
+    def create_statement(self, dialect):
+        """statement creating the index. On MySQL, it is built in place without blocking writes."""
+        kind = "UNIQUE INDEX" if self.unique else "INDEX"
+        if dialect == "mysql":
+            return "ALTER TABLE %s ADD %s %s (%s), ALGORITHM=INPLACE, LOCK=NONE" % (
+                    self.table, kind, self.name, ", ".join(self.columns))
+        return "CREATE %s %s ON %s (%s)" % (kind, self.get_name(dialect), self.table, ", ".join(self.columns))
+
+    def drop_statement(self, dialect):
+        """statement removing the index"""
+        if dialect == "mysql":
+            return "ALTER TABLE %s DROP INDEX %s" % (self.table, self.name)
+        return "DROP INDEX %s" % self.get_name(dialect)
+
+    def __str__(self):
+        return "%s%s on %s(%s)" % ("unique " if self.unique else "", self.name, self.table, ", ".join(self.columns))
+
+# indexes of the v6 schema
+BASELINE_INDEXES = [
+    Index("dataset", "idx_name", ("name",), sqlite_name="idx_dataset_name"),
+    Index("sample",  "idx_name", ("name",), sqlite_name="idx_sample_name"),
+    Index("result",  "idx_path", ("path",), sqlite_name="idx_result_path"),
+    ]
+
+# v6 indexes replaced by unique ones in v7
+SUPERSEDED_INDEXES = BASELINE_INDEXES[:2]
+
+# indexes added in v7 (see data/v6_to_v7_upgrade.sql)
+HOT_PATH_INDEXES = [
+    Index("dataset", "uq_dataset_name", ("name",), unique=True),
+    Index("dataset", "idx_dataset_process_energy", ("process", "energy")),
+    Index("dataset", "idx_dataset_creation_time", ("creation_time",)),
+    Index("sample", "uq_sample_name", ("name",), unique=True),
+    Index("sample", "idx_sample_source_dataset", ("source_dataset_id", "sampletype")),
+    Index("sample", "idx_sample_source_sample", ("source_sample_id",)),
+    Index("sample", "idx_sample_path", ("path",)),
+    Index("sample", "idx_sample_creation_time", ("creation_time",)),
+    Index("result", "idx_result_creation_time", ("creation_time",)),
+    Index("sampleresult", "idx_sampleresult_result", ("result_id", "sample_id")),
+    Index("file", "idx_file_sample", ("sample_id",)),
+    ]
+
+def create_sqlite_schema(store):
+    """create the v6 catalog tables and their indexes in an empty SQLite database"""
+    dialect = get_dialect(store)
+    if dialect != "sqlite":
+        raise ValueError("Only SQLite databases can be created this way, use data/SAMADhi.sql for %s" % dialect)
+    for statement in SQLITE_TABLES:
+        store.execute(statement, noresult=True)
+    for index in BASELINE_INDEXES:
+        store.execute(index.create_statement(dialect), noresult=True)
+    store.commit()
+
+def get_indexes(store, table):
+    """names of the indexes defined on a table"""
+    dialect = get_dialect(store)
+    if dialect == "mysql":
+        return set(row[2] for row in store.execute("SHOW INDEX FROM %s" % table))
+    return set(row[1] for row in store.execute("PRAGMA index_list(%s)" % table))
+
+def find_duplicated_names(store):
+    """(table, name, count) of the names that prevent the creation of the unique indexes"""
+    duplicates = []
+    for table in ("dataset", "sample"):
+        for name, count in store.execute("SELECT name, COUNT(*) FROM %s GROUP BY name HAVING COUNT(*) > 1" % table):
+            duplicates.append((table, name, count))
+    return duplicates
+
+def drop_indexes(store, indexes):
+    """drop the given indexes, if they exist"""
+    dialect = get_dialect(store)
+    for index in indexes:
+        if index.get_name(dialect) in get_indexes(store, index.table):
+            store.execute(index.drop_statement(dialect), noresult=True)
+    store.commit()
+
+def create_indexes(store, indexes):
+    """create the given indexes, unless they already exist"""
+    dialect = get_dialect(store)
+    for index in indexes:
+        if index.get_name(dialect) not in get_indexes(store, index.table):
+            store.execute(index.create_statement(dialect), noresult=True)
+    store.commit()
+
+def upgrade_indexes(store):
+    """v6 to v7 index upgrade: unique names and hot path indexes"""
+    duplicates = find_duplicated_names(store)
+    if duplicates:
+        raise ValueError("Cannot make names unique, duplicated entries: %s" %
+                         ", ".join("%s %s (%d times)" % dup for dup in duplicates))
+    create_indexes(store, HOT_PATH_INDEXES)
+    drop_indexes(store, SUPERSEDED_INDEXES)
+
+def downgrade_indexes(store):
+    """v7 to v6 index downgrade, mostly useful to benchmark the upgrade"""
+    create_indexes(store, SUPERSEDED_INDEXES)
+    drop_indexes(store, HOT_PATH_INDEXES)
+
+def analyze_tables(store, tables=CATALOG_TABLES):
+    """refresh the statistics used by the query planner"""
+    if get_dialect(store) == "mysql":
+        for table in tables:
+            store.execute("ANALYZE TABLE %s" % table).get_all()
+    else:
+        store.execute("ANALYZE", noresult=True)
+    store.commit()
+
+def insert_rows(store, table, columns, rows, chunk_size=None, replace=False):
+    """insert many rows at once, using multi-row INSERT statements.
+       rows can be any iterable of tuples, it is consumed chunk by chunk.
+       With replace, existing rows with the same key are overwritten.
+       Returns the number of inserted rows."""
+    if chunk_size is None:
+        # stay below the default limit of 999 bound parameters of SQLite
+        chunk_size = max(1, 999//len(columns))
+    verb = "INSERT"
+    if replace:
+        verb = "REPLACE" if get_dialect(store) == "mysql" else "INSERT OR REPLACE"
+    head = "%s INTO %s (%s) VALUES " % (verb, table, ", ".join(columns))
+    placeholder = "(%s)" % ", ".join("?" for c in columns)
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            store.execute(head + ", ".join(placeholder for r in chunk), [ v for r in chunk for v in r ], noresult=True)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        store.execute(head + ", ".join(placeholder for r in chunk), [ v for r in chunk for v in r ], noresult=True)
+        count += len(chunk)
+    return count
+
+def update_rows(store, table, key, columns, rows, chunk_size=None):
+    """update many rows at once, with one UPDATE statement (CASE on the key) per chunk.
+       rows can be any iterable of tuples of the key and the new values of the columns,
+       it is consumed chunk by chunk. Returns the number of updated rows."""
+    if chunk_size is None:
+        # a key and a value per column, and the key again in the IN list
+        chunk_size = max(1, 999//(2*len(columns)+1))
+    def update(chunk):
+        assignments = ", ".join("%s = CASE %s %s END" % (column, key, " ".join("WHEN ? THEN ?" for r in chunk)) for column in columns)
+        params = [ v for i in range(len(columns)) for r in chunk for v in (r[0], r[i+1]) ]+[ r[0] for r in chunk ]
+        store.execute("UPDATE %s SET %s WHERE %s IN (%s)" % (table, assignments, key, ", ".join("?" for r in chunk)), params, noresult=True)
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            update(chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        update(chunk)
+        count += len(chunk)
+    return count
+
+# change log of the updates and deletions, filled by triggers (v8), used to synchronize snapshots
+
+CHANGELOG_TABLE = {
+"mysql" : """CREATE TABLE IF NOT EXISTS changelog
+(
+change_id bigint NOT NULL AUTO_INCREMENT,
+tablename varchar(32) NOT NULL,
+row_id bigint NOT NULL,
+operation char(1) NOT NULL,
+changed_on datetime,
+PRIMARY KEY (change_id)
+) ENGINE = INNODB""",
+"sqlite" : """CREATE TABLE IF NOT EXISTS changelog
+(
+change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+tablename VARCHAR(32) NOT NULL,
+row_id BIGINT NOT NULL,
+operation CHAR(1) NOT NULL,
+changed_on DATETIME
+)""" }
+
+# (table, key column, logged operations). For sampleresult, the key is the sample.
+CHANGELOG_TRACKED = [
+    ("analysis", "analysis_id", ("UPDATE", "DELETE")),
+    ("dataset", "dataset_id", ("UPDATE", "DELETE")),
+    ("sample", "sample_id", ("UPDATE", "DELETE")),
+    ("result", "result_id", ("UPDATE", "DELETE")),
+    ("file", "id", ("UPDATE", "DELETE")),
+    ("sampleresult", "sample_id", ("INSERT", "DELETE")),
+    ]
+
+def changelog_triggers(dialect):
+    """(name, statement) of the triggers filling the change log.
+       On MySQL, logging can be switched off for a session with SET @samadhi_changelog_off = 1
+       (used by the migration backfills, after which snapshots are rebuilt anyway)."""
+    triggers = []
+    for table, key, operations in CHANGELOG_TRACKED:
+        for operation in operations:
+            name = "%s_%s_log" % (table, operation.lower())
+            row = "OLD" if operation == "DELETE" else "NEW"
+            if dialect == "mysql":
+                statement = ("CREATE TRIGGER %s AFTER %s ON %s FOR EACH ROW "
+                             "INSERT INTO changelog (tablename, row_id, operation, changed_on) "
+                             "SELECT '%s', %s.%s, '%s', NOW() FROM DUAL WHERE @samadhi_changelog_off IS NULL" %
+                             (name, operation, table, table, row, key, operation[0]))
+            else:
+                statement = ("CREATE TRIGGER %s AFTER %s ON %s FOR EACH ROW BEGIN "
+                             "INSERT INTO changelog (tablename, row_id, operation, changed_on) "
+                             "VALUES ('%s', %s.%s, '%s', CURRENT_TIMESTAMP); END" %
+                             (name, operation, table, table, row, key, operation[0]))
+            triggers.append((name, statement))
+    return triggers
+
+def get_triggers(store):
+    """names of the triggers defined in the database"""
+    if get_dialect(store) == "mysql":
+        return set(row[0] for row in store.execute("SHOW TRIGGERS"))
+    return set(row[0] for row in store.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'"))
+
+def create_changelog(store):
+    """create the change log table and its triggers, unless they exist"""
+    dialect = get_dialect(store)
+    store.execute(CHANGELOG_TABLE[dialect], noresult=True)
+    existing = get_triggers(store)
+    for name, statement in changelog_triggers(dialect):
+        if name not in existing:
+            store.execute(statement, noresult=True)
+    store.commit()
+
+def drop_changelog_triggers(store):
+    existing = get_triggers(store)
+    for name, statement in changelog_triggers(get_dialect(store)):
+        if name in existing:
+            store.execute("DROP TRIGGER %s" % name, noresult=True)
+    store.commit()
+
+def catalog_version(store):
+    """a value that changes whenever the catalog content changes: the last ids of the
+       main tables and, from v8, the last entry of the change log (the last synchronized one for a snapshot).
+       Caches of query results are keyed on it."""
+    tables = set(row[0] for row in store.execute(
+        "SHOW TABLES" if get_dialect(store) == "mysql" else "SELECT name FROM sqlite_master WHERE type = 'table'"))
+    parts = [ "(SELECT MAX(dataset_id) FROM dataset)", "(SELECT MAX(sample_id) FROM sample)",
+              "(SELECT MAX(result_id) FROM result)", "(SELECT COUNT(*) FROM sampleresult)" ]
+    if "changelog" in tables:
+        parts.append("(SELECT MAX(change_id) FROM changelog)")
+    elif "snapshot_state" in tables:
+        parts.append("(SELECT value FROM snapshot_state WHERE name = 'last_change_id')")
+    return tuple(store.execute("SELECT %s" % ", ".join(parts)).get_one())
+
+# hashed lfn (v9), to find the files registered in several samples with an index-only GROUP BY.
+# On MySQL it is a virtual generated column (no backfill, maintained by the server) with a compact index;
+# SQLite has no MD5 function, and the lfn itself is indexed instead.
+
+LFN_HASH = "CAST(CONV(LEFT(MD5(lfn), 15), 16, 10) AS SIGNED)"
+
+LFN_KEY = { "mysql" : "lfn_hash", "sqlite" : "lfn" }
+
+LFN_INDEXES = {
+    "mysql" : Index("file", "idx_file_lfn_hash", ("lfn_hash", "sample_id")),
+    "sqlite" : Index("file", "idx_file_lfn", ("lfn", "sample_id")),
+    }
+
+def create_lfn_hash(store):
+    """add the hashed lfn column (MySQL) and the index used to find duplicated files"""
+    from .migrations import get_columns
+    dialect = get_dialect(store)
+    if dialect == "mysql" and "lfn_hash" not in get_columns(store, "file"):
+        store.execute("ALTER TABLE file ADD COLUMN lfn_hash BIGINT AS (%s) VIRTUAL, ALGORITHM=INPLACE, LOCK=NONE" % LFN_HASH, noresult=True)
+    create_indexes(store, [ LFN_INDEXES[dialect] ])
@@ -0,0 +1,360 @@
+"""Read-only JSON service for the catalog.
+   Paginated and filterable endpoints for the datasets, samples, results and analyses,
+   e.g. /samples?name=TT*&sampletype=PAT&page=2&per_page=50 or /samples/123 (with the lineage
+   of the sample, its results and a summary of its files). Filters on text columns accept
+   the * and ? wildcards.
+
+   The responses are kept in an in-process cache keyed on the catalog version
+   (see schema.catalog_version), which is read from the database at most every version_ttl
+   seconds: any change of the catalog invalidates all cached responses at once. The ETag of
+   a response depends only on the catalog version, the URL and the content coding (gzipped
+   responses, sent to the clients that accept it, have a -gzip suffix), so a client sending it
+   back in If-None-Match gets a 304 without any query.
+
+   The requests are handled by a fixed pool of threads, each with its own store (the same
+   arguments as DbStore, e.g. snapshot=... to serve a local snapshot)."""
+
+import sys
+import gzip
+import json
+import time
+import hashlib
+import datetime
+import threading
+from io import BytesIO
+from storm.expr import Like
+from storm.info import get_cls_info
+from .SAMADhi import DbStore, Dataset, Sample, Result, Analysis, SampleResult
+from .cache import LRUCache
+from . import schema, lineage
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import urlsplit, parse_qsl
+    import Queue as queue
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qsl
+    import queue
+
+# responses smaller than this are not compressed
+GZIP_MIN_SIZE = 1024
+
+class Resource(object):
+    """A model class exposed as /<name> and /<name>/<id>.
+       The filters map a query parameter to a column: text columns are compared with LIKE
+       when the value contains wildcards, the others are converted with the given type.
+       The large columns are only given for a single object."""
+
+    def __init__(self, name, cls, filters, large=()):
+        self.name = name
+        self.cls = cls
+        self.info = get_cls_info(cls)
+        self.key = self.info.primary_key[0]
+        self.filters = filters
+        self.columns = [ (attribute, column) for attribute, column in
+                         sorted(self.info.attributes.items(), key=lambda item: self.info.columns.index(item[1])) ]
+        self.summary_columns = [ (attribute, column) for attribute, column in self.columns if attribute not in large ]
+
+    def conditions(self, query):
+        conditions = []
+        for parameter, value in query.items():
+            if parameter in ("page", "per_page"):
+                continue
+            if parameter not in self.filters:
+                raise ValueError("Unknown filter %s for %s (possible filters: %s)" % (parameter, self.name, ", ".join(sorted(self.filters))))
+            column, kind = self.filters[parameter]
+            if kind is unicode:
+                if '*' in value or '?' in value:
+                    conditions.append(Like(column, value.replace('*', '%').replace('?', '_')))
+                else:
+                    conditions.append(column == value)
+            else:
+                try:
+                    conditions.append(column == kind(value))
+                except ValueError:
+                    raise ValueError("Invalid value for %s: %s" % (parameter, value))
+        return conditions
+
+    def to_dict(self, obj, full=False):
+        return dict((attribute, _jsonable(getattr(obj, attribute))) for attribute, column in (self.columns if full else self.summary_columns))
+
+def _jsonable(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+RESOURCES = dict((resource.name, resource) for resource in (
+    Resource("datasets", Dataset, {
+        "name" : (Dataset.name, unicode), "process" : (Dataset.process, unicode), "datatype" : (Dataset.datatype, unicode),
+        "cmssw_release" : (Dataset.cmssw_release, unicode), "globaltag" : (Dataset.globaltag, unicode), "energy" : (Dataset.energy, float) }),
+    Resource("samples", Sample, {
+        "name" : (Sample.name, unicode), "path" : (Sample.path, unicode), "sampletype" : (Sample.sampletype, unicode),
+        "author" : (Sample.author, unicode), "code_version" : (Sample.code_version, unicode),
+        "source_dataset" : (Sample.source_dataset_id, int), "source_sample" : (Sample.source_sample_id, int) },
+        large=("processed_lumi", "extras_event_weight_sum")),
+    Resource("results", Result, {
+        "path" : (Result.path, unicode), "description" : (Result.description, unicode), "author" : (Result.author, unicode),
+        "analysis" : (Result.analysis_id, int) }),
+    Resource("analyses", Analysis, {
+        "description" : (Analysis.description, unicode), "contact" : (Analysis.contact, unicode), "cadiline" : (Analysis.cadiline, unicode) }),
+    ))
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def _sample_details(store, sample):
+    """lineage (source dataset, chain of source samples, derived samples), results and files of a sample"""
+    graph = lineage.ancestors(store, samples=[sample.sample_id])
+    parents, node = [], ("sample", sample.sample_id)
+    while True:
+        node = ([ parent for parent in graph.parents(node) if parent[0] == "sample" ] or [ None ])[0]
+        if node is None or node[1] == sample.sample_id or len(parents) > len(graph.samples):
+            break
+        parents.append({ "sample_id" : node[1], "name" : graph.samples[node[1]] })
+    dataset = sample.source_dataset
+    nfiles, nevents, weight_sum = store.execute("SELECT COUNT(*), SUM(nevents), SUM(event_weight_sum) FROM file WHERE sample_id = ?",
+                                                (sample.sample_id,)).get_one()
+    return {
+        "lineage" : {
+            "dataset" : None if dataset is None else { "dataset_id" : dataset.dataset_id, "name" : dataset.name },
+            "parents" : parents,
+            "derived" : [ { "sample_id" : sample_id, "name" : name } for sample_id, name in
+                          store.find((Sample.sample_id, Sample.name), Sample.source_sample_id == sample.sample_id).order_by(Sample.sample_id) ] },
+        "results" : [ result_id for result_id, in store.execute(
+                      "SELECT result_id FROM sampleresult WHERE sample_id = ? ORDER BY result_id", (sample.sample_id,)) ],
+        # SUM gives a decimal on MySQL
+        "files" : { "count" : nfiles, "nevents" : None if nevents is None else int(nevents),
+                    "event_weight_sum" : None if weight_sum is None else float(weight_sum) },
+        }
+
+def _samples_of(store, condition):
+    return [ { "sample_id" : sample_id, "name" : name } for sample_id, name in
+             store.find((Sample.sample_id, Sample.name), condition).order_by(Sample.sample_id) ]
+
+DETAILS = {
+    "samples" : _sample_details,
+    "datasets" : lambda store, dataset: { "samples" : _samples_of(store, Sample.source_dataset_id == dataset.dataset_id) },
+    "results" : lambda store, result: { "samples" : _samples_of(store, (Sample.sample_id == SampleResult.sample_id) & (SampleResult.result_id == result.result_id)) },
+    "analyses" : lambda store, analysis: { "results" : [ { "result_id" : result_id, "path" : path } for result_id, path in
+                                           store.find((Result.result_id, Result.path), Result.analysis_id == analysis.analysis_id).order_by(Result.result_id) ] },
+    }
+
+def gzip_etag(etag):
+    """ETag of the gzipped body of a response: the two bodies differ, so their strong ETags must too"""
+    return etag[:-1]+'-gzip"'
+
+def matching_etag(etag, header):
+    """the ETag of If-None-Match matching a response, of its identity or gzipped body (weak or not), or None"""
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return etag
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag in (etag, gzip_etag(etag)):
+            return tag
+    return None
+
+class CatalogService(object):
+    """Answers the requests (path and query parameters) with cached JSON documents.
+       The arguments other than the cache settings are passed to DbStore."""
+
+    def __init__(self, cache_size=1000, version_ttl=5., per_page=100, max_per_page=1000, **options):
+        self.options = options
+        self.cache = LRUCache(cache_size)
+        self.version_ttl = version_ttl
+        self.per_page = per_page
+        self.max_per_page = max_per_page
+        self.local = threading.local()
+        self.version_lock = threading.Lock()
+        self.current_version = None
+        self.version_checked = 0.
+
+    def store(self):
+        """store of the current thread"""
+        if getattr(self.local, "store", None) is None:
+            self.local.store = DbStore(**self.options)
+        return self.local.store
+
+    def close_store(self):
+        if getattr(self.local, "store", None) is not None:
+            self.local.store.close()
+            self.local.store = None
+
+    def version(self):
+        """catalog version, read from the database at most every version_ttl seconds"""
+        with self.version_lock:
+            if self.current_version is None or time.time()-self.version_checked > self.version_ttl:
+                store = self.store()
+                self.current_version = schema.catalog_version(store)
+                store.rollback()
+                self.version_checked = time.time()
+            return self.current_version
+
+    def etag(self, version, url):
+        return '"%s"' % hashlib.md5(("%r %s" % (version, url)).encode("utf-8")).hexdigest()
+
+    def get(self, url):
+        """(ETag, JSON document, gzipped document or None) for a URL, from the cache if possible"""
+        version = self.version()
+        try:
+            return self.cache.get((version, url))
+        except KeyError:
+            pass
+        store = self.store()
+        try:
+            document = self.query(store, url)
+        finally:
+            # do not keep a transaction open: the next request sees the latest data
+            store.rollback()
+        body = json.dumps(document, sort_keys=True).encode("utf-8")
+        compressed = None
+        if len(body) >= GZIP_MIN_SIZE:
+            buf = BytesIO()
+            with gzip.GzipFile(mode="wb", fileobj=buf, mtime=0) as zipped:
+                zipped.write(body)
+            compressed = buf.getvalue()
+        response = (self.etag(version, url), body, compressed)
+        self.cache.put((version, url), response)
+        return response
+
+    def query(self, store, url):
+        parts = urlsplit(url)
+        path = [ part for part in parts.path.split("/") if part ]
+        query = dict((key, value.decode("utf-8") if isinstance(value, bytes) else value) for key, value in parse_qsl(parts.query))
+        if not path:
+            return { "endpoints" : sorted("/"+name for name in RESOURCES)+["/version"] }
+        if path == ["version"]:
+            return { "version" : list(schema.catalog_version(store)) }
+        if path[0] not in RESOURCES or len(path) > 2:
+            raise HTTPError(404, "No such endpoint: %s" % parts.path)
+        resource = RESOURCES[path[0]]
+        if len(path) == 2:
+            try:
+                obj = store.get(resource.cls, int(path[1]))
+            except ValueError:
+                obj = None
+            if obj is None:
+                raise HTTPError(404, "No %s with id %s" % (resource.name, path[1]))
+            document = resource.to_dict(obj, full=True)
+            document.update(DETAILS[resource.name](store, obj))
+            return document
+        try:
+            page = int(query.get("page", 1))
+            per_page = min(int(query.get("per_page", self.per_page)), self.max_per_page)
+            conditions = resource.conditions(query)
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+        if page < 1 or per_page < 1:
+            raise HTTPError(400, "page and per_page must be positive")
+        result = store.find(resource.cls, *conditions)
+        total = result.count()
+        items = result.order_by(resource.key)[(page-1)*per_page:page*per_page]
+        return { "items" : [ resource.to_dict(obj) for obj in items ], "page" : page, "per_page" : per_page,
+                 "total" : total, "pages" : (total+per_page-1)//per_page }
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server_version = "SAMADhi"
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        service = self.server.service
+        try:
+            matched = matching_etag(service.etag(service.version(), self.path), self.headers.get("If-None-Match", ""))
+            if matched is not None:
+                self.send_response(304)
+                self.send_header("ETag", matched)
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return
+            etag, body, compressed = service.get(self.path)
+            status = 200
+        except HTTPError as error:
+            status, etag, compressed = error.status, None, None
+            body = json.dumps({ "error" : str(error) }).encode("utf-8")
+        except Exception as error:
+            self.log_error("%s", repr(error))
+            service.close_store()
+            status, etag, compressed = 500, None, None
+            body = json.dumps({ "error" : "Internal error" }).encode("utf-8")
+        if compressed is not None and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = compressed
+            etag = gzip_etag(etag)
+        else:
+            compressed = None
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+        if compressed is not None:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class CatalogServer(HTTPServer):
+    """HTTP server with a fixed pool of threads, each with its own store"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, workers=8, quiet=False):
+        HTTPServer.__init__(self, address, _Handler)
+        self.service = service
+        self.quiet = quiet
+        self.requests = queue.Queue()
+        self.workers = [ threading.Thread(target=self._work) for i in range(workers) ]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def _work(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+        self.service.close_store()
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        for worker in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+
+def serve(host="localhost", port=8080, workers=8, quiet=False, stream=sys.stderr, **options):
+    """run the service until interrupted; the other arguments are passed to CatalogService"""
+    server = CatalogServer((host, port), CatalogService(**options), workers=workers, quiet=quiet)
+    stream.write("Serving the catalog on http://%s:%d/\n" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
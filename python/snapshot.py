@@ -0,0 +1,201 @@
+"""Local read-only SQLite snapshot of the catalog.
+   The snapshot is a copy of the catalog tables, which batch jobs and interactive
+   sessions can query without a connection to the database server
+   (see DbStore(snapshot=...) and the SAMADHI_SNAPSHOT environment variable).
+   It is synchronized incrementally: new rows are copied from their increasing id, and
+   updates and deletions are replayed from the change log filled by triggers (schema v8).
+   The synchronization works on a copy of the snapshot, which then replaces the previous
+   one atomically, so that readers always see a consistent snapshot."""
+
+import os
+import sys
+import time
+import shutil
+from collections import defaultdict
+from datetime import datetime
+from storm.locals import Store, create_database
+from . import schema
+from .migrations import MigrationRunner, Progress, get_columns, has_table
+
+# tables with an increasing integer key, in the order in which they are copied
+KEYED_TABLES = [
+    ("analysis", "analysis_id"),
+    ("dataset", "dataset_id"),
+    ("sample", "sample_id"),
+    ("result", "result_id"),
+    ("file", "id"),
+    ]
+
+STATE_TABLE = """CREATE TABLE IF NOT EXISTS snapshot_state
+(
+name VARCHAR(64) PRIMARY KEY,
+value TEXT
+)"""
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def open_snapshot(path):
+    """read-only store on a snapshot"""
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        raise IOError('Snapshot %r not found.' % path)
+    store = Store(create_database("sqlite:%s" % path))
+    store.execute("PRAGMA query_only = ON", noresult=True)
+    return store
+
+def get_state(store):
+    """synchronization state of a snapshot: schema version, last copied ids and change, times"""
+    if not has_table(store, "snapshot_state"):
+        return {}
+    return dict(store.execute("SELECT name, value FROM snapshot_state"))
+
+def set_state(store, **values):
+    for name, value in values.items():
+        store.execute("INSERT OR REPLACE INTO snapshot_state (name, value) VALUES (?, ?)",
+                      (unicode(name), unicode(value)), noresult=True)
+
+def create_snapshot_schema(store, stream=sys.stderr):
+    """catalog tables and indexes at the latest version, without the change log"""
+    schema.create_sqlite_schema(store)
+    MigrationRunner(store, stream=stream).upgrade()
+    schema.drop_changelog_triggers(store)
+    store.execute("DROP TABLE IF EXISTS changelog", noresult=True)
+    store.execute(STATE_TABLE, noresult=True)
+    store.commit()
+
+def _columns(source, target, table):
+    """columns present in both databases, in the order of the snapshot"""
+    available = get_columns(source, table)
+    return [ row[1] for row in target.execute("PRAGMA table_info(%s)" % table) if row[1] in available ]
+
+def _chunks(ids, size=ID_CHUNK):
+    ids = sorted(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
+def _in(column, ids):
+    return "%s IN (%s)" % (column, ", ".join("?" for i in ids))
+
+def copy_new_rows(source, target, table, key, columns, last_id, chunk_size=10000, stream=sys.stderr):
+    """copy the rows with a key above last_id, by chunks of increasing keys.
+       Returns the number of copied rows and the new last key."""
+    total = source.execute("SELECT COUNT(*) FROM %s WHERE %s > ?" % (table, key), (last_id,)).get_one()[0]
+    if not total:
+        return 0, last_id
+    progress = Progress("copy %s" % table, total, stream=stream)
+    select = "SELECT %s FROM %s WHERE %s > ? ORDER BY %s LIMIT %d" % (", ".join(columns), table, key, key, chunk_size)
+    position = columns.index(key)
+    copied = 0
+    while True:
+        rows = source.execute(select, (last_id,)).get_all()
+        if not rows:
+            break
+        copied += schema.insert_rows(target, table, columns, rows, replace=True)
+        last_id = rows[-1][position]
+        progress.update(len(rows))
+    progress.finish()
+    return copied, last_id
+
+def copy_links(source, target, sample_ids=None):
+    """copy the sample-result links (all of them, or those of the given samples)"""
+    if sample_ids is None:
+        return schema.insert_rows(target, "sampleresult", ("sample_id", "result_id"),
+                                  source.execute("SELECT sample_id, result_id FROM sampleresult"), replace=True)
+    copied = 0
+    for ids in _chunks(sample_ids):
+        target.execute("DELETE FROM sampleresult WHERE %s" % _in("sample_id", ids), ids, noresult=True)
+        copied += schema.insert_rows(target, "sampleresult", ("sample_id", "result_id"),
+                                     source.execute("SELECT sample_id, result_id FROM sampleresult WHERE %s" % _in("sample_id", ids), ids))
+    return copied
+
+def replay_changes(source, target, first_change, last_change, columns):
+    """apply the updates and deletions logged between two changes.
+       The changed rows are copied again from the source, or removed if they are gone.
+       Returns the number of updated and deleted rows per table."""
+    changed = defaultdict(set)
+    for table, row_id in source.execute("SELECT tablename, row_id FROM changelog WHERE change_id > ? AND change_id <= ?",
+                                        (first_change, last_change)):
+        changed[table].add(row_id)
+    counts = {}
+    for table, key in KEYED_TABLES:
+        if not changed[table]:
+            continue
+        updated, deleted = 0, set()
+        for ids in _chunks(changed[table]):
+            rows = source.execute("SELECT %s FROM %s WHERE %s" % (", ".join(columns[table]), table, _in(key, ids)), ids).get_all()
+            target.execute("DELETE FROM %s WHERE %s" % (table, _in(key, ids)), ids, noresult=True)
+            updated += schema.insert_rows(target, table, columns[table], rows)
+            deleted.update(set(ids)-set(row[columns[table].index(key)] for row in rows))
+        if table == "sample" and deleted:
+            # the files of a sample are removed by a cascade, which does not fire the triggers
+            for ids in _chunks(deleted):
+                target.execute("DELETE FROM file WHERE %s" % _in("sample_id", ids), ids, noresult=True)
+                target.execute("DELETE FROM sampleresult WHERE %s" % _in("sample_id", ids), ids, noresult=True)
+        counts[table] = { "updated" : updated, "deleted" : len(deleted) }
+    if changed["sampleresult"]:
+        counts["sampleresult"] = { "updated" : copy_links(source, target, changed["sampleresult"]) }
+    return counts
+
+def sync_snapshot(source, target, chunk_size=10000, stream=sys.stderr):
+    """bring a snapshot (target store) up to date with the source database.
+       Returns the number of copied, updated and deleted rows per table."""
+    state = get_state(target)
+    version = MigrationRunner(source).current_version()
+    if "schema_version" in state and state["schema_version"] != unicode(version):
+        raise ValueError("The snapshot was taken from schema v%s, the database is now at v%s: rebuild it" % (state["schema_version"], version))
+    with_log = has_table(source, "changelog")
+    if not with_log:
+        stream.write("No change log in the database (schema before v8), only new rows are copied\n")
+    # position in the change log first: the changes done while copying are replayed at the next synchronization
+    last_change = (source.execute("SELECT MAX(change_id) FROM changelog").get_one()[0] or 0) if with_log else 0
+    columns = dict((table, _columns(source, target, table)) for table, key in KEYED_TABLES)
+    start = time.time()
+    counts = {}
+    for table, key in KEYED_TABLES:
+        last_id = int(state.get("last_id:%s" % table, 0))
+        copied, last_id = copy_new_rows(source, target, table, key, columns[table], last_id, chunk_size, stream)
+        counts[table] = { "copied" : copied }
+        set_state(target, **{ "last_id:%s" % table : last_id })
+        target.commit()
+    if "last_change_id" not in state:
+        counts["sampleresult"] = { "copied" : copy_links(source, target) }
+    elif with_log:
+        for table, changes in replay_changes(source, target, int(state["last_change_id"]), last_change, columns).items():
+            counts.setdefault(table, {}).update(changes)
+    set_state(target, last_change_id=last_change, schema_version=version,
+              synced_on=datetime.now().replace(microsecond=0).isoformat(), sync_time_s="%.1f" % (time.time()-start))
+    target.commit()
+    return counts
+
+def update_snapshot(source, path, full=False, chunk_size=10000, stream=sys.stderr):
+    """create or synchronize the snapshot at path.
+       The snapshot is rebuilt from scratch if full is set or if the schema of the database changed."""
+    path = os.path.abspath(os.path.expanduser(path))
+    work = path+".sync"
+    if os.path.exists(work):
+        os.remove(work)
+    rebuild = full or not os.path.exists(path)
+    if not rebuild:
+        previous = open_snapshot(path)
+        state = get_state(previous)
+        previous.close()
+        version = MigrationRunner(source).current_version()
+        if state.get("schema_version") != unicode(version):
+            stream.write("The database schema changed (v%s to v%s), rebuilding the snapshot\n" % (state.get("schema_version"), version))
+            rebuild = True
+    if not rebuild:
+        shutil.copy2(path, work)
+    target = Store(create_database("sqlite:%s" % work))
+    try:
+        if rebuild:
+            create_snapshot_schema(target, stream=stream)
+            set_state(target, created_on=datetime.now().replace(microsecond=0).isoformat())
+        counts = sync_snapshot(source, target, chunk_size=chunk_size, stream=stream)
+        target.close()
+    except:
+        target.close()
+        os.remove(work)
+        raise
+    os.rename(work, path)
+    return counts
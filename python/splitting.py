@@ -0,0 +1,136 @@
+"""Splitting of the files of samples into balanced jobs.
+   The files are streamed from the database in chunks of ids, and assigned to the least loaded
+   job (in number of events), the largest files of each chunk first. Only the file ids are kept
+   in memory during the planning, a few bytes per file; the job manifests are then written job by job,
+   so that samples with millions of files can be split with a bounded amount of memory.
+
+   Example:
+     jobs = plan_jobs(dbstore, resolve_samples(dbstore, [u"TT_*_PAT_v1"]), events_per_job=500000)
+     write_json(dbstore, jobs, "jobs.json")"""
+
+import os
+import json
+import math
+import heapq
+from array import array
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+def _chunks(values, size=ID_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i+size]
+
+def resolve_samples(store, samples):
+    """sample ids from a list of sample names, ids or name patterns (with * and ?)"""
+    ids = []
+    for sample in samples:
+        if isinstance(sample, (int, long)) or (isinstance(sample, basestring) and sample.isdigit()):
+            rows = store.execute("SELECT sample_id FROM sample WHERE sample_id = ?", (int(sample),)).get_all()
+        elif '*' in sample or '?' in sample:
+            rows = store.execute("SELECT sample_id FROM sample WHERE name LIKE ? ORDER BY sample_id",
+                                 (unicode(sample.replace('*', '%').replace('?', '_')),)).get_all()
+        else:
+            rows = store.execute("SELECT sample_id FROM sample WHERE name = ?", (unicode(sample),)).get_all()
+        if not rows:
+            raise KeyError("No sample matching %s" % sample)
+        ids += [ row[0] for row in rows if row[0] not in ids ]
+    return ids
+
+def iter_file_chunks(store, sample_ids, columns="id, nevents", chunk_size=10000):
+    """rows of the files of the samples, by chunks of increasing ids (the id must be the first column)"""
+    for samples in _chunks(sample_ids):
+        last_id = 0
+        while True:
+            rows = store.execute("SELECT %s FROM file WHERE %s AND id > ? ORDER BY id LIMIT %d" % (columns, _in("sample_id", samples), chunk_size),
+                                 samples+[last_id]).get_all()
+            if not rows:
+                break
+            yield rows
+            last_id = rows[-1][0]
+
+class Job(object):
+    """One job: its files (ids) and number of events"""
+
+    def __init__(self, index, sample_id=None):
+        self.index = index
+        self.sample_id = sample_id
+        self.nevents = 0
+        self.file_ids = array('l')
+
+    def __len__(self):
+        return len(self.file_ids)
+
+def _plan(store, sample_ids, njobs, events_per_job, first_index, chunk_size):
+    total_files, total_events = 0, 0
+    for samples in _chunks(sample_ids):
+        files, events = store.execute("SELECT COUNT(*), SUM(nevents) FROM file WHERE %s" % _in("sample_id", samples), samples).get_one()
+        total_files += files
+        total_events += events or 0
+    if not total_files:
+        return []
+    if events_per_job is not None:
+        njobs = max(1, int(math.ceil(float(total_events)/events_per_job)))
+    jobs = [ Job(first_index+i, sample_ids[0] if len(sample_ids) == 1 else None) for i in range(min(njobs, total_files)) ]
+    loads = [ (0, i) for i in range(len(jobs)) ]
+    for rows in iter_file_chunks(store, sample_ids, chunk_size=chunk_size):
+        # largest files first within each chunk, each one in the least loaded job
+        for file_id, nevents in sorted(rows, key=lambda row: -(row[1] or 0)):
+            load, i = heapq.heappop(loads)
+            jobs[i].file_ids.append(file_id)
+            jobs[i].nevents += nevents or 0
+            heapq.heappush(loads, (load+(nevents or 0), i))
+    return jobs
+
+def plan_jobs(store, sample_ids, njobs=None, events_per_job=None, per_sample=False, chunk_size=10000):
+    """split the files of the samples into njobs jobs, or into jobs of about events_per_job events.
+       With per_sample, each sample is split separately (and njobs is the number of jobs per sample).
+       Files without a number of events count as empty."""
+    if (njobs is None) == (events_per_job is None):
+        raise ValueError("Either the number of jobs or the number of events per job must be given")
+    if per_sample:
+        jobs = []
+        for sample_id in sample_ids:
+            jobs += _plan(store, [sample_id], njobs, events_per_job, len(jobs), chunk_size)
+        return jobs
+    return _plan(store, list(sample_ids), njobs, events_per_job, 0, chunk_size)
+
+def iter_job_files(store, job):
+    """(pfn, lfn, nevents, event_weight_sum, sample name) of the files of a job, by increasing id"""
+    for ids in _chunks(sorted(job.file_ids)):
+        for row in store.execute("SELECT file.pfn, file.lfn, file.nevents, file.event_weight_sum, sample.name FROM file "
+                                 "JOIN sample ON sample.sample_id = file.sample_id WHERE %s ORDER BY file.id" % _in("file.id", ids), ids):
+            yield row
+
+def write_json(store, jobs, path):
+    """one JSON manifest for all jobs, written job by job"""
+    with open(path, "w") as output:
+        output.write('{"jobs": [')
+        for i, job in enumerate(jobs):
+            files = [ { "pfn" : pfn, "lfn" : lfn, "nevents" : nevents, "event_weight_sum" : weight_sum, "sample" : sample }
+                      for pfn, lfn, nevents, weight_sum, sample in iter_job_files(store, job) ]
+            entry = { "job" : job.index, "nevents" : job.nevents, "files" : files,
+                      "event_weight_sum" : sum(f["event_weight_sum"] or 0. for f in files) }
+            output.write("%s\n%s" % ("," if i else "", json.dumps(entry)))
+        output.write("\n]}\n")
+
+def write_text(store, jobs, directory):
+    """one text file per job (job_0000.txt, ...) with the pfn of its files, one per line"""
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    width = max(4, len(str(len(jobs))))
+    for job in jobs:
+        with open(os.path.join(directory, "job_%0*d.txt" % (width, job.index)), "w") as output:
+            for pfn, lfn, nevents, weight_sum, sample in iter_job_files(store, job):
+                output.write((u"%s\n" % pfn).encode("utf-8"))
+
+def balance(jobs):
+    """(smallest, largest, mean) number of events per job"""
+    events = [ job.nevents for job in jobs ]
+    if not events:
+        return 0, 0, 0.
+    return min(events), max(events), sum(events)/float(len(events))
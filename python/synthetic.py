@@ -0,0 +1,209 @@
+"""Synthetic catalog generator, to fill a SQLite or MySQL database
+   with realistic content for benchmarks and tests at production scale"""
+
+import sys
+import json
+import math
+import random
+from datetime import datetime, timedelta
+from . import schema
+from .migrations import MigrationRunner
+
+AUTHORS = [ u"user%02d" % i for i in range(30) ]
+PROCESSES = [ u"TTTo2L2Nu", u"DYJetsToLL_M-50", u"WJetsToLNu", u"ST_tW_top", u"ST_tW_antitop", u"WWTo2L2Nu",
+              u"WZTo2L2Q", u"ZZTo2L2Nu", u"GluGluToHHTo2B2VTo2L2Nu_node_SM", u"TTWJetsToLNu", u"TTZToLLNuNu",
+              u"GluGluHToBB", u"VBFHToBB", u"ZH_HToBB_ZToLL", u"QCD_Pt-20toInf_MuEnrichedPt15" ]
+PRIMARY_DATASETS = [ u"DoubleMuon", u"DoubleEG", u"MuonEG", u"SingleMuon", u"SingleElectron" ]
+ERAS = [ (7., u"Summer11", u"CMSSW_4_2_8"), (8., u"Summer12", u"CMSSW_5_3_32"),
+         (13., u"RunIISummer16", u"CMSSW_8_0_26"), (13., u"RunIIFall17", u"CMSSW_9_4_7") ]
+DERIVED_TYPES = { u"PAT" : u"SKIM", u"SKIM" : u"NTUPLES", u"NTUPLES" : u"HISTOS", u"HISTOS" : u"HISTOS" }
+
+def _lognormal_int(rnd, median, sigma, lower=1):
+    return max(lower, int(rnd.lognormvariate(math.log(median), sigma)))
+
+def lumi_mask(rnd, first_run, nruns):
+    """a processed lumi sections mask, in the CMS JSON format {run : [[first, last], ...]}"""
+    mask = {}
+    run = first_run
+    for i in range(nruns):
+        run += rnd.randint(1, 20)
+        ranges = []
+        ls = 1
+        for j in range(rnd.randint(1, 4)):
+            first = ls + rnd.randint(0, 30)
+            last = first + rnd.randint(5, 400)
+            ranges.append([first, last])
+            ls = last + 1
+        mask[str(run)] = ranges
+    return mask
+
+def weight_sums(rnd, nweights, central):
+    """extra event weight sums (scale, PDF variations...), as stored in extras_event_weight_sum"""
+    return dict(("weight_%02d" % i, central*rnd.uniform(0.8, 1.2)) for i in range(nweights))
+
+def split_files(rnd, nfiles, nsamples):
+    """number of files of each sample: a few large samples, many small ones"""
+    weights = [ rnd.lognormvariate(0., 1.5) for i in range(nsamples) ]
+    total = sum(weights)
+    counts = [ int(nfiles*w/total) for w in weights ]
+    for i in range(nfiles-sum(counts)):
+        counts[rnd.randrange(nsamples)] += 1
+    return counts
+
+class CatalogGenerator(object):
+    """Generates the content of the catalog tables.
+       All entries are derived from the seed, so that two databases generated with
+       the same parameters are identical. Ids follow the ones already in the database."""
+
+    def __init__(self, ndatasets=1000, nsamples=10000, nfiles=1000000, nresults=2000, nanalyses=50,
+                 derived_fraction=0.6, data_fraction=0.2, nweights=20, seed=1234, stream=sys.stderr):
+        self.ndatasets = ndatasets
+        self.nsamples = nsamples
+        self.nfiles = nfiles
+        self.nresults = nresults
+        self.nanalyses = nanalyses
+        self.derived_fraction = derived_fraction
+        self.data_fraction = data_fraction
+        self.nweights = nweights
+        self.seed = seed
+        self.stream = stream
+        self.start_time = datetime(2012, 1, 1)
+
+    def log(self, message):
+        if self.stream is not None:
+            self.stream.write(message+"\n")
+            self.stream.flush()
+
+    def generate(self, store):
+        """fill the database, returns the number of inserted rows per table"""
+        rnd = random.Random(self.seed)
+        offsets = dict((table, store.execute("SELECT COALESCE(MAX(%s), 0) FROM %s" % (key, table)).get_one()[0])
+                       for table, key in (("analysis", "analysis_id"), ("dataset", "dataset_id"), ("sample", "sample_id"), ("result", "result_id")))
+        counts = {}
+        counts["analysis"] = schema.insert_rows(store, "analysis", ("analysis_id", "description", "cadiline", "contact"),
+                                                self.analyses(rnd, offsets["analysis"]))
+        self.log("%d analyses" % counts["analysis"])
+        datasets = list(self.datasets(rnd, offsets["dataset"]))
+        counts["dataset"] = schema.insert_rows(store, "dataset", ("dataset_id", "name", "datatype", "process", "nevents", "dsize",
+                                               "xsection", "cmssw_release", "globaltag", "energy", "creation_time", "user_comment"), datasets)
+        self.log("%d datasets" % counts["dataset"])
+        file_counts = split_files(rnd, self.nfiles, self.nsamples) if self.nsamples else []
+        samples = list(self.samples(rnd, datasets, offsets["sample"], file_counts))
+        counts["sample"] = schema.insert_rows(store, "sample", ("sample_id", "name", "path", "sampletype", "nevents_processed", "nevents",
+                                              "normalization", "event_weight_sum", "extras_event_weight_sum", "luminosity", "processed_lumi",
+                                              "code_version", "user_comment", "author", "creation_time", "source_dataset_id", "source_sample_id"), samples)
+        self.log("%d samples" % counts["sample"])
+        store.commit()
+        counts["file"] = 0
+        next_log = 100000
+        for sample, nfiles in zip(samples, file_counts):
+            counts["file"] += schema.insert_rows(store, "file", ("sample_id", "lfn", "pfn", "event_weight_sum", "extras_event_weight_sum", "nevents"),
+                                                 self.files(sample, nfiles, blobs=True))
+            if counts["file"] >= next_log:
+                store.commit()
+                self.log("%d files" % counts["file"])
+                next_log += 100000
+        store.commit()
+        self.log("%d files" % counts["file"])
+        results = list(self.results(rnd, offsets["result"], offsets["analysis"]))
+        counts["result"] = schema.insert_rows(store, "result", ("result_id", "path", "description", "author", "creation_time", "analysis_id", "elog"), results)
+        links = set()
+        for result in results:
+            for i in range(_lognormal_int(rnd, 3, 0.8)):
+                links.add((offsets["sample"]+rnd.randint(1, self.nsamples), result[0]))
+        counts["sampleresult"] = schema.insert_rows(store, "sampleresult", ("sample_id", "result_id"), sorted(links))
+        self.log("%d results, %d sample-result links" % (counts["result"], counts["sampleresult"]))
+        store.commit()
+        return counts
+
+    def analyses(self, rnd, offset):
+        for i in range(1, self.nanalyses+1):
+            yield (offset+i, u"Analysis %d: search for %s" % (offset+i, rnd.choice(PROCESSES)),
+                   u"HIG-%02d-%03d" % (rnd.randint(12, 19), rnd.randint(1, 50)), rnd.choice(AUTHORS))
+
+    def datasets(self, rnd, offset):
+        for i in range(1, self.ndatasets+1):
+            energy, campaign, release = rnd.choice(ERAS)
+            created = self.start_time + timedelta(hours=6*i, minutes=rnd.randint(0, 300))
+            nevents = _lognormal_int(rnd, 2*10**6, 1.2, lower=1000)
+            if rnd.random() < self.data_fraction:
+                process = rnd.choice(PRIMARY_DATASETS)
+                name = u"/%s/Run%d%s-%s-v%d/MINIAOD" % (process, 2011+int(energy)//4, u"ABCDEFGH"[i % 8], campaign, offset+i)
+                datatype, xsection = u"data", None
+            else:
+                process = rnd.choice(PROCESSES)
+                name = u"/%s_%dTeV-madgraph/%s-v%d/MINIAODSIM" % (process, energy, campaign, offset+i)
+                datatype, xsection = u"mc", rnd.choice([1., rnd.lognormvariate(2., 2.)])
+            yield (offset+i, name, datatype, process, nevents, nevents*rnd.randint(20000, 60000), xsection, release,
+                   u"%s_V%d" % (campaign, rnd.randint(1, 9)), energy, created, u"")
+
+    def samples(self, rnd, datasets, offset, file_counts):
+        """samples derive either from a dataset, or from an earlier sample (derivation chains)"""
+        created = {}
+        for i in range(1, self.nsamples+1):
+            sample_id = offset+i
+            nfiles = file_counts[i-1]
+            nevents, weight_sum = self.file_sums(sample_id, nfiles)
+            author = rnd.choice(AUTHORS)
+            if i > 1 and rnd.random() < self.derived_fraction:
+                parent = created[offset+rnd.randint(max(1, i-500), i-1)]
+                dataset = datasets[parent[15]-datasets[0][0]] if parent[15] is not None else None
+                sampletype = DERIVED_TYPES[parent[3]]
+                source_sample_id = parent[0]
+                nevents_processed = parent[5] if parent[5] else parent[4]
+            else:
+                dataset = rnd.choice(datasets) if datasets else None
+                sampletype = u"PAT"
+                source_sample_id = None
+                nevents_processed = dataset[4] if dataset else nevents
+            if dataset is not None and dataset[2] == u"data":
+                mask = lumi_mask(random.Random(self.seed+7*sample_id), 190000+(dataset[0] % 50)*1000, rnd.randint(5, 60))
+                processed_lumi, luminosity, extras = unicode(json.dumps(mask)), rnd.uniform(100., 40000.), None
+            else:
+                processed_lumi, luminosity = None, None
+                extras = unicode(json.dumps(weight_sums(rnd, self.nweights, weight_sum))) if self.nweights else None
+            name = u"%s_%s_v%d" % (dataset[3] if dataset else u"Private", sampletype, sample_id)
+            row = (sample_id, name, u"/storage/data/cms/store/user/%s/%s" % (author, name), sampletype, nevents_processed, nevents,
+                   1., weight_sum, extras, luminosity, processed_lumi, u"v%d.%d.%d" % (rnd.randint(1, 5), rnd.randint(0, 9), rnd.randint(0, 20)),
+                   u"", author, self.start_time + timedelta(hours=2*i, minutes=rnd.randint(0, 100)),
+                   dataset[0] if dataset else None, source_sample_id)
+            created[sample_id] = row
+            yield row
+
+    def file_sums(self, sample_id, nfiles):
+        """total number of events and weight sum of the files of a sample"""
+        nevents, weight_sum = 0, 0.
+        for f in self.files((sample_id, None, u"/"), nfiles, blobs=False):
+            nevents += f[5]
+            weight_sum += f[3]
+        return nevents, weight_sum
+
+    def files(self, sample, nfiles, blobs=True):
+        """files of a sample: the number of entries varies by two orders of magnitude"""
+        rnd = random.Random(self.seed*100003+sample[0])
+        blob_rnd = random.Random(self.seed*100019+sample[0])
+        typical = _lognormal_int(rnd, 20000, 0.7, lower=100)
+        lfn_base = u"/store/user/%s" % sample[2].split(u"/store/user/")[-1]
+        for i in range(nfiles):
+            nevents = _lognormal_int(rnd, typical, 1.0, lower=1)
+            weight_sum = nevents*rnd.uniform(0.5, 1.5)
+            lfn = u"%s/%04d/output_%d.root" % (lfn_base, i//1000, i+1)
+            extras = unicode(json.dumps(weight_sums(blob_rnd, self.nweights, weight_sum))) if blobs and self.nweights else None
+            yield (sample[0], lfn, u"/storage/data/cms" + lfn, weight_sum, extras, nevents)
+
+    def results(self, rnd, offset, analysis_offset):
+        for i in range(1, self.nresults+1):
+            author = rnd.choice(AUTHORS)
+            analysis_id = analysis_offset+rnd.randint(1, self.nanalyses) if self.nanalyses and rnd.random() < 0.8 else None
+            yield (offset+i, u"/home/users/%s/results/result_%d" % (author, offset+i), u"Limits and plots, iteration %d" % i, author,
+                   self.start_time + timedelta(hours=10*i, minutes=rnd.randint(0, 500)), analysis_id,
+                   u"https://cp3-llbb.example/elog/%d" % (offset+i) if rnd.random() < 0.3 else None)
+
+def create_synthetic_catalog(store, upgrade=True, **kwargs):
+    """create the tables of an empty SQLite database and fill them with synthetic content.
+       Unless upgrade is False, the schema is then migrated to the latest version."""
+    schema.create_sqlite_schema(store)
+    counts = CatalogGenerator(**kwargs).generate(store)
+    if upgrade:
+        MigrationRunner(store, stream=kwargs.get("stream", sys.stderr)).upgrade()
+    return counts
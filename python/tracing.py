@@ -0,0 +1,194 @@
+"""Opt-in tracing of the SQL statements issued through Storm.
+   Each statement is recorded with its normalized SQL, latency, row count and the
+   Python call site, and aggregated in a summary that flags the statements repeated
+   with identical parameters and the call sites issuing the same query in a loop (N+1).
+   Tracing is enabled with the SAMADHI_TRACE environment variable ("stderr", or
+   "json:/path/to/trace.json"), or with the trace argument of DbStore.
+   Scripts can also time their phases with the phase() context manager."""
+
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import defaultdict
+from storm.tracer import install_tracer, remove_tracer
+from storm.expr import Variable
+
+_STORM_DIR = os.path.dirname(os.path.abspath(install_tracer.__code__.co_filename))
+_THIS_FILE = os.path.splitext(os.path.abspath(__file__))[0]
+
+_literals = [ (re.compile(r"'(?:[^']|'')*'"), "?"),
+              (re.compile(r"\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b"), "?"),
+              (re.compile(r"\s+"), " "),
+              (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?, ...)"),
+              (re.compile(r"%s"), "?") ]
+
+def normalize_sql(statement):
+    """replace literals and lists of parameters by placeholders, to group identical queries"""
+    for pattern, replacement in _literals:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+def call_site():
+    """first frame outside of Storm and of this module, as file:line (function)"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not filename.startswith(_STORM_DIR) and os.path.splitext(filename)[0] != _THIS_FILE:
+            return "%s:%d (%s)" % (filename, frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+def _raw_params(params):
+    values = []
+    for param in params or ():
+        if isinstance(param, Variable):
+            param = param.get()
+        values.append(param if isinstance(param, (int, long, float, type(None))) else repr(param))
+    return tuple(values)
+
+class QueryTracer(object):
+    """Storm tracer recording every executed statement"""
+
+    def __init__(self, repeat_threshold=10):
+        self.repeat_threshold = repeat_threshold
+        self.statements = []
+        self.phases = []
+        self._pending = threading.local()
+        self._lock = threading.Lock()
+        self.start = time.time()
+
+    def connection_raw_execute(self, connection, raw_cursor, statement, params):
+        self._pending.start = time.time()
+        self._pending.site = call_site()
+
+    def _record(self, raw_cursor, statement, params, error=None):
+        latency = time.time()-getattr(self._pending, "start", time.time())
+        rowcount = getattr(raw_cursor, "rowcount", -1)
+        entry = { "sql" : normalize_sql(statement),
+                  "params" : _raw_params(params),
+                  "latency_ms" : 1000.*latency,
+                  "rows" : rowcount if rowcount is not None and rowcount >= 0 else None,
+                  "site" : getattr(self._pending, "site", "unknown") }
+        if error is not None:
+            entry["error"] = str(error)
+        with self._lock:
+            self.statements.append(entry)
+
+    def connection_raw_execute_success(self, connection, raw_cursor, statement, params):
+        self._record(raw_cursor, statement, params)
+
+    def connection_raw_execute_error(self, connection, raw_cursor, statement, params, error):
+        self._record(raw_cursor, statement, params, error)
+
+    def count(self):
+        return len(self.statements)
+
+    def summary(self):
+        """aggregate the statements per normalized SQL and per call site"""
+        queries = defaultdict(lambda: { "count" : 0, "total_ms" : 0., "max_ms" : 0., "rows" : 0, "sites" : set() })
+        identical = defaultdict(int)
+        per_site = defaultdict(int)
+        for entry in self.statements:
+            query = queries[entry["sql"]]
+            query["count"] += 1
+            query["total_ms"] += entry["latency_ms"]
+            query["max_ms"] = max(query["max_ms"], entry["latency_ms"])
+            query["rows"] += entry["rows"] or 0
+            query["sites"].add(entry["site"])
+            identical[(entry["sql"], entry["params"])] += 1
+            per_site[(entry["sql"], entry["site"])] += 1
+        result = { "statements" : len(self.statements),
+                   "total_ms" : sum(entry["latency_ms"] for entry in self.statements),
+                   "wall_s" : time.time()-self.start,
+                   "phases" : self.phases,
+                   "queries" : sorted(({ "sql" : sql, "count" : q["count"], "total_ms" : q["total_ms"], "max_ms" : q["max_ms"],
+                                         "rows" : q["rows"], "sites" : sorted(q["sites"]) } for sql, q in queries.items()),
+                                      key=lambda q: -q["total_ms"]),
+                   "repeated_identical" : sorted(({ "sql" : sql, "params" : list(params), "count" : n }
+                                                  for (sql, params), n in identical.items() if n > 1), key=lambda r: -r["count"]),
+                   "loops" : sorted(({ "sql" : sql, "site" : site, "count" : n }
+                                     for (sql, site), n in per_site.items() if n >= self.repeat_threshold), key=lambda r: -r["count"]) }
+        return result
+
+    def report(self, stream=sys.stderr, top=15):
+        """human-readable summary"""
+        summary = self.summary()
+        stream.write("SQL trace: %d statements, %.1f ms in the database, %.2f s wall time\n" %
+                     (summary["statements"], summary["total_ms"], summary["wall_s"]))
+        if summary["phases"]:
+            stream.write("Phases:\n")
+            for phase in summary["phases"]:
+                stream.write("  %-40s %9.3f s %8d statements\n" % (phase["name"], phase["wall_s"], phase["statements"]))
+        stream.write("Most expensive queries:\n")
+        for query in summary["queries"][:top]:
+            stream.write("  %6d x %10.1f ms  %s\n" % (query["count"], query["total_ms"], query["sql"][:150]))
+        if summary["repeated_identical"]:
+            stream.write("Statements repeated with identical parameters:\n")
+            for query in summary["repeated_identical"][:top]:
+                stream.write("  %6d x  %s %r\n" % (query["count"], query["sql"][:120], tuple(query["params"])))
+        if summary["loops"]:
+            stream.write("Queries issued in a loop (possible N+1):\n")
+            for query in summary["loops"][:top]:
+                stream.write("  %6d x  %s\n           from %s\n" % (query["count"], query["sql"][:120], query["site"]))
+        stream.flush()
+
+    def write_json(self, path, with_statements=False):
+        summary = self.summary()
+        if with_statements:
+            summary["trace"] = self.statements
+        with open(path, "w") as outfile:
+            json.dump(summary, outfile, indent=2)
+
+_tracer = None
+
+def enable(output="stderr"):
+    """install the tracer (once), and write its summary at exit to stderr or to json:path"""
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+    _tracer = QueryTracer()
+    install_tracer(_tracer)
+    if output.startswith("json:"):
+        atexit.register(_tracer.write_json, output[len("json:"):])
+    else:
+        atexit.register(_tracer.report)
+    return _tracer
+
+def disable():
+    global _tracer
+    if _tracer is not None:
+        remove_tracer(_tracer)
+        _tracer = None
+
+def get_tracer():
+    return _tracer
+
+def enable_from_environment():
+    output = os.environ.get("SAMADHI_TRACE")
+    if output:
+        enable(output)
+
+class phase(object):
+    """Time a phase of a script, e.g.
+         with phase("check samples"):
+           ...
+       The wall time and number of statements go to the trace summary, if tracing is enabled."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        self.statements = _tracer.count() if _tracer is not None else 0
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_s = time.time()-self.start
+        if _tracer is not None:
+            _tracer.phases.append({ "name" : self.name, "wall_s" : self.wall_s,
+                                    "statements" : _tracer.count()-self.statements })
+        return False
@@ -1,4 +1,5 @@
 from cp3_llbb.SAMADhi.SAMADhi import Sample, Dataset
+from cp3_llbb.SAMADhi.namesearch import name_index
 
 def confirm(prompt=None, resp=False):
     """prompts for yes or no response from the user. Returns True for yes and
@@ -36,72 +37,57 @@ def parse_samples(inputString):
   """parse a comma-separated list of samples"""
   return [ int(x) for x in inputString.split(',') ]
 
+# number of matches shown at once
+PAGE_SIZE = 20
+
+def search_prompt(index, kind, question, query=None, parse=int, valid=None):
+  """incremental search of an id: the words typed are searched in the names (see namesearch.py),
+     and the best matches are shown one page at a time. Returns the answer given to question,
+     converted by parse, or None if empty. An answer that parse cannot convert, or that does not
+     pass valid (e.g. a number that is not an existing id), is searched in the names."""
+  print "Type words of the %s name to search for it, n or p for the next or previous matches, or the id."%kind
+  matches = index.search(query) if query else []
+  page = 0
+  while True:
+    if matches:
+      print "%s\t\tName"%kind.capitalize()
+      for key, name in matches[page*PAGE_SIZE:(page+1)*PAGE_SIZE]:
+        print "%i\t\t%s"%(key, name)
+      print "(matches %d to %d of %d)"%(page*PAGE_SIZE+1, min((page+1)*PAGE_SIZE, len(matches)), len(matches))
+    ans = raw_input(question).strip()
+    if not ans:
+      return None
+    if ans in ('n', 'p'):
+      page = min(max(page+(1 if ans == 'n' else -1), 0), max((len(matches)-1)//PAGE_SIZE, 0))
+      continue
+    try:
+      value = parse(ans)
+    except ValueError:
+      value = None
+    if value is not None and (valid is None or valid(value)):
+      return value
+    # not an existing id: the answer is searched in the names (e.g. a year or a run number)
+    matches = index.search(ans)
+    page = 0
+    if not matches: print "No %s with this id or matching %s."%(kind, ans)
+
 def prompt_samples(store):
   """prompts for the source sample among the existing ones"""
   print "No source sample defined."
   print "Please select the samples associated with this result."
-  # full list of samples
-  print "Sample\t\tName"
-  check = store.find(Sample)
-  all_samples = check.values(Sample.sample_id,Sample.name)
-  for dset in all_samples:
-    print "%i\t\t%s"%(dset[0], dset[1])
-  # prompt
-  while True:
-    try:
-      return parse_samples(raw_input("Comma-separated list of sample id [None]?"))
-    except:
-      continue
+  index = name_index(store, Sample)
+  return search_prompt(index, "sample", "Comma-separated list of sample id [None]?", parse=parse_samples,
+                       valid=lambda ids: all(i in index for i in ids)) or []
 
 def prompt_sample(sample,store):
   """prompts for the source sample among the existing ones"""
   print "Please select the sample associated with this sample."
-  # full list of samples
-  print "Sample\t\tName"
-  check = store.find(Sample)
-  all_samples = check.values(Sample.sample_id,Sample.name)
-  for dset in all_samples:
-    print "%i\t\t%s"%(dset[0], dset[1])
-  # prompt
-  while True:
-    try:
-      ans = int(raw_input("Sample id [None]?"))
-    except:
-      sample.source_sample_id = None
-      return
-    check = store.find(Sample,Sample.sample_id==ans)
-    if check.is_empty(): continue
-    else:
-      sample.source_sample_id = ans
-      return
+  index = name_index(store, Sample)
+  sample.source_sample_id = search_prompt(index, "sample", "Sample id [None]?", valid=lambda i: i in index)
 
 def prompt_dataset(sample,store):
   """prompts for the source dataset among the existing ones"""
   print "Please select the dataset associated with this sample."
-  # full list of datasets
-  print "Dataset\t\tName"
-  check = store.find(Dataset)
-  all_datasets = check.values(Dataset.dataset_id,Dataset.name)
-  for dset in all_datasets:
-    print "%i\t\t%s"%(dset[0], dset[1])
-  # datasets whose name contain the sample name
-  check = store.find(Dataset,Dataset.name.contains_string(sample.name))
-  if not check.is_empty():
-    print "Suggestions:"
-    print "Dataset\t\tName"
-    suggested_datasets = check.values(Dataset.dataset_id,Dataset.name)
-    for dset in suggested_datasets:
-      print "%i\t\t%s"%(dset[0], dset[1])
-  # prompt
-  while True:
-    try:
-      ans = int(raw_input("Dataset id [None]?"))
-    except:
-      sample.source_dataset_id = None
-      return
-    check = store.find(Dataset,Dataset.dataset_id==ans)
-    if check.is_empty(): continue
-    else:
-      sample.source_dataset_id = ans
-      return
-
+  # the datasets whose name resembles the sample name are suggested
+  index = name_index(store, Dataset)
+  sample.source_dataset_id = search_prompt(index, "dataset", "Dataset id [None]?", query=sample.name, valid=lambda i: i in index)
@@ -0,0 +1,206 @@
+"""Validation of the registered File entries.
+   The file rows are streamed from the database in chunks of ids, and each chunk is checked
+   in parallel: the file must exist and not be empty and, optionally, open with ROOT and
+   have as many entries in its tree as recorded in File.nevents.
+   After each chunk, the problems found are appended to a JSON-lines file and the last checked
+   id is saved in a checkpoint, so that an interrupted validation resumes where it stopped.
+   The checkpoint records the selection (samples, opening the files): a run with another
+   selection, or after a completed run, starts again from the first file.
+   The summary (counts per status, problems per sample) is meant for the dbAnalysis reports."""
+
+import os
+import sys
+import json
+import time
+from collections import defaultdict
+
+OK = "ok"
+MISSING = "missing"
+EMPTY = "empty"
+UNREADABLE = "unreadable"
+NEVENTS_MISMATCH = "nevents mismatch"
+UNCHECKED = "unchecked"
+
+# maximal number of ids in an IN (...) list
+ID_CHUNK = 500
+
+def _in(column, values):
+    return "%s IN (%s)" % (column, ", ".join("?" for v in values))
+
+def _is_local(path):
+    return "://" not in path
+
+def check_file(entry, open_files=False):
+    """check one (id, sample_id, pfn, nevents) file entry.
+       Returns (id, status, size in bytes, entries in the file)"""
+    file_id, sample_id, pfn, nevents = entry
+    size, entries = None, None
+    if _is_local(pfn):
+        try:
+            size = os.stat(pfn).st_size
+        except OSError:
+            return (file_id, MISSING, None, None)
+        if size == 0:
+            return (file_id, EMPTY, 0, None)
+    elif not open_files:
+        return (file_id, UNCHECKED, None, None)
+    if open_files:
+        import ROOT
+        f = ROOT.TFile.Open(pfn)
+        if not f:
+            return (file_id, UNREADABLE, size, None)
+        if f.IsZombie() or f.TestBit(ROOT.TFile.kRecovered):
+            f.Close()
+            return (file_id, UNREADABLE, size, None)
+        tree = f.Get("t")
+        if tree:
+            entries = tree.GetEntries()
+        f.Close()
+        if nevents is not None and entries != nevents:
+            return (file_id, NEVENTS_MISMATCH, size, entries)
+    return (file_id, OK, size, entries)
+
+def _check_stat(entry):
+    return check_file(entry)
+
+def _check_open(entry):
+    return check_file(entry, open_files=True)
+
+class FileValidator(object):
+    """Checks the files of the catalog (or of some samples) in parallel, with a checkpoint.
+       Threads are enough to wait for the file system; files are opened in separate processes."""
+
+    def __init__(self, store, checkpoint, sample_ids=None, workers=16, open_files=False, chunk_size=1000, stream=sys.stderr):
+        self.store = store
+        self.checkpoint = checkpoint
+        self.problems = checkpoint+".problems"
+        self.sample_ids = None if sample_ids is None else sorted(sample_ids)
+        self.workers = workers
+        self.open_files = open_files
+        self.chunk_size = chunk_size
+        self.stream = stream
+
+    def new_state(self):
+        return { "last_id" : 0, "checked" : 0, "counts" : {}, "elapsed_s" : 0., "complete" : False,
+                 "sample_ids" : self.sample_ids, "open_files" : self.open_files }
+
+    def resumes(self, state):
+        """whether a run continues the one of the state: same selection, and not completed"""
+        return (not state.get("complete", False) and state.get("sample_ids") == self.sample_ids
+                and state.get("open_files", False) == self.open_files)
+
+    def load_state(self):
+        """state of the previous run, if any. Problems recorded after the checkpoint are dropped."""
+        if not os.path.exists(self.checkpoint):
+            return self.new_state()
+        with open(self.checkpoint) as infile:
+            state = json.load(infile)
+        if os.path.exists(self.problems):
+            with open(self.problems) as infile:
+                kept = [ line for line in infile if json.loads(line)["id"] <= state["last_id"] ]
+            with open(self.problems, "w") as outfile:
+                outfile.writelines(kept)
+        return state
+
+    def save_state(self, state):
+        with open(self.checkpoint+".tmp", "w") as outfile:
+            json.dump(state, outfile)
+        os.rename(self.checkpoint+".tmp", self.checkpoint)
+
+    def reset(self):
+        for path in (self.checkpoint, self.problems):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def iter_chunks(self, last_id):
+        """file entries above last_id, by chunks of increasing ids"""
+        selection = ""
+        if self.sample_ids is not None and len(self.sample_ids) <= ID_CHUNK:
+            selection = " AND " + _in("sample_id", self.sample_ids)
+        samples = None if self.sample_ids is None else set(self.sample_ids)
+        while True:
+            rows = self.store.execute("SELECT id, sample_id, pfn, nevents FROM file WHERE id > ?%s ORDER BY id LIMIT %d" % (selection, self.chunk_size),
+                                      [last_id]+(self.sample_ids if selection else [])).get_all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            if samples is not None and not selection:
+                rows = [ row for row in rows if row[1] in samples ]
+            yield last_id, rows
+            # the results of the previous chunk are committed, do not keep a transaction open on the server
+            self.store.rollback()
+
+    def _count(self):
+        if self.sample_ids is None:
+            return self.store.execute("SELECT COUNT(*) FROM file").get_one()[0]
+        total = 0
+        for i in range(0, len(self.sample_ids), ID_CHUNK):
+            chunk = self.sample_ids[i:i+ID_CHUNK]
+            total += self.store.execute("SELECT COUNT(*) FROM file WHERE %s" % _in("sample_id", chunk), chunk).get_one()[0]
+        return total
+
+    def run(self):
+        """check the files not checked yet, and return the state (counts per status)"""
+        from multiprocessing import Pool
+        from multiprocessing.pool import ThreadPool
+        state = self.load_state()
+        if not self.resumes(state):
+            if state["last_id"] > 0:
+                self.stream.write("The checkpoint %s is of a %s, starting from the first file\n" % (
+                                  self.checkpoint, "completed run" if state.get("complete", False) else "run with other samples or options"))
+            self.reset()
+            state = self.new_state()
+        total = self._count()
+        pool = (Pool if self.open_files else ThreadPool)(self.workers)
+        check = _check_open if self.open_files else _check_stat
+        start, last_report = time.time()-state["elapsed_s"], time.time()
+        try:
+            with open(self.problems, "a") as problems:
+                for last_id, rows in self.iter_chunks(state["last_id"]):
+                    samples = dict((row[0], (row[1], row[2], row[3])) for row in rows)
+                    for file_id, status, size, entries in pool.imap_unordered(check, rows, chunksize=max(1, len(rows)//(4*self.workers))):
+                        state["counts"][status] = state["counts"].get(status, 0)+1
+                        if status not in (OK, UNCHECKED):
+                            sample_id, pfn, nevents = samples[file_id]
+                            problems.write(json.dumps({ "id" : file_id, "sample_id" : sample_id, "pfn" : pfn, "status" : status,
+                                                        "size" : size, "nevents" : nevents, "entries" : entries })+"\n")
+                    problems.flush()
+                    state["last_id"] = last_id
+                    state["checked"] += len(rows)
+                    state["elapsed_s"] = time.time()-start
+                    self.save_state(state)
+                    if time.time()-last_report > 10.:
+                        last_report = time.time()
+                        rate = state["checked"]/max(state["elapsed_s"], 1e-6)
+                        self.stream.write("  %d/%d files checked (%.0f files/s, %.0f s left)\n" % (
+                                          state["checked"], total, rate, max(total-state["checked"], 0)/max(rate, 1e-6)))
+                        self.stream.flush()
+            # the next run starts again from the first file
+            state["complete"] = True
+            self.save_state(state)
+        finally:
+            pool.terminate()
+        return state
+
+    def summary(self, state=None, examples=5):
+        """counts per status, and the problems of each sample with a few examples"""
+        if state is None:
+            state = self.load_state()
+        per_sample = defaultdict(lambda: { "problems" : defaultdict(int), "examples" : [] })
+        if os.path.exists(self.problems):
+            with open(self.problems) as infile:
+                for line in infile:
+                    problem = json.loads(line)
+                    sample = per_sample[problem["sample_id"]]
+                    sample["problems"][problem["status"]] += 1
+                    if len(sample["examples"]) < examples:
+                        sample["examples"].append(problem)
+        names = {}
+        sample_ids = sorted(per_sample.keys())
+        for i in range(0, len(sample_ids), ID_CHUNK):
+            chunk = sample_ids[i:i+ID_CHUNK]
+            names.update(self.store.execute("SELECT sample_id, name FROM sample WHERE %s" % _in("sample_id", chunk), chunk))
+        return { "checked" : state["checked"], "counts" : state["counts"], "elapsed_s" : state["elapsed_s"],
+                 "opened" : self.open_files,
+                 "samples" : [ { "sample_id" : sample_id, "name" : names.get(sample_id), "problems" : dict(per_sample[sample_id]["problems"]),
+                                 "examples" : per_sample[sample_id]["examples"] } for sample_id in sample_ids ] }
@@ -2,13 +2,19 @@
 
 # Script to do basic checks to the database and output statistics on usage and issues
 
-import os,errno,json
+import os,errno,json,time
 import ROOT
 ROOT.gROOT.SetBatch()
 from optparse import OptionParser, OptionGroup
 from datetime import date
-from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, Result, MadWeight, DbStore
-from storm.info import get_cls_info
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, Result, SampleResult, DbStore
+from storm.expr import And, Not, Exists, Select
+from storm.info import ClassAlias
+from cp3_llbb.SAMADhi.tracing import phase
+from cp3_llbb.SAMADhi.duplicates import find_duplicates
+from cp3_llbb.SAMADhi.lumioverlap import result_overlaps
+from cp3_llbb.SAMADhi.reports import ReportWriter, iter_records
+from contextlib import contextmanager
 from datetime import datetime
 from collections import defaultdict
 from das_import import get_data
@@ -32,6 +38,15 @@ class MyOptionParser:
         self.parser.add_option("-d","--dry", action="store_true",
                                dest="dryRun", default=False,
              help="Dry run: do no write to disk")
+        self.parser.add_option("--files-report", action="store", type="string",
+                               dest="filesReport", default=None,
+             help="Include the report of validate_files.py in the samples report")
+        self.parser.add_option("-z","--gzip", action="store_true",
+                               dest="compress", default=False,
+             help="Write gzip-compressed reports (.json.gz)")
+        self.parser.add_option("-j","--workers", action="store", type="int",
+                               dest="workers", default=8,
+             help="Number of paths checked in parallel in each section")
         # ---- DAS options 
         das_group = OptionGroup(self.parser,"DAS options",
                                 "The following options control the communication with the DAS server")
@@ -82,46 +97,174 @@ def main():
     # prepare the output directory
     if not os.path.exists(opts.path) and not opts.dryRun:
       os.makedirs(opts.path)
-    # run each of the checks and collect data
+    # run each of the checks and write their results, section by section
 
     # collect general statistics
-    outputDict = collectGeneralStats(dbstore,opts)
-    if not opts.dryRun:
-      with open(opts.path+'/stats.json', 'w') as outfile:
-        json.dump(outputDict, outfile, default=encode_storm_object)
-	force_symlink(opts.path+'/stats.json',opts.basedir+'/data/stats.json')
+    with openReport(opts,'stats.json') as report, phase("general statistics"):
+      for key,value in collectGeneralStats(dbstore,opts).items():
+        report.write(key,value)
+
+    # the dataset, sample and result sections run concurrently, each with its own store,
+    # and the checks of a section share one scan of its table. ROOT is only used afterwards, here.
+    with phase("dataset, sample and result sections"):
+      datasets,samples,results = runSections(opts,[datasetSection,sampleSection,resultSection])
  
     # check datasets
-    outputDict = {}
-    outputDict["DatabaseInconsistencies"] = checkDatasets(dbstore,opts) if opts.DAScrosscheck else []
-    outputDict["Orphans"] = findOrphanDatasets(dbstore,opts)
-    outputDict["IncompleteData"] = checkDatasetsIntegrity(dbstore,opts)
-    outputDict["DatasetsStatistics"] = analyzeDatasetsStatistics(dbstore,opts)
-    if not opts.dryRun:
-      with open(opts.path+'/DatasetsAnalysisReport.json', 'w') as outfile:
-        json.dump(outputDict, outfile, default=encode_storm_object)
-	force_symlink(opts.path+'/DatasetsAnalysisReport.json',opts.basedir+'/data/DatasetsAnalysisReport.json')
+    with openReport(opts,'DatasetsAnalysisReport.json') as report:
+      report.write("DatabaseInconsistencies", printCheck("Datasets inconsistent with DAS",datasets["DatabaseInconsistencies"]))
+      report.write("Orphans", printCheck("Orphan Datasets",datasets["Orphans"]))
+      report.write("IncompleteData", printCheck("Datasets integrity issues",datasets["IncompleteData"]))
+      with phase("dataset statistics") as stage:
+        report.write("DatasetsStatistics", analyzeDatasetsStatistics(datasets["statistics"],opts))
+      datasets["timings"]["statistics"] = stage.wall_s
+      report.write("Timings", datasets["timings"])
 
     # check samples
-    outputDict = {}
-    outputDict["MissingDirSamples"] = checkSamplePath(dbstore,opts)
-    outputDict["DatabaseInconsistencies"] = checkSampleConsistency(dbstore,opts)
-    outputDict["SampleStatistics"] = analyzeSampleStatistics(dbstore,opts)
-    if not opts.dryRun:
-      with open(opts.path+'/SamplesAnalysisReport.json', 'w') as outfile:
-        json.dump(outputDict, outfile, default=encode_storm_object)
-	force_symlink(opts.path+'/SamplesAnalysisReport.json',opts.basedir+'/data/SamplesAnalysisReport.json')
+    with openReport(opts,'SamplesAnalysisReport.json') as report:
+      report.write("MissingDirSamples", printCheck("Samples with missing path",samples["MissingDirSamples"]))
+      report.write("DatabaseInconsistencies", printCheck("Samples with missing source",samples["DatabaseInconsistencies"]))
+      report.write("SharedFiles", printSharedFiles(samples["SharedFiles"]))
+      if opts.filesReport is not None:
+        with open(opts.filesReport) as infile:
+          report.write("FileValidation", json.load(infile))
+      with phase("sample statistics") as stage:
+        report.write("SampleStatistics", analyzeSampleStatistics(samples["statistics"],opts))
+      samples["timings"]["statistics"] = stage.wall_s
+      report.write("Timings", samples["timings"])
 
     # now, check results
-    outputDict = {}
-    outputDict["MissingDirSamples"] = checkResultPath(dbstore,opts)
-    outputDict["DatabaseInconsistencies"] = checkResultConsistency(dbstore,opts)
-    outputDict["SelectedResults"] = selectResults(dbstore,opts)
-    outputDict["ResultsStatistics"] = analyzeResultsStatistics(dbstore,opts)
+    with openReport(opts,'ResultsAnalysisReport.json') as report:
+      report.write("MissingDirSamples", printCheck("Results with missing path",results["MissingDirSamples"]))
+      report.write("DatabaseInconsistencies", printCheck("Results with missing source",results["DatabaseInconsistencies"]))
+      report.write("SelectedResults", printCheck("Selected results",results["SelectedResults"]))
+      report.write("LumiOverlaps", printCheck("Results with lumi sections counted twice",results["LumiOverlaps"]))
+      with phase("result statistics") as stage:
+        report.write("ResultsStatistics", analyzeResultsStatistics(results["statistics"],opts))
+      results["timings"]["statistics"] = stage.wall_s
+      report.write("Timings", results["timings"])
+
+def runSections(opts,sections):
+    """run the sections concurrently, each in a thread with its own store.
+       Each section returns a dictionary with its checks, the data of its statistics and its timings."""
+    from multiprocessing.pool import ThreadPool
+    def run(section):
+      dbstore = DbStore()
+      try:
+        start = time.time()
+        output = section(dbstore,opts)
+        output["timings"]["total"] = time.time()-start
+        return output
+      finally:
+        dbstore.close()
+    pool = ThreadPool(len(sections))
+    try:
+      return pool.map(run,sections)
+    finally:
+      pool.terminate()
+
+def fanOut(rows,checkers,workers=1):
+    """apply the checkers to the rows of a shared scan (in parallel for the checks of the file system).
+       A checker is a function of a row returning None, or a (report entry, message) pair for a problem."""
+    from multiprocessing.pool import ThreadPool
+    found = dict((name,[]) for name,checker in checkers)
+    def check(row):
+      return [ (name,checker(row)) for name,checker in checkers ]
+    pool = ThreadPool(workers)
+    try:
+      for results in pool.imap(check,rows,chunksize=100):
+        for name,result in results:
+          if result is not None:
+            found[name].append(result)
+    finally:
+      pool.terminate()
+    return found
+
+def printCheck(title,found):
+    """print the messages of a check, and return its report entries"""
+    print "\n%s:"%title
+    print "="*(len(title)+1)
+    for entry,message in found:
+      print message
+    if len(found)==0: print "None"
+    return [ entry for entry,message in found ]
+
+def countBy(rows,column):
+    """(value, number of rows) for each value of a column, as given by a GROUP BY"""
+    counts = defaultdict(int)
+    for row in rows:
+      counts[row[column]] += 1
+    return sorted(counts.items(), key=lambda entry: (entry[0] is not None, entry[0]))
+
+def fullRecords(dbstore,cls,key,found):
+    """replace the projected rows of the problems found by all their columns"""
+    ids = [ entry[key] for entry,message in found ]
+    records = {}
+    for i in range(0,len(ids),500):
+      for record in iter_records(dbstore, cls, getattr(cls,key).is_in(ids[i:i+500])):
+        records[record[key]] = record
+    return [ (records.get(entry[key],entry),message) for entry,message in found ]
+
+def datasetSection(dbstore,opts):
+    """dataset checks and statistics, from one scan of the datasets"""
+    timings = {}
+    with phase("dataset scan") as stage:
+      nsamples = dict(dbstore.execute("SELECT source_dataset_id, COUNT(*) FROM sample GROUP BY source_dataset_id"))
+      rows = list(iter_records(dbstore, Dataset))
+    timings["scan"] = stage.wall_s
+    with phase("dataset checks") as stage:
+      output = fanOut(rows,[("Orphans",lambda dataset: orphanDataset(dataset,nsamples)),("IncompleteData",incompleteDataset)])
+      output["DatabaseInconsistencies"] = checkDatasets(rows,opts) if opts.DAScrosscheck else []
+    timings["checks"] = stage.wall_s
+    output["statistics"] = dict((column,countBy(rows,column)) for column in ("cmssw_release","globaltag","datatype","energy"))
+    output["statistics"]["datasets"] = sorted((dataset["creation_time"],nsamples.get(dataset["dataset_id"],0),dataset["nevents"],dataset["dsize"]) for dataset in rows)
+    output["timings"] = timings
+    return output
+
+def sampleSection(dbstore,opts):
+    """sample checks and statistics, from one scan of the samples"""
+    timings = {}
+    with phase("sample scan") as stage:
+      rows = list(iter_records(dbstore, Sample, columns=("name","path","sampletype","author","creation_time","nevents","nevents_processed")))
+    timings["scan"] = stage.wall_s
+    with phase("sample checks") as stage:
+      output = fanOut(rows,[("MissingDirSamples",lambda sample: missingPath("Sample",sample["sample_id"],sample))],opts.workers)
+      output["MissingDirSamples"] = fullRecords(dbstore,Sample,"sample_id",output["MissingDirSamples"])
+      output["DatabaseInconsistencies"] = checkSampleConsistency(dbstore,opts)
+      output["SharedFiles"] = find_duplicates(dbstore)
+    timings["checks"] = stage.wall_s
+    output["statistics"] = { "author" : countBy(rows,"author"), "sampletype" : countBy(rows,"sampletype"),
+                             "samples" : sorted((sample["creation_time"],sample["nevents"],sample["nevents_processed"]) for sample in rows) }
+    output["timings"] = timings
+    return output
+
+def resultSection(dbstore,opts):
+    """result checks and statistics, from one scan of the results"""
+    timings = {}
+    with phase("result scan") as stage:
+      nsamples = dict(dbstore.execute("SELECT result_id, COUNT(*) FROM sampleresult GROUP BY result_id"))
+      rows = list(iter_records(dbstore, Result))
+    timings["scan"] = stage.wall_s
+    with phase("result checks") as stage:
+      output = fanOut(rows,[("MissingDirSamples",lambda result: missingPath("Result",result["result_id"],result)),
+                            ("SelectedResults",lambda result: selectResult(result,opts))],opts.workers)
+      output["DatabaseInconsistencies"] = checkResultConsistency(dbstore,opts)
+      output["LumiOverlaps"] = checkLumiOverlaps(dbstore,opts)
+    timings["checks"] = stage.wall_s
+    output["statistics"] = { "author" : countBy(rows,"author"),
+                             "results" : sorted((result["creation_time"],nsamples.get(result["result_id"],0)) for result in rows) }
+    output["timings"] = timings
+    return output
+
+@contextmanager
+def openReport(opts,name):
+    """JSON report written section by section, and linked from the data directory of the website"""
+    report = ReportWriter(None if opts.dryRun else opts.path+'/'+name, compress=opts.compress)
+    try:
+      yield report
+    finally:
+      report.close()
     if not opts.dryRun:
-      with open(opts.path+'/ResultsAnalysisReport.json', 'w') as outfile:
-        json.dump(outputDict, outfile, default=encode_storm_object)
-	force_symlink(opts.path+'/ResultsAnalysisReport.json',opts.basedir+'/data/ResultsAnalysisReport.json')
+      force_symlink(report.path,opts.basedir+'/data/'+os.path.basename(report.path))
 
 def collectGeneralStats(dbstore,opts):
     # get number of datasets, samples, results, analyses
@@ -140,81 +283,58 @@ def collectGeneralStats(dbstore,opts):
     print results.count(), " results"
     return result
 
-def checkDatasets(dbstore,opts):
-    datasets = dbstore.find(Dataset)
-    print "\nDatasets inconsistent with DAS:"
-    print '=================================='
+def checkDatasets(datasets,opts):
     result = []
     for dataset in datasets:
-      query1 = "dataset="+dataset.name+" | grep dataset.name, dataset.nevents, dataset.size, dataset.tag, dataset.datatype, dataset.creation_time"
-      query2 = "release dataset="+dataset.name+" | grep release.name"
-      query3 = "config dataset="+dataset.name+" | grep config.global_tag,config.name=cmsRun"
+      query1 = "dataset="+dataset["name"]+" | grep dataset.name, dataset.nevents, dataset.size, dataset.tag, dataset.datatype, dataset.creation_time"
+      query2 = "release dataset="+dataset["name"]+" | grep release.name"
+      query3 = "config dataset="+dataset["name"]+" | grep config.global_tag,config.name=cmsRun"
       das_response1 = get_data(opts.host, query1, opts.idx, 1, opts.verbose, opts.threshold, opts.ckey, opts.cert, opts.das_headers)
       das_response2 = get_data(opts.host, query2, opts.idx, 1, opts.verbose, opts.threshold, opts.ckey, opts.cert, opts.das_headers)
       das_response3 = get_data(opts.host, query3, opts.idx, 1, opts.verbose, opts.threshold, opts.ckey, opts.cert, opts.das_headers)
       tmp = [{u'dataset' : [{}]},]
       for i in range(0,len(das_response1[0]["dataset"])):
-          if das_response1[0]["dataset"][i]["name"]==dataset.name:
+          if das_response1[0]["dataset"][i]["name"]==dataset["name"]:
               for key in das_response1[0]["dataset"][i]:
                   tmp[0]["dataset"][0][key] = das_response1[0]["dataset"][i][key]
       if not "tag" in tmp[0]["dataset"][0]:
           tmp[0]["dataset"][0][u'tag']=None
       das_response1 = tmp
       try:
-         test1 = das_response2[0]["release"][0]["name"]=="unknown" or dataset.cmssw_release == das_response2[0]["release"][0]["name"], 
-         test2 = dataset.datatype == das_response1[0]["dataset"][0]["datatype"],
-         test3 = dataset.nevents == das_response1[0]["dataset"][0]["nevents"], 
-         test4 = dataset.dsize == das_response1[0]["dataset"][0]["size"]
+         test1 = das_response2[0]["release"][0]["name"]=="unknown" or dataset["cmssw_release"] == das_response2[0]["release"][0]["name"], 
+         test2 = dataset["datatype"] == das_response1[0]["dataset"][0]["datatype"],
+         test3 = dataset["nevents"] == das_response1[0]["dataset"][0]["nevents"], 
+         test4 = dataset["dsize"] == das_response1[0]["dataset"][0]["size"]
       except:
-         result.append([dataset,"Inconsistent with DAS"])
-         print "%s (imported on %s)"%(str(dataset.name),str(dataset.creation_time))
+         result.append(([dataset,"Inconsistent with DAS"],"%s (imported on %s)"%(str(dataset["name"]),str(dataset["creation_time"]))))
       else:
          if not(test1 and test2 and test3 and test4):
-             result.append([dataset,"Inconsistent with DAS"])
-             print "%s (imported on %s)"%(str(dataset.name),str(dataset.creation_time))
+             result.append(([dataset,"Inconsistent with DAS"],"%s (imported on %s)"%(str(dataset["name"]),str(dataset["creation_time"]))))
     return result
 
-def findOrphanDatasets(dbstore,opts):
-    datasets = dbstore.find(Dataset)
-    print "\nOrphan Datasets:"
-    print '==================='
-    result = []
-    for dataset in datasets:
-        if dataset.samples.count()==0:
-            result.append(dataset)
-            print "%s (imported on %s)"%(str(dataset.name),str(dataset.creation_time))
-    if len(result)==0:
-       print "None"
-    return result
+def orphanDataset(dataset,nsamples):
+    if nsamples.get(dataset["dataset_id"],0)==0:
+        return dataset, "%s (imported on %s)"%(str(dataset["name"]),str(dataset["creation_time"]))
 
-def checkDatasetsIntegrity(dbstore,opts):
-    datasets = dbstore.find(Dataset)
-    print "\nDatasets integrity issues:"
-    print '==========================='
-    result = []
-    for dataset in datasets:
-        if dataset.cmssw_release is None:
-            result.append([dataset,"missing CMSSW release"])
-            print "%s (imported on %s): missing CMSSW release"%(str(dataset.name),str(dataset.creation_time))
-        elif dataset.energy is None:
-            result.append([dataset,"missing Energy"])
-            print "%s (imported on %s): missing Energy"%(str(dataset.name),str(dataset.creation_time))
-        elif dataset.globaltag is None:
-            result.append([dataset,"missing Globaltag"])
-            print "%s (imported on %s): missing Globaltag"%(str(dataset.name),str(dataset.creation_time))
-    if len(result)==0:
-       print "None"
-    return result
+def incompleteDataset(dataset):
+    if dataset["cmssw_release"] is None:
+        issue = "missing CMSSW release"
+    elif dataset["energy"] is None:
+        issue = "missing Energy"
+    elif dataset["globaltag"] is None:
+        issue = "missing Globaltag"
+    else:
+        return None
+    return [dataset,issue], "%s (imported on %s): %s"%(str(dataset["name"]),str(dataset["creation_time"]),issue)
     
 
-def analyzeDatasetsStatistics(dbstore,opts):
+def analyzeDatasetsStatistics(data,opts):
     # ROOT output
     if not opts.dryRun:
       rootfile = ROOT.TFile(opts.path+"/analysisReport.root","update")
     stats = {}
     # Releases used
-    output =  dbstore.execute("select dataset.cmssw_release,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY cmssw_release")
-    stats["cmssw_release"] = output.get_all()
+    stats["cmssw_release"] = data["cmssw_release"]
     releasePie = ROOT.TPie("datasetReleasePie","Datasets release",len(stats["cmssw_release"]))
     for index,entry in enumerate(stats["cmssw_release"]):
       releasePie.SetEntryVal(index,entry[1])
@@ -229,8 +349,7 @@ def analyzeDatasetsStatistics(dbstore,opts):
     if not opts.dryRun:
       ROOT.gPad.Write()
     # GlobalTag used
-    output =  dbstore.execute("select dataset.globaltag,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY globaltag")
-    stats["globaltag"] = output.get_all()
+    stats["globaltag"] = data["globaltag"]
     globaltagPie = ROOT.TPie("datasetGTPie","Datasets globaltag",len(stats["globaltag"]))
     for index,entry in enumerate(stats["globaltag"]):
       globaltagPie.SetEntryVal(index,entry[1])
@@ -245,8 +364,7 @@ def analyzeDatasetsStatistics(dbstore,opts):
     if not opts.dryRun:
       ROOT.gPad.Write()
     # Datatype
-    output =  dbstore.execute("select dataset.datatype,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY datatype")
-    stats["datatype"] = output.get_all()
+    stats["datatype"] = data["datatype"]
     datatypePie = ROOT.TPie("datasetTypePie","Datasets datatype",len(stats["datatype"]))
     for index,entry in enumerate(stats["datatype"]):
       datatypePie.SetEntryVal(index,entry[1])
@@ -261,8 +379,7 @@ def analyzeDatasetsStatistics(dbstore,opts):
     if not opts.dryRun:
       ROOT.gPad.Write()
     # Energy
-    output =  dbstore.execute("select dataset.energy,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY energy")
-    stats["energy"] = output.get_all()
+    stats["energy"] = data["energy"]
     energyPie = ROOT.TPie("datasetEnergyPie","Datasets energy",len(stats["energy"]))
     for index,entry in enumerate(stats["energy"]):
       energyPie.SetEntryVal(index,entry[1])
@@ -276,9 +393,8 @@ def analyzeDatasetsStatistics(dbstore,opts):
     energyPie.Draw("r")
     if not opts.dryRun:
       ROOT.gPad.Write()
-    # get all datasets to loop
-    datasets = dbstore.find(Dataset)
-    datasets.order_by(Dataset.creation_time)
+    # all datasets, by creation time
+    datasets = data["datasets"]
     # time evolution of # datasets (still in db)
     datasets_time = [[0,0]]
     # various stats (histograms)
@@ -286,13 +402,13 @@ def analyzeDatasetsStatistics(dbstore,opts):
     datasets_nevents  = ROOT.TH1I("dataseets_nevents", "datasets_nevents" ,100,0,-100)
     datasets_dsize    = ROOT.TH1I("dataseets_dsize",   "datasets_dsize"   ,100,0,-100)
     # let's go... loop
-    for dataset in datasets:
+    for creation_time,nsamples,nevents,dsize in datasets:
         # for Highcharts the time format is #seconds since epoch
-        time = int(dataset.creation_time.strftime("%s"))*1000
+        time = int(creation_time.strftime("%s"))*1000
         datasets_time.append([time,datasets_time[-1][1]+1])
-        datasets_nsamples.Fill(dataset.samples.count())
-        datasets_nevents.Fill(dataset.nevents)
-        datasets_dsize.Fill(dataset.dsize)
+        datasets_nsamples.Fill(nsamples)
+        datasets_nevents.Fill(nevents)
+        datasets_dsize.Fill(dsize)
     # drop this: just to initialize the loop
     datasets_time.pop(0)
     # output
@@ -325,115 +441,74 @@ def analyzeDatasetsStatistics(dbstore,opts):
     return stats
 
 
-def checkResultPath(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Result)
-    print "\nResults with missing path:"
-    print '==========================='
-    array = []
-    for res in result:
-      # check that the path exists, and keep track of the sample if not the case.
-      if not os.path.exists(res.path):
-        print "Result #%s (created on %s by %s):"%(str(res.result_id),str(res.creation_time),str(res.author)),
-        print " missing path: %s" %res.path
-        array.append(res)
-    if len(array)==0: print "None"
-    return array
+def missingPath(kind,key,entry):
+    # check that the path exists, and keep track of the entry if not the case.
+    if not os.path.exists(entry["path"]):
+        return entry, "%s #%s (created on %s by %s):  missing path: %s"%(kind,str(key),str(entry["creation_time"]),str(entry["author"]),entry["path"])
 
-    
-def checkSamplePath(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Sample)
-    print "\nSamples with missing path:"
-    print '==========================='
-    array = []
-    for sample in result:
-      # check that the path exists, and keep track of the sample if not the case.
-      if not os.path.exists(sample.path):
-        print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
-        print " missing path: %s" %sample.path
-        array.append(sample)
-    if len(array)==0: print "None"
-    return array
-
-
-def selectResults(dbstore,opts):
+def selectResult(result,opts):
     # look for result records pointing to a ROOT file
     # eventually further filter 
-    results = dbstore.find(Result)
-    print "\nSelected results:"
-    print '==========================='
-    array = []
-    for result in results:
-        path = result.path
-        if os.path.exists(path) and os.path.isdir(path):
-            files = [ f for f in os.listdir(path) if os.path.isfile(path+"/"+f) ]
-            if len(files)==1:
-                path = path+"/"+f
-		result.path = path
-	if os.path.exists(path) and os.path.isfile(path) and path.lower().endswith(".root"):
-	    symlink = "%s/data/result_%s.root"%(opts.basedir,str(result.result_id))
-	    relpath = "../data/result_%s.root"%(str(result.result_id))
-	    force_symlink(path,symlink)
-	    array.append([result,relpath])
-            print "Result #%s (created on %s by %s): "%(str(result.result_id),str(result.creation_time),str(result.author)),
-            print symlink
-
-    if len(array)==0: print "None"
-    return array
+    path = result["path"]
+    if os.path.exists(path) and os.path.isdir(path):
+        files = [ f for f in os.listdir(path) if os.path.isfile(path+"/"+f) ]
+        if len(files)==1:
+            path = path+"/"+files[0]
+            result = dict(result,path=path)
+    if os.path.exists(path) and os.path.isfile(path) and path.lower().endswith(".root"):
+        symlink = "%s/data/result_%s.root"%(opts.basedir,str(result["result_id"]))
+        relpath = "../data/result_%s.root"%(str(result["result_id"]))
+        force_symlink(path,symlink)
+        return [result,relpath], "Result #%s (created on %s by %s):  %s"%(str(result["result_id"]),str(result["creation_time"]),str(result["author"]),symlink)
 
 def checkResultConsistency(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Result)
-    print "\nResults with missing source:"
-    print '============================='
-    array = []
-    for res in result:
-      # check that the source sample exists in the database.
-      # normaly, this should be protected already at the level of sql rules
-      for sample in res.samples:
-        if sample is None:
-          print "Result #%s (created on %s by %s):"%(str(res.result_id),str(res.creation_time),str(res.author)),
-          print "inconsistent source sample"
-          array.append([res,"inconsistent source sample"])
-          print res
-          break
-    if len(array)==0: print "None"
-    return array
+    # get the results linked to a sample that does not exist.
+    # normaly, this should be protected already at the level of sql rules
+    result = iter_records(dbstore, Result, Exists(Select(SampleResult.sample_id, And(SampleResult.result_id == Result.result_id,
+                          Not(Exists(Select(Sample.sample_id, Sample.sample_id == SampleResult.sample_id, tables=Sample)))), tables=SampleResult)))
+    return [ ([res,"inconsistent source sample"],"Result #%s (created on %s by %s): inconsistent source sample"%(
+             str(res["result_id"]),str(res["creation_time"]),str(res["author"]))) for res in result ]
 
 
+def checkLumiOverlaps(dbstore,opts):
+    # data samples of the same result processing the same lumi sections
+    return [ (entry,"Result #%d: samples #%d %s and #%d %s share %d lumi sections (%s /pb)"%(entry["result_id"],
+             entry["samples"][0],entry["names"][0],entry["samples"][1],entry["names"][1],entry["lumisections"],
+             "unknown" if entry["luminosity"] is None else "%.1f"%entry["luminosity"]))
+             for entry in result_overlaps(dbstore)["overlaps"] ]
+
 def checkSampleConsistency(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Sample)
-    print "\nSamples with missing source:"
-    print '============================='
-    array = []
-    for sample in result:
-      # check that either the source dataset or the source sample exists in the database.
-      # normaly, this should be protected already at the level of sql rules
-      sourceDataset = sample.source_dataset
-      sourceSample = sample.source_sample
-      if (sample.source_dataset_id is not None) and (sourceDataset is None):
-        print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
-        print "inconsistent source dataset"
-        array.append([sample,"inconsistent source dataset"])
-        print sample
-      if (sample.source_sample_id is not None) and (sourceSample is None):
-        print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
-        print "inconsistent source sample"
-        array.append([sample,"inconsistent source sample"])
-    if len(array)==0: print "None"
-    return array
-
-
-def analyzeResultsStatistics(dbstore,opts):
+    # get the samples whose source dataset or source sample does not exist in the database.
+    # normaly, this should be protected already at the level of sql rules
+    Source = ClassAlias(Sample)
+    issues = [ ("inconsistent source dataset", And(Sample.source_dataset_id != None,
+                  Not(Exists(Select(Dataset.dataset_id, Dataset.dataset_id == Sample.source_dataset_id, tables=Dataset))))),
+               ("inconsistent source sample", And(Sample.source_sample_id != None,
+                  Not(Exists(Select(Source.sample_id, Source.sample_id == Sample.source_sample_id, tables=Source))))) ]
+    return [ ([sample,issue],"Sample #%s (created on %s by %s): %s"%(str(sample["sample_id"]),str(sample["creation_time"]),str(sample["author"]),issue))
+             for issue,condition in issues for sample in iter_records(dbstore, Sample, condition) ]
+
+
+def printSharedFiles(result):
+    # files registered in several samples (the events would be counted twice)
+    print "\nSamples sharing files:"
+    print '======================'
+    for entry in result["shared"]:
+      print "Samples #%d %s and #%d %s:"%(entry["samples"][0],entry["names"][0],entry["samples"][1],entry["names"][1]),
+      print "%d shared files (%s)"%(entry["shared_files"],entry["relation"])
+    for entry in result["within_sample"]:
+      print "Sample #%d %s: %d files registered more than once"%(entry["sample_id"],entry["name"],entry["duplicated_files"])
+    if len(result["shared"])+len(result["within_sample"])==0: print "None"
+    return result
+
+
+def analyzeResultsStatistics(data,opts):
     stats = {}
     # ROOT output
     if not opts.dryRun:
       rootfile = ROOT.TFile(opts.path+"/analysisReport.root","update")
     #authors statistics
-    output =  dbstore.execute("select result.author,COUNT(result.result_id) as numOfResults FROM result GROUP BY author")
-    stats["resultsAuthors"] = output.get_all()
+    stats["resultsAuthors"] = data["author"]
     authorPie = ROOT.TPie("resultsAuthorsPie","Results authors",len(stats["resultsAuthors"]))
     for index,entry in enumerate(stats["resultsAuthors"]):
       authorPie.SetEntryVal(index,entry[1])
@@ -448,17 +523,16 @@ def analyzeResultsStatistics(dbstore,opts):
     if not opts.dryRun:
       ROOT.gPad.Write()
     result_nsamples = ROOT.TH1I("result_nsamples","result_nsamples",20,0,20)
-    # get all samples to loop
-    results = dbstore.find(Result)
-    results.order_by(Result.creation_time)
+    # all results, by creation time
+    results = data["results"]
     # time evolution of # results (still in db)
     results_time = [[0,0]]
     # let's go... loop
-    for result in results:
+    for creation_time,nsamples in results:
         # for Highcharts the time format is #seconds since epoch
-        time = int(result.creation_time.strftime("%s"))*1000
+        time = int(creation_time.strftime("%s"))*1000
         results_time.append([time,results_time[-1][1]+1])
-        result_nsamples.Fill(result.samples.count())
+        result_nsamples.Fill(nsamples)
     # drop this: just to initialize the loop
     results_time.pop(0)
     # output
@@ -482,14 +556,13 @@ def analyzeResultsStatistics(dbstore,opts):
     # JSON output
     return stats
 
-def analyzeSampleStatistics(dbstore,opts):
+def analyzeSampleStatistics(data,opts):
     stats = {}
     # ROOT output
     if not opts.dryRun:
       rootfile = ROOT.TFile(opts.path+"/analysisReport.root","update")
     #authors statistics
-    output =  dbstore.execute("select sample.author,COUNT(sample.sample_id) as numOfSamples FROM sample GROUP BY author")
-    stats["sampleAuthors"] = output.get_all()
+    stats["sampleAuthors"] = data["author"]
     authorPie = ROOT.TPie("sampleAuthorsPie","Samples authors",len(stats["sampleAuthors"]))
     for index,entry in enumerate(stats["sampleAuthors"]):
       authorPie.SetEntryVal(index,entry[1])
@@ -504,8 +577,7 @@ def analyzeSampleStatistics(dbstore,opts):
     if not opts.dryRun:
       ROOT.gPad.Write()
     #sample types statistics
-    output =  dbstore.execute("select sample.sampletype,COUNT(sample.sample_id) as numOfSamples FROM sample GROUP BY sampletype")
-    stats["sampleTypes"] = output.get_all()
+    stats["sampleTypes"] = data["sampletype"]
     typePie = ROOT.TPie("sampleTypesPie","Samples types",len(stats["sampleTypes"]))
     for index,entry in enumerate(stats["sampleTypes"]):
       typePie.SetEntryVal(index,entry[1])
@@ -519,9 +591,8 @@ def analyzeSampleStatistics(dbstore,opts):
     typePie.Draw("r")
     if not opts.dryRun:
       ROOT.gPad.Write()
-    # get all samples to loop
-    result = dbstore.find(Sample)
-    result.order_by(Sample.creation_time)
+    # all samples, by creation time
+    result = data["samples"]
     # events statistics
     sample_nevents_processed = ROOT.TH1I("sample_nevents_processed","sample_nevents_processed",100,0,-100)
     sample_nevents = ROOT.TH1I("sample_nevents","sample_nevents",100,0,-100)
@@ -530,11 +601,11 @@ def analyzeSampleStatistics(dbstore,opts):
     sample_nevents_time = [[0,0]] 
     samples_time = [[0,0]]
     # let's go... loop
-    for sample in result:
+    for creation_time,nevents,nevents_processed in result:
         # for Highcharts the time format is #seconds since epoch
-        time = int(sample.creation_time.strftime("%s"))*1000
-        ne = 0 if sample.nevents is None else sample.nevents
-        np = 0 if sample.nevents_processed is None else sample.nevents_processed
+        time = int(creation_time.strftime("%s"))*1000
+        ne = 0 if nevents is None else nevents
+        np = 0 if nevents_processed is None else nevents_processed
         sample_nevents_processed.Fill(np)
         sample_nevents.Fill(ne)
         sample_nevents_processed_time.append([time,sample_nevents_processed_time[-1][1]+np])
@@ -581,33 +652,6 @@ def analyzeSampleStatistics(dbstore,opts):
     # JSON output
     return stats
 
-# function to serialize the storm objects,
-# from Jamu Kakar and Mario Zito at https://lists.ubuntu.com/archives/storm/2010-May/001286.html
-def encode_storm_object(object):
-    ''' Serializes to JSON a Storm object
-    
-    Use:
-        from storm.info import get_cls_info
-        import json
-        ...
-        storm_object = get_storm_object()
-        print json.dumps(storm_object, default=encode_storm_object)
-            
-    Warnings:
-        Serializes objects containing Int, Date and Unicode data types
-        other datatypes are not tested. MUST be improved
-    '''
-    if not hasattr(object, "__storm_table__"):
-        raise TypeError(repr(object) + " is not JSON serializable")
-    result = {}
-    cls_info = get_cls_info(object.__class__)
-    for name in cls_info.attributes.iterkeys():
-        value= getattr(object, name)
-        if (isinstance(value, date)): 
-            value= str(value)
-        result[name] = value
-    return result
-
 def force_symlink(file1, file2):
     try:
         os.symlink(file1, file2)
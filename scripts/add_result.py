@@ -8,6 +8,8 @@ from datetime import datetime
 from optparse import OptionParser
 from cp3_llbb.SAMADhi.SAMADhi import Analysis, Sample, Result, DbStore
 from cp3_llbb.SAMADhi.userPrompt import confirm, prompt_samples, parse_samples
+from cp3_llbb.SAMADhi.lumioverlap import result_overlaps
+from cp3_llbb.SAMADhi.registration import load_manifest, register_results, ManifestError
 
 class MyOptionParser: 
     """
@@ -15,6 +17,7 @@ class MyOptionParser:
     """
     def __init__(self):
         usage  = "Usage: %prog path [options]\n"
+        usage += "   or: %prog --manifest results.json\n"
         self.parser = OptionParser(usage=usage)
         self.parser.add_option("-s", "--sample", action="store", type="string", 
                                default=None, dest="inputSamples",
@@ -34,12 +37,20 @@ class MyOptionParser:
         self.parser.add_option("-t", "--time", action="store", type="string", 
                                default=None, dest="time",
              help="result timestamp. If set to \"path\", timestamp will be taken from the path. Otherwise, it must be formated like YYYY-MM-DD HH:MM:SS")
+        self.parser.add_option("-m", "--manifest", action="store", type="string",
+                               default=None, dest="manifest",
+             help="register all the results of a JSON (or YAML) manifest at once, without questions (see registration.py)")
 
     def get_opt(self):
         """
         Returns parse list of options
         """
         opts, args = self.parser.parse_args()
+        # batch mode: everything is in the manifest
+        if opts.manifest is not None:
+          if len(args) > 0:
+            self.parser.error("no path can be given with a manifest")
+          return opts
         # check that the path exists
         if len(args) < 1:
           self.parser.error("path is mandatory")
@@ -64,6 +75,9 @@ def main():
     # get the options
     optmgr = MyOptionParser()
     opts   = optmgr.get_opt()
+    if opts.manifest is not None:
+      register_manifest(opts.manifest)
+      return
     # build the result from user input
     result = Result(unicode(opts.path))
     result.description = unicode(opts.desc)
@@ -89,9 +103,28 @@ def main():
     dbstore.flush()
     # print the resulting object and ask for confirmation
     print result
+    # warn about data samples processing the same lumi sections
+    for overlap in result_overlaps(dbstore, [result.result_id])["overlaps"]:
+      print "Warning: samples #%d and #%d share %d lumi sections"%(overlap["samples"][0],overlap["samples"][1],overlap["lumisections"])
     if confirm(prompt="Insert into the database?", resp=True):
       dbstore.commit()
 
+def register_manifest(path):
+    """register the results of a manifest in one transaction"""
+    dbstore = DbStore()
+    try:
+      summary = register_results(dbstore, load_manifest(path, "results"))
+    except ManifestError as error:
+      print "Nothing registered, the manifest has problems:"
+      print error
+      dbstore.rollback()
+      return
+    dbstore.commit()
+    print summary
+    # warn about data samples processing the same lumi sections
+    for overlap in result_overlaps(dbstore, [ result_id for result_id, path, nsamples in summary.entries ])["overlaps"]:
+      print "Warning: result #%d: samples #%d and #%d share %d lumi sections"%(overlap["result_id"],overlap["samples"][0],overlap["samples"][1],overlap["lumisections"])
+
 #
 # main
 #
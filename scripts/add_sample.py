@@ -3,32 +3,23 @@
 # Script to add a sample to the database
 
 import os
-import glob
 from pwd import getpwuid
 from optparse import OptionParser
 from datetime import datetime
 from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, File, DbStore
 from cp3_llbb.SAMADhi.userPrompt import confirm, prompt_dataset, prompt_sample
+from cp3_llbb.SAMADhi.sampleupdate import diff_sample, apply_sample_changes
+from cp3_llbb.SAMADhi.filescan import scan_files, list_file, diff_files, apply_changes
+from cp3_llbb.SAMADhi.registration import load_manifest, register_samples, ManifestError
+from cp3_llbb.SAMADhi.rootmeta import file_metadata, BACKENDS
+from cp3_llbb.SAMADhi.checksums import ChecksumBackfill
+from cp3_llbb.SAMADhi.tracing import phase
 
-def get_file_data_(f_):
-    import ROOT
-
-    f = ROOT.TFile.Open(f_)
-    if not f:
-        return (None, None)
-
-    weight_sum = f.Get("event_weight_sum")
-    if weight_sum:
-        weight_sum = weight_sum.GetVal()
-    else:
-        weight_sum = None
+# how the files are read (see rootmeta.py), set from the options
+metadata_backend = "auto"
 
-    entries = None
-    tree = f.Get("t")
-    if tree:
-        entries = tree.GetEntriesFast()
-
-    return (weight_sum, entries)
+def get_file_data_(f_):
+    return file_metadata(f_, metadata_backend)
 
 
 class MyOptionParser: 
@@ -38,7 +29,8 @@ class MyOptionParser:
     def __init__(self):
         usage  = "Usage: %prog type path [options]\n"
         usage += "where type is one of PAT, SKIM, RDS, NTUPLES, HISTOS, ...\n"
-        usage += "      and path is the location of the sample on disk"  
+        usage += "      and path is the location of the sample on disk\n"
+        usage += "   or: %prog --manifest samples.json"
         self.parser = OptionParser(usage=usage)
         self.parser.add_option("--name", action="store", type="string", 
                                default=None, dest="name",
@@ -79,12 +71,38 @@ class MyOptionParser:
         self.parser.add_option("-t", "--time", action="store", type="string",
                                default=None, dest="time",
              help="result timestamp. If set to \"path\", timestamp will be taken from the path. Otherwise, it must be formated like YYYY-MM-DD HH:MM:SS. Default is current time.")
+        self.parser.add_option("--resync", action="store_true",
+                               default=False, dest="resync",
+             help="update the files of an existing sample: add the new files, remove the vanished ones and read again the changed ones")
+        self.parser.add_option("-j", "--workers", action="store", type="int",
+                               default=8, dest="workers",
+             help="number of directories listed in parallel")
+        self.parser.add_option("-m", "--manifest", action="store", type="string",
+                               default=None, dest="manifest",
+             help="register all the samples of a JSON (or YAML) manifest at once, without questions (see registration.py). "
+                  "The files of all the samples are listed and read by the same -j workers")
+        self.parser.add_option("--commit-each", action="store_true",
+                               default=False, dest="commit_each",
+             help="with a manifest, commit each sample when its files are read (by default, all of them are committed at the end)")
+        self.parser.add_option("--backend", action="store", type="choice",
+                               choices=list(BACKENDS), default="auto", dest="backend",
+             help="how the event weight sum and the number of entries are read from the files: python (without ROOT), "
+                  "pyroot, or auto (python, and PyROOT for the files it cannot read, e.g. remote ones)")
+        self.parser.add_option("--checksums", action="store_true",
+                               default=False, dest="checksums",
+             help="also compute the checksums of the new and changed files (see checksums.py; "
+                  "scripts/checksum_files.py does it for the files already registered)")
 
     def get_opt(self):
         """
         Returns parse list of options
         """
         opts, args = self.parser.parse_args()
+        # batch mode: everything is in the manifest
+        if opts.manifest is not None:
+          if len(args) > 0:
+            self.parser.error("no type and path can be given with a manifest")
+          return opts
         # mandatory arguments
         if len(args) < 2:
           self.parser.error("type and path are mandatory")
@@ -112,11 +130,70 @@ class MyOptionParser:
             opts.name = opts.path.split('/')[-1]
         return opts
 
+def list_files_(path, files, workers):
+    """(path, size, mtime) of the given files, or of the root files in path and its subdirectories.
+       The size and modification time of the given files that are remote or not visible yet are None."""
+    if files == "":
+        return scan_files(path, workers=workers)
+    return [ list_file(f) for f in unicode(files).split(",") ]
+
+def checksum_files_(dbstore, sample_ids, opts):
+    """fill the checksums of the new and changed files of the samples, before the commit"""
+    if not opts.checksums:
+      return
+    dbstore.flush()
+    with phase("checksum files"):
+      summary = ChecksumBackfill(dbstore, sample_ids=sample_ids, workers=opts.workers, commit=False).run()
+    print "Checksums: %s" % ", ".join("%d %s" % (n, status) for status, n in sorted(summary["counts"].items()))
+
+def resync(opts):
+    """Compare the files on disk to the File entries of an existing sample, and apply the differences"""
+    dbstore = DbStore()
+    sample = dbstore.find(Sample,Sample.name==unicode(opts.name)).one()
+    if sample is None:
+      raise IndexError("No sample with such name: %s"%opts.name)
+    with phase("list files"):
+      files = list_files_(unicode(opts.path), opts.files, opts.workers)
+    changes = diff_files(dbstore, sample.sample_id, files)
+    print "Sample %s: %s" % (sample.name, changes)
+    if len(changes) == 0:
+      return
+    if confirm(prompt="Update the files in the database?", resp=True):
+      with phase("read %d files" % (len(changes.new)+len(changes.changed))):
+        apply_changes(dbstore, sample.sample_id, changes, get_file_data_)
+      checksum_files_(dbstore, [ sample.sample_id ], opts)
+      with phase("commit"):
+        dbstore.commit()
+
+def register_manifest(opts):
+    """register the samples of a manifest, and their files"""
+    dbstore = DbStore()
+    try:
+      with phase("register samples"):
+        summary = register_samples(dbstore, load_manifest(opts.manifest, "samples"), get_file_data_, opts.workers, opts.commit_each)
+    except ManifestError as error:
+      print "Nothing registered, the manifest has problems:"
+      print error
+      dbstore.rollback()
+      return
+    checksum_files_(dbstore, [ sample_id for sample_id, name, nfiles in summary.entries ], opts)
+    with phase("commit"):
+      dbstore.commit()
+    print summary
+
 def main():
     """Main function"""
     # get the options
     optmgr = MyOptionParser()
     opts   = optmgr.get_opt()
+    global metadata_backend
+    metadata_backend = opts.backend
+    if opts.resync:
+      resync(opts)
+      return
+    if opts.manifest is not None:
+      register_manifest(opts)
+      return
     # build the sample from user input
     sample  = Sample(unicode(opts.name), unicode(opts.path), unicode(opts.sampletype), opts.nevents_processed)
     sample.nevents = opts.nevents
@@ -153,23 +230,27 @@ def main():
     if sample.nevents_processed is None:
       print "Warning: Number of processed events not given, and no way to guess it."
 
-    # List input files
-    files = []
-    if opts.files == "":
-        files = glob.glob(os.path.join(sample.path, '*.root'))
-    else:
-        files = unicode(opts.files).split(",")
+    # List input files, in the sample directory and its subdirectories
+    with phase("list files"):
+      files = list_files_(sample.path, opts.files, opts.workers)
     if len(files) == 0:
       print "Warning: no root files found in %r" % sample.path
 
     # Try to guess the number of events stored into the file, as well as the weight sum
-    for f in files:
-        (weight_sum, entries) = get_file_data_(f)
-        sample.files.add(File(f, f, weight_sum, entries))
+    entries = []
+    with phase("read %d files" % len(files)):
+      for f, size, mtime in files:
+        (weight_sum, nevents) = get_file_data_(f)
+        entry = File(f, f, weight_sum, None, nevents)
+        entry.size = size
+        entry.mtime = mtime
+        entries.append(entry)
 
     # check that there is no existing entry
     checkExisting = dbstore.find(Sample,Sample.name==sample.name)
     if checkExisting.is_empty():
+      for entry in entries:
+        sample.files.add(entry)
       print sample
       if confirm(prompt="Insert into the database?", resp=True):
         dbstore.add(sample)
@@ -177,20 +258,25 @@ def main():
         if sample.luminosity is None:
           dbstore.flush()
           sample.luminosity = sample.getLuminosity()
+        checksum_files_(dbstore, [ sample.sample_id ], opts)
     else:
+      # only the changed columns and files are written
       existing = checkExisting.one()
-      prompt  = "Replace existing "
+      changes = diff_sample(dbstore, existing, sample, entries)
+      prompt  = "Update existing "
       prompt += str(existing)
-      prompt += "\nby new "
-      prompt += str(sample)
+      prompt += "\nwith the changes\n"
+      prompt += str(changes)
       prompt += "\n?"
       if confirm(prompt, resp=False):
-        existing.replaceBy(sample)
+        apply_sample_changes(dbstore, existing, changes)
         if existing.luminosity is None:
           dbstore.flush()
           existing.luminosity = existing.getLuminosity()
+        checksum_files_(dbstore, [ existing.sample_id ], opts)
     # commit
-    dbstore.commit()
+    with phase("commit"):
+      dbstore.commit()
 
 #
 # main
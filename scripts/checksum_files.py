@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+""" Compute the missing checksums (adler32, and xxhash64 if the xxhash module is available) of the
+    files registered in the database, with a pool of processes, or verify the recorded ones.
+    The checksums are cached locally by (path, size, modification time): unchanged files are
+    not read again (except with --verify), and an interrupted run continues with the files not done yet. """
+
+import sys
+import json
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi.splitting import resolve_samples
+from cp3_llbb.SAMADhi.checksums import ChecksumBackfill, ChecksumCache, xxhash
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Fill the checksums of the File entries of the database (schema v11), or verify them.')
+
+    parser.add_argument('-s', '--samples', nargs='+', dest='samples', help='Only these samples (names, ids or name patterns)')
+    parser.add_argument('-j', '--workers', type=int, default=8, dest='workers', help='Number of files read in parallel')
+    parser.add_argument('--verify', dest='verify', action='store_true', help='Also read the files with checksums, and compare them to the recorded ones (the cache is not used, only refreshed)')
+    parser.add_argument('--cache', default='checksum_files.cache', dest='cache', help='Local cache of the checksums (SQLite file)')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='Read all the files, even if their checksums are cached')
+    parser.add_argument('--chunk-size', type=int, default=1000, dest='chunk_size', help='Number of files per update of the database')
+    parser.add_argument('-o', '--output', default='FilesChecksumReport.json', dest='output', help='Output JSON report')
+    parser.add_argument('-d', '--database', dest='database', help='Database URI (e.g. sqlite:/path/to/file). By default, the credentials in ~/.samadhi are used.')
+
+    return parser.parse_args()
+
+def main():
+    options = get_options()
+    dbstore = DbStore(uri=options.database)
+    sample_ids = None
+    if options.samples:
+        try:
+            sample_ids = resolve_samples(dbstore, options.samples)
+        except KeyError as error:
+            print(error.args[0])
+            sys.exit(1)
+    if xxhash is None:
+        print("The xxhash module is not available, only the adler32 checksums are computed")
+    cache = None if options.no_cache else ChecksumCache(options.cache)
+    backfill = ChecksumBackfill(dbstore, cache, sample_ids=sample_ids, workers=options.workers,
+                                verify=options.verify, chunk_size=options.chunk_size)
+    summary = backfill.run()
+    with open(options.output, "w") as outfile:
+        json.dump(summary, outfile, indent=2)
+
+    print("%d files in %.0f s (%.1f GB read, %.0f MB/s), %d entries updated: %s" % (
+          sum(summary["counts"].values()), summary["elapsed_s"], summary["bytes"]/1e9,
+          summary["bytes"]/1e6/max(summary["elapsed_s"], 1e-6), summary["updated"],
+          ", ".join("%d %s" % (n, status) for status, n in sorted(summary["counts"].items()))))
+    for problem in summary["problems"][:20]:
+        print("File #%d %s: %s" % (problem["id"], problem["pfn"], problem["status"]))
+    if len(summary["problems"]) > 20:
+        print("... and %d more problems" % (len(summary["problems"])-20))
+    print("Report written to %s" % options.output)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
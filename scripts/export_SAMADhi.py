@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+""" Export the catalog tables to columnar files (Parquet or Arrow), for analytics without the database server """
+
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi.tracing import phase
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Export the catalog tables, and a denormalized view of the samples, to columnar files. '
+                                     'They are read with columnar.load_catalog(directory).')
+
+    parser.add_argument('directory', type=str, help='Output directory', metavar='DIRECTORY')
+
+    parser.add_argument('-f', '--format', choices=['parquet', 'arrow'], dest='format', default='parquet',
+            help='Parquet (compressed), or Arrow IPC files (memory-mapped without copy when loaded)')
+    parser.add_argument('-c', '--compression', type=str, dest='compression', default='snappy',
+            help='Compression of the Parquet files (snappy, gzip, zstd, ...)')
+    parser.add_argument('-t', '--tables', type=str, nargs='+', dest='tables', default=None, metavar='TABLE',
+            help='Tables to export (all of them by default)')
+    parser.add_argument('--chunk-size', type=int, dest='chunk_size', default=50000, help='Number of rows read and written at once')
+
+    options = parser.parse_args()
+
+    return options
+
+def main():
+    options = get_options()
+    # imported here to give the usage without pyarrow
+    from cp3_llbb.SAMADhi.columnar import export_catalog, TABLES
+    tables = TABLES if options.tables is None else options.tables
+    unknown = [ table for table in tables if table not in TABLES ]
+    if unknown:
+        print("Unknown tables: %s (possible tables: %s)" % (", ".join(unknown), ", ".join(TABLES)))
+        return
+    dbstore = DbStore()
+    with phase("export"):
+        export_catalog(dbstore, options.directory, tables, options.format, options.compression, options.chunk_size)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+""" Upgrade the SAMADhi database schema to the latest (or a given) version """
+
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi.migrations import MigrationRunner
+from cp3_llbb.SAMADhi import schema
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Apply the pending schema migrations to the SAMADhi database.')
+
+    parser.add_argument('-d', '--database', dest='database', help='Database URI (e.g. sqlite:/path/to/file). By default, the credentials in ~/.samadhi are used.')
+    parser.add_argument('--status', dest='status', action='store_true', help='Only print the current version and the pending migrations')
+    parser.add_argument('--target', type=int, dest='target', help='Version to upgrade to (latest by default)')
+    parser.add_argument('--chunk-size', type=int, default=10000, dest='chunk_size', help='Number of rows per chunk for data backfills')
+    parser.add_argument('--pause', type=float, default=0., dest='pause', help='Pause between two chunks, in seconds, to limit the load on the server')
+    parser.add_argument('--create-sqlite', dest='create', action='store_true', help='Create the catalog tables first (empty SQLite database only)')
+
+    return parser.parse_args()
+
+def main():
+    options = get_options()
+    dbstore = DbStore(uri=options.database)
+    if options.create:
+        schema.create_sqlite_schema(dbstore)
+    runner = MigrationRunner(dbstore, chunk_size=options.chunk_size, pause=options.pause)
+
+    current = runner.current_version()
+    print("Current schema version: %s" % ("unversioned" if current is None else current))
+    pending = runner.pending(options.target)
+    if not pending:
+        print("The database is up to date.")
+        return
+    print("Pending migrations:")
+    for migration in pending:
+        print("  %s" % migration)
+    if options.status:
+        return
+
+    applied = runner.upgrade(options.target)
+    print("Applied %d migration(s), the schema is now at version %d." % (len(applied), runner.current_version()))
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
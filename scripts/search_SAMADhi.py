@@ -4,7 +4,8 @@
 
 import os
 from optparse import OptionParser
-from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, Result, DbStore, Analysis
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, Result, DbStore, Analysis, iter_chunks
+from cp3_llbb.SAMADhi.tracing import phase
 
 class MyOptionParser: 
     """
@@ -75,27 +76,27 @@ def main():
       objectId = Result.result_id
 
     if opts.objid is not None:
-      result = dbstore.find(objectClass, objectId==opts.objid)
+      conditions = [ objectId==opts.objid ]
     elif opts.path is not None:
-      result = dbstore.find(objectClass, objectClass.path.like(unicode(opts.path.replace('*', '%').replace('?', '_'))))
+      conditions = [ objectClass.path.like(unicode(opts.path.replace('*', '%').replace('?', '_'))) ]
     elif opts.name is not None:
-      result = dbstore.find(objectClass, objectClass.name.like(unicode(opts.name.replace('*', '%').replace('?', '_'))))
+      conditions = [ objectClass.name.like(unicode(opts.name.replace('*', '%').replace('?', '_'))) ]
     else: 
-      result = dbstore.find(objectClass)
+      conditions = [ ]
 
-    result = result.order_by(objectId)
-    # loop and print
-    if opts.longOutput:
-      for entry in result:
-        print entry
-        print "--------------------------------------------------------------------------------------"
-    else:
-      if opts.objtype != "result" and opts.objtype != "analysis":
-        data = result.values(objectId, objectClass.name)
+    # loop and print, by chunks of entries
+    with phase("search and print"):
+      if opts.longOutput:
+        for entry in iter_chunks(dbstore, objectClass, *conditions):
+          print entry
+          print "--------------------------------------------------------------------------------------"
       else:
-        data = result.values(objectId, objectClass.description)
-      for dset in data:
-        print "%i\t%s"%(dset[0], dset[1])
+        if opts.objtype != "result" and opts.objtype != "analysis":
+          columns = (objectId, objectClass.name)
+        else:
+          columns = (objectId, objectClass.description)
+        for dset in iter_chunks(dbstore, objectClass, *conditions, columns=columns):
+          print "%i\t%s"%(dset[0], dset[1])
 
 #
 # main
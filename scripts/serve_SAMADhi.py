@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+""" Read-only JSON service for the SAMADhi catalog, with a response cache invalidated when the catalog changes.
+    Examples: /samples?name=TT*&page=2, /samples/123, /results?analysis=4, /datasets?datatype=mc """
+
+import argparse
+from cp3_llbb.SAMADhi.service import serve
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Serve the SAMADhi catalog as JSON over HTTP (read-only).')
+
+    parser.add_argument('-d', '--database', dest='database', help='Database URI (e.g. sqlite:/path/to/file). By default, the credentials in ~/.samadhi are used.')
+    parser.add_argument('--snapshot', dest='snapshot', help='Serve a local snapshot of the catalog (see snapshot_SAMADhi.py)')
+    parser.add_argument('--host', default='localhost', dest='host', help='Address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8080, dest='port', help='Port to listen on')
+    parser.add_argument('-w', '--workers', type=int, default=8, dest='workers', help='Number of threads (and database connections)')
+    parser.add_argument('--cache-size', type=int, default=1000, dest='cache_size', help='Maximal number of cached responses')
+    parser.add_argument('--version-ttl', type=float, default=5., dest='version_ttl', help='Seconds between two checks of the catalog version')
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true', help='Do not log the requests')
+
+    return parser.parse_args()
+
+def main():
+    options = get_options()
+    serve(host=options.host, port=options.port, workers=options.workers, quiet=options.quiet,
+          cache_size=options.cache_size, version_ttl=options.version_ttl, uri=options.database, snapshot=options.snapshot)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
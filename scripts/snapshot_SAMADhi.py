@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+""" Create or synchronize a local read-only SQLite snapshot of the SAMADhi catalog.
+    Jobs use it with export SAMADHI_SNAPSHOT=/path/to/snapshot.db """
+
+import os
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi.snapshot import update_snapshot, open_snapshot, get_state
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Create a local SQLite snapshot of the SAMADhi database, or bring it up to date.')
+
+    parser.add_argument('path', help='Path of the snapshot file')
+    parser.add_argument('-d', '--database', dest='database', help='Database URI (e.g. sqlite:/path/to/file). By default, the credentials in ~/.samadhi are used.')
+    parser.add_argument('--full', dest='full', action='store_true', help='Rebuild the snapshot from scratch')
+    parser.add_argument('--status', dest='status', action='store_true', help='Only print the synchronization state of the snapshot')
+    parser.add_argument('--chunk-size', type=int, default=10000, dest='chunk_size', help='Number of rows copied per query')
+
+    return parser.parse_args()
+
+def main():
+    options = get_options()
+    if options.status:
+        for name, value in sorted(get_state(open_snapshot(options.path)).items()):
+            print("%-20s %s" % (name, value))
+        return
+    # the snapshot is made from the database, never from another snapshot
+    os.environ.pop("SAMADHI_SNAPSHOT", None)
+    dbstore = DbStore(uri=options.database)
+    counts = update_snapshot(dbstore, options.path, full=options.full, chunk_size=options.chunk_size)
+    for table in sorted(counts.keys()):
+        print("%-15s %s" % (table, ", ".join("%d %s" % (n, what) for what, n in sorted(counts[table].items()))))
+    print("Snapshot %s is up to date." % options.path)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
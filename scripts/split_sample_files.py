@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+""" Split the files of samples into jobs with balanced numbers of events, and write the job manifests """
+
+import sys
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi import splitting
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Split the files of samples into jobs with balanced numbers of events.')
+
+    parser.add_argument('samples', nargs='+', help='Sample names, ids or name patterns (with * and ?)')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-n', '--jobs', type=int, dest='njobs', help='Number of jobs (per sample with --per-sample)')
+    group.add_argument('-e', '--events-per-job', type=int, dest='events_per_job', help='Approximate number of events per job')
+    parser.add_argument('--per-sample', dest='per_sample', action='store_true', help='Do not mix the files of different samples in a job')
+    parser.add_argument('-f', '--format', choices=('json', 'text'), default='json', dest='format', help='One JSON manifest, or a directory with one text file (list of pfn) per job')
+    parser.add_argument('-o', '--output', default='jobs.json', dest='output', help='Output JSON file or directory')
+    parser.add_argument('-d', '--database', dest='database', help='Database URI (e.g. sqlite:/path/to/file). By default, the credentials in ~/.samadhi are used.')
+
+    options = parser.parse_args()
+    if (options.njobs is not None and options.njobs < 1) or (options.events_per_job is not None and options.events_per_job < 1):
+        parser.error("the number of jobs and of events per job must be positive")
+
+    return options
+
+def main():
+    options = get_options()
+    dbstore = DbStore(uri=options.database)
+    try:
+        sample_ids = splitting.resolve_samples(dbstore, options.samples)
+    except KeyError as error:
+        print(error.args[0])
+        sys.exit(1)
+    jobs = splitting.plan_jobs(dbstore, sample_ids, njobs=options.njobs, events_per_job=options.events_per_job, per_sample=options.per_sample)
+    if options.format == "json":
+        splitting.write_json(dbstore, jobs, options.output)
+    else:
+        splitting.write_text(dbstore, jobs, options.output)
+    smallest, largest, mean = splitting.balance(jobs)
+    print("%d files of %d samples split into %d jobs of %d to %d events (mean %.0f), written to %s" % (
+          sum(len(job) for job in jobs), len(sample_ids), len(jobs), smallest, largest, mean, options.output))
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
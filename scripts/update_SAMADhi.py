@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+""" Update some columns of many catalog entries at once (e.g. the cross-section of a campaign) """
+
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi.bulkupdate import BulkUpdate, TABLES, parse_value, parse_date
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Update some columns of all the entries of a table matching a selection. '
+                                     'Nothing is written without -w: the number of entries to update and the changes of the first ones are shown.')
+
+    parser.add_argument('table', choices=sorted(TABLES), help='Table to update')
+
+    parser.add_argument('-s', '--set', type=str, action='append', dest='values', required=True, metavar='COLUMN=VALUE',
+            help='New value of a column (NULL for no value). Can be given several times')
+
+    parser.add_argument('--name', type=str, nargs='+', dest='names', default=[], metavar='NAME',
+            help='Names of the entries (path for results, lfn for files). Only \'*\' and \'?\' wildcards are supported')
+    parser.add_argument('-i', '--id', type=int, nargs='+', dest='ids', default=[], metavar='ID', help='IDs of the entries')
+    parser.add_argument('--datatype', choices=['mc', 'data'], help='Datatype of the dataset (the source dataset for samples)')
+    parser.add_argument('--energy', type=float, help='Center-of-mass energy of the dataset (the source dataset for samples), in TeV')
+    parser.add_argument('--author', type=str, help='Author of the samples or results')
+    parser.add_argument('--since', type=parse_date, help='Created on or after this date (YYYY-MM-DD)', metavar='DATE')
+    parser.add_argument('--until', type=parse_date, help='Created before this date (YYYY-MM-DD)', metavar='DATE')
+    parser.add_argument('--all', dest='all', action='store_true', help='Allow to update the whole table, without any selection')
+
+    parser.add_argument('-n', '--preview', type=int, dest='preview', default=10, metavar='N', help='Number of changed entries shown')
+    parser.add_argument('-w', '--write', dest='write', action='store_true', help='Write changes to the database')
+
+    options = parser.parse_args()
+
+    selection = [ options.names, options.ids, options.datatype, options.energy, options.author, options.since, options.until ]
+    if not options.all and not any(value is not None and value != [] for value in selection):
+        parser.error('No selection given: use --all to update the whole table')
+
+    values = {}
+    for assignment in options.values:
+        if '=' not in assignment:
+            parser.error('Invalid assignment %s (expected COLUMN=VALUE)' % assignment)
+        column, text = assignment.split('=', 1)
+        try:
+            values[column] = parse_value(options.table, column, text)
+        except ValueError as error:
+            parser.error(str(error))
+    options.values = values
+
+    return options
+
+def main():
+    options = get_options()
+    dbstore = DbStore()
+    try:
+        update = BulkUpdate(options.table, options.values, names=options.names, ids=options.ids, datatype=options.datatype,
+                            energy=options.energy, author=options.author, since=options.since, until=options.until)
+    except ValueError as error:
+        print(error)
+        return
+
+    preview = update.preview(dbstore, options.preview)
+    print(preview)
+    if len(preview) == 0:
+        return
+
+    if options.write:
+        count = update.apply(dbstore)
+        dbstore.commit()
+        print("%d %s rows updated." % (count, options.table))
+    else:
+        print("Currently running in dry-run mode. If you are happy with the change, pass the '-w' flag to this script to store the changes into the database.")
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
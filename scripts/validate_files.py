@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+""" Check that the files registered in the database exist, are not empty and, optionally,
+    that they open and contain the recorded number of entries. Interrupted runs resume
+    from the checkpoint (with the same samples and options); the report can be included in the dbAnalysis output (--files-report). """
+
+import sys
+import json
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi.splitting import resolve_samples
+from cp3_llbb.SAMADhi.validation import FileValidator
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Validate the File entries of the database, in parallel and resumably.')
+
+    parser.add_argument('-s', '--samples', nargs='+', dest='samples', help='Only check these samples (names, ids or name patterns)')
+    parser.add_argument('-j', '--workers', type=int, default=16, dest='workers', help='Number of parallel checks')
+    parser.add_argument('--open', dest='open_files', action='store_true', help='Also open the files with ROOT and compare the number of entries to the recorded one (slower)')
+    parser.add_argument('--checkpoint', default='validate_files.checkpoint', dest='checkpoint', help='Checkpoint file, to resume an interrupted validation')
+    parser.add_argument('--restart', dest='restart', action='store_true', help='Ignore the checkpoint and start from the first file')
+    parser.add_argument('--chunk-size', type=int, default=1000, dest='chunk_size', help='Number of files per checkpoint')
+    parser.add_argument('-o', '--output', default='FilesValidationReport.json', dest='output', help='Output JSON report')
+    parser.add_argument('-d', '--database', dest='database', help='Database URI (e.g. sqlite:/path/to/file). By default, the credentials in ~/.samadhi are used.')
+
+    return parser.parse_args()
+
+def main():
+    options = get_options()
+    dbstore = DbStore(uri=options.database)
+    sample_ids = None
+    if options.samples:
+        try:
+            sample_ids = resolve_samples(dbstore, options.samples)
+        except KeyError as error:
+            print(error.args[0])
+            sys.exit(1)
+    validator = FileValidator(dbstore, options.checkpoint, sample_ids=sample_ids, workers=options.workers,
+                              open_files=options.open_files, chunk_size=options.chunk_size)
+    if options.restart:
+        validator.reset()
+    state = validator.run()
+    summary = validator.summary(state)
+    with open(options.output, "w") as outfile:
+        json.dump(summary, outfile, indent=2)
+
+    print("%d files checked in %.0f s: %s" % (summary["checked"], summary["elapsed_s"],
+          ", ".join("%d %s" % (n, status) for status, n in sorted(summary["counts"].items()))))
+    for sample in summary["samples"]:
+        print("Sample #%s %s: %s" % (sample["sample_id"], sample["name"],
+              ", ".join("%d %s" % (n, status) for status, n in sorted(sample["problems"].items()))))
+    print("Report written to %s" % options.output)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()